@@ -0,0 +1,89 @@
+"""
+Проверка и просмотр словаря брендов (dict_brand.csv) и его скомпилированного артефакта.
+
+    python data/utilities/brand_dict_tool.py check   # замечания к словарю; код выхода 1, если они есть
+    python data/utilities/brand_dict_tool.py show    # сводка по словарю и состояние артефакта
+    python data/utilities/brand_dict_tool.py show --brand danfoss
+    python data/utilities/brand_dict_tool.py build   # пересобрать артефакт data/cache/brand_dict.pickle
+"""
+import argparse
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(REPO_ROOT / "pipeline"))
+from utils.brand_index import (
+    BRAND_DICT_CACHE_PATH, BRAND_DICT_PATH, FUZZY_MIN_ALIAS_LEN, BrandDictionary, brand_dictionary_key,
+    load_brand_dictionary, read_brand_artifact, read_brand_entries, save_brand_artifact, validate_brand_entries,
+)
+
+ISSUE_TITLES = {
+    'duplicates': 'Повторяющиеся алиасы',
+    'exact_and_fuzzy': 'Алиасы и в точном, и в нечетком поиске (разные строки)',
+    'short_fuzzy': f'Алиасы нечеткого поиска короче {FUZZY_MIN_ALIAS_LEN} символов (не используются)',
+    'unknown_match_type': 'Неизвестный match_type (алиас не используется)',
+}
+
+def check(path: str) -> int:
+    issues = validate_brand_entries(read_brand_entries(path))
+    total = 0
+    for name, messages in issues.items():
+        if not messages:
+            continue
+        total += len(messages)
+        print(f"{ISSUE_TITLES[name]}: {len(messages)}")
+        for message in messages:
+            print(f"  {message}")
+    print(f"Замечаний: {total}" if total else "Замечаний нет")
+    return 1 if total else 0
+
+def show(path: str, cache_path: str, brand: str | None) -> int:
+    key = brand_dictionary_key(path)
+    started = time.perf_counter()
+    cached = read_brand_artifact(cache_path, key)
+    if cached is None:
+        print(f"Артефакт {cache_path}: нет или устарел (пересоберётся при запуске step4 или командой build)")
+        dictionary = BrandDictionary.from_csv(path)
+    else:
+        print(f"Артефакт {cache_path}: актуален, загрузка {1000 * (time.perf_counter() - started):.1f} мс")
+        dictionary = cached
+
+    aliases = defaultdict(lambda: {'exact': [], 'fuzzy': []})
+    for alias, name in dictionary.exact_aliases.items():
+        aliases[name]['exact'].append(alias)
+    for alias, name in dictionary.fuzzy_aliases.items():
+        aliases[name]['fuzzy'].append(alias)
+    print(f"Брендов: {len(aliases)}; алиасов: точных {len(dictionary.exact_aliases)}, "
+          f"нечетких {len(dictionary.fuzzy_aliases)} (в поиске {len(dictionary.fuzzy_matcher.keys)})")
+
+    names = [brand.strip().lower()] if brand else sorted(aliases)
+    for name in names:
+        if name not in aliases:
+            print(f"Бренд '{name}' не найден")
+            return 1
+        print(f"  {name}: exact [{', '.join(aliases[name]['exact'])}]; fuzzy [{', '.join(aliases[name]['fuzzy'])}]")
+    return 0
+
+def build(path: str, cache_path: str) -> int:
+    started = time.perf_counter()
+    save_brand_artifact(BrandDictionary.from_csv(path), cache_path, brand_dictionary_key(path))
+    print(f"Артефакт собран: {cache_path} ({1000 * (time.perf_counter() - started):.1f} мс)")
+    started = time.perf_counter()
+    load_brand_dictionary(path, cache_path)
+    print(f"Загрузка: {1000 * (time.perf_counter() - started):.1f} мс")
+    return 0
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Проверка и просмотр словаря брендов')
+    parser.add_argument('command', nargs='?', default='check', choices=['check', 'show', 'build'])
+    parser.add_argument('--dict', default=str(REPO_ROOT / BRAND_DICT_PATH), help='CSV словаря брендов')
+    parser.add_argument('--cache', default=str(REPO_ROOT / BRAND_DICT_CACHE_PATH), help='путь артефакта')
+    parser.add_argument('--brand', help='show: алиасы одного бренда')
+    args = parser.parse_args()
+    if args.command == 'check':
+        sys.exit(check(args.dict))
+    if args.command == 'show':
+        sys.exit(show(args.dict, args.cache, args.brand))
+    sys.exit(build(args.dict, args.cache))
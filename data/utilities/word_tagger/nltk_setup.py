@@ -1,2 +1,17 @@
+# Обновляет офлайн-копию русских стоп-слов NLTK (data/utilities/stopwords_ru.txt).
+# Нужен только при смене версии корпуса: step2 и word_tagger читают файл без сети.
 import nltk
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[3]
+STOPWORDS_FILE = REPO_ROOT / "data" / "utilities" / "stopwords_ru.txt"
+
 nltk.download('stopwords')
+from nltk.corpus import stopwords
+
+header = [
+    "# Русские стоп-слова NLTK (corpora/stopwords/russian), офлайн-копия для step2 и word_tagger.",
+    "# Обновить: python data/utilities/word_tagger/nltk_setup.py",
+]
+STOPWORDS_FILE.write_text("\n".join(header + stopwords.words("russian")) + "\n", encoding="utf-8")
+print(f"Сохранено: {STOPWORDS_FILE}")
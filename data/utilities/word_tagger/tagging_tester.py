@@ -1,14 +1,20 @@
 import pandas as pd
 import re
 import pymorphy2
-from nltk.corpus import stopwords
-from nltk import download
 from collections import defaultdict
+import sys
+from pathlib import Path
+
+# Общий с pipeline/step2_tagging.py кэш лемм (data/cache/lemmas.sqlite)
+REPO_ROOT = Path(__file__).resolve().parents[3]
+sys.path.insert(0, str(REPO_ROOT / "pipeline"))
+from utils.lemma_cache import LEMMA_CACHE_PATH, LemmaCache
+from utils.stopwords import STOPWORDS_PATH, load_stopwords
 
 # Загрузка ресурсов
 morph = pymorphy2.MorphAnalyzer()
-download('stopwords')
-stop_words = set(stopwords.words("russian"))
+lemma_cache = LemmaCache(morph, path=str(REPO_ROOT / LEMMA_CACHE_PATH))
+stop_words = load_stopwords(str(REPO_ROOT / STOPWORDS_PATH))
 
 # Загрузка списка слов
 tags_df = pd.read_csv("tagged_words_temp.csv")
@@ -24,7 +30,7 @@ def extract_lemmas(text):
     lemmas = []
     for token in tokens:
         if token not in stop_words and len(token) > 2:
-            lemma = morph.parse(token)[0].normal_form
+            lemma = lemma_cache.lemma(token)
             lemmas.append(lemma)
     return lemmas
 
@@ -68,5 +74,8 @@ df["reason"] = reasons
 df["matched_approved"] = approved_matches
 df["matched_rejected"] = rejected_matches
 
+lemma_cache.close()
+print(lemma_cache.stats_line())
+
 df.to_excel("tagging_results.xlsx", index=False)
 print("Готово: tagging_results.xlsx")
@@ -1,17 +1,24 @@
 import streamlit as st
 import pandas as pd
-import nltk
 import pymorphy2
-from nltk.corpus import stopwords
 from collections import Counter, defaultdict
 import re
 import os
+import sys
+from pathlib import Path
 
-# Загрузка стоп-слов
-stop_words = set(stopwords.words("russian"))
+# Общий с pipeline/step2_tagging.py кэш лемм (data/cache/lemmas.sqlite)
+REPO_ROOT = Path(__file__).resolve().parents[3]
+sys.path.insert(0, str(REPO_ROOT / "pipeline"))
+from utils.lemma_cache import LEMMA_CACHE_PATH, LemmaCache
+from utils.stopwords import STOPWORDS_PATH, load_stopwords
+
+# Загрузка стоп-слов (офлайн-копия NLTK, общая со step2)
+stop_words = load_stopwords(str(REPO_ROOT / STOPWORDS_PATH))
 
 # Морфоанализатор
 morph = pymorphy2.MorphAnalyzer()
+lemma_cache = LemmaCache(morph, path=str(REPO_ROOT / LEMMA_CACHE_PATH))
 
 
 @st.cache_data
@@ -28,10 +35,11 @@ def preprocess_words(product_names):
         tokens = re.findall(r"\b[а-яА-Яa-zA-Z]+\b", name.lower())
         for token in tokens:
             if token not in stop_words and len(token) > 2:
-                lemma = morph.parse(token)[0].normal_form
+                lemma = lemma_cache.lemma(token)
                 words.append(lemma)
                 if len(context_dict[lemma]) < 3:
                     context_dict[lemma].append(name)
+    lemma_cache.flush()
     return Counter(words), context_dict
 
 
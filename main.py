@@ -1,27 +1,152 @@
-from pipeline import step1_preprocess, step2_tagging, step3_enrichment, step4_brand_extraction
+# main.py — оркестратор шагов пайплайна
+#
+# Шаг перезапускается, только если изменился его отпечаток (fingerprint):
+# хэш содержимого входов (стадия предыдущего шага / сырые файлы), справочников
+# и кода шага. Отпечатки хранятся в манифесте data/stage_manifest.json.
+# Запуск из корня репозитория:
+#   python main.py            # пересобрать только изменившиеся шаги
+#   python main.py --force    # пересобрать всё
+#   python main.py --delta    # построчные шаги считают только новые строки (см. utils/delta_utils.py)
+
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import sys
+from datetime import datetime
 from pathlib import Path
 
-def main():
-    raw_path = Path("data/raw/input.xlsx")
-    stage1_path = Path("data/stage1_cleaned/cleaned.parquet")
-    stage2_path = Path("data/stage2_enriched/enriched.parquet")
-    stage3_path = Path("data/stage3_tagged/tagged.parquet")
-    final_path = Path("data/final/output.xlsx")
+sys.path.insert(0, str(Path(__file__).parent / 'pipeline'))
+
+from utils.delta_utils import file_digest
+from utils.logging_utils import setup_logger
+
+logger = setup_logger()
+
+PIPELINE_DIR = Path('pipeline')
+MANIFEST_PATH = Path('data/stage_manifest.json')
+UTILS_DIR = PIPELINE_DIR / 'utils'
+
+# --- Шаги: код, входы (стадии и справочники), выход ---
+# utils — модули pipeline/utils, которые шаг импортирует (в том числе через другие утилиты);
+# правка утилиты пересобирает только шаги, которые от неё зависят
+STAGES = [
+    {
+        'name': 'step1',
+        'script': PIPELINE_DIR / 'step1_preprocess.py',
+        'inputs': [
+            'data/raw/EAU.xlsx',
+            'data/raw/atlas_merge_state/merged_files.json',  # меняется при каждом объединении Atlas (step0)
+            'data/raw/rf_world_exp_2025.xlsx',
+            'data/utilities/countries.csv',
+        ],
+        'output': 'data/st1_cleaned/st1.parquet',
+        'utils': ['countries', 'delta_utils', 'io', 'logging_utils', 'normalization_utils'],
+    },
+    {
+        'name': 'step2',
+        'script': PIPELINE_DIR / 'step2_tagging.py',
+        'inputs': [
+            'data/st1_cleaned/st1.parquet',
+            'data/utilities/word_tagger/tagged_words.csv',
+            'data/utilities/stopwords_ru.txt',
+        ],
+        'output': 'data/st2_tagged/st2.parquet',
+        'utils': ['delta_utils', 'io', 'lemma_cache', 'logging_utils', 'normalization_utils', 'stopwords', 'term_matcher'],
+    },
+    {
+        'name': 'step3',
+        'script': PIPELINE_DIR / 'step3_enrichment.py',
+        'inputs': [
+            'data/st2_tagged/st2.parquet',
+            'data/utilities/blacklist_companies.csv',
+            'data/utilities/countries.csv',
+        ],
+        'output': 'data/st3_enriched/st3.parquet',
+        'utils': ['countries', 'delta_utils', 'entity_resolution', 'io', 'logging_utils', 'normalization_utils', 'price_anomalies'],
+    },
+    {
+        'name': 'step4',
+        'script': PIPELINE_DIR / 'step4_brand_extraction.py',
+        'inputs': ['data/st3_enriched/st3.parquet', 'data/utilities/dict_brand.csv'],
+        'output': 'data/st4_branded/st4.parquet',
+        'utils': ['brand_index', 'delta_utils', 'io', 'logging_utils'],
+    },
+    {
+        'name': 'step5',
+        'script': PIPELINE_DIR / 'step5_attribute_extraction.py',
+        'inputs': ['data/st4_branded/st4.parquet'],
+        'output': 'data/st5_attributes/st5.parquet',
+        'utils': ['delta_utils', 'io', 'logging_utils'],
+    },
+    {
+        'name': 'step6',
+        'script': PIPELINE_DIR / 'step6_datamart.py',
+        'inputs': ['data/st5_attributes/st5.parquet'],
+        'output': 'data/st6_datamart/st6.xlsx',
+        'utils': ['io', 'logging_utils'],
+    },
+]
+
+# ---------------------------- ФУНКЦИИ ---------------------------- #
+
+def stage_fingerprint(stage: dict) -> str:
+    """Отпечаток шага: входы + код шага + утилиты, от которых он зависит."""
+    h = hashlib.sha256()
+    utils_code = [UTILS_DIR / f'{module}.py' for module in stage['utils']]
+    for path in [*stage['inputs'], stage['script'], *utils_code]:
+        h.update(str(path).encode())
+        h.update(file_digest(path).encode() if Path(path).exists() else b'<missing>')
+    return h.hexdigest()
+
+def load_manifest() -> dict:
+    if MANIFEST_PATH.exists():
+        return json.loads(MANIFEST_PATH.read_text(encoding='utf-8'))
+    return {}
+
+def save_manifest(manifest: dict):
+    MANIFEST_PATH.parent.mkdir(parents=True, exist_ok=True)
+    MANIFEST_PATH.write_text(json.dumps(manifest, ensure_ascii=False, indent=2), encoding='utf-8')
+
+def run_stage(stage: dict, delta: bool = False):
+    """Запуск шага отдельным процессом (шаги импортируют `utils` из pipeline/)."""
+    output = Path(stage['output'])
+    mtime_before = output.stat().st_mtime if output.exists() else None
+    env = {**os.environ, 'PYTHONPATH': str(PIPELINE_DIR), 'CUSTBASE_DELTA_MODE': '1' if delta else '0'}
+    subprocess.run([sys.executable, str(stage['script'])], env=env, check=True)
+    # шаги логируют ошибки и завершаются с кодом 0 — проверяем, что выход действительно обновлён
+    if not output.exists() or output.stat().st_mtime == mtime_before:
+        raise RuntimeError(f"{stage['name']}: выход {output} не обновлён")
+
+# ------------------------- ОСНОВНОЙ БЛОК -------------------------- #
 
-    # Step 1: Preprocess raw input
-    if not stage1_path.exists():
-        step1_preprocess.run(raw_path, stage1_path)
+def main(force: bool = False, delta: bool = False):
+    start_time = datetime.now()
+    manifest = load_manifest()
 
-    # Step 2: Enrichment from external sources
-    if not stage2_path.exists():
-        step3_enrichment.run(stage1_path, stage2_path)
+    for stage in STAGES:
+        name = stage['name']
+        fingerprint = stage_fingerprint(stage)
+        cached = manifest.get(name, {})
+        if not force and cached.get('fingerprint') == fingerprint and Path(stage['output']).exists():
+            logger.info(f'⏭️ {name}: входы не изменились, пропуск')
+            continue
 
-    # Step 3: Tagging with fuzzy logic
-    if not stage3_path.exists():
-        step2_tagging.run(stage2_path, stage3_path)
+        logger.info(f'▶️ {name}: запуск')
+        run_stage(stage, delta)
+        manifest[name] = {
+            'fingerprint': fingerprint,
+            'output': stage['output'],
+            'updated': datetime.now().isoformat(timespec='seconds'),
+        }
+        save_manifest(manifest)
 
-    # Step 4: Final export
-    step4_brand_extraction.run(stage3_path, final_path)
+    logger.info(f'🕒 Продолжительность: {datetime.now() - start_time}')
 
-if __name__ == "__main__":
-    main()
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Пайплайн custbase с инкрементальной пересборкой шагов')
+    parser.add_argument('--force', action='store_true', help='пересобрать все шаги')
+    parser.add_argument('--delta', action='store_true', help='инкрементальный режим: считать только новые строки')
+    args = parser.parse_args()
+    main(force=args.force, delta=args.delta)
@@ -1,38 +1,284 @@
-import pandas as pd
-import glob
+# steps/step0_merger_atlas.py
+#
+# Инкрементальное объединение выгрузок Atlas из папки в одно хранилище Parquet.
+# Файлы читаются потоково; дубликаты (по всем колонкам, кроме "NO" и source_file)
+# отсекаются по сохраняемому набору хэшей строк, поэтому новый файл в папке
+# обрабатывается за время, пропорциональное только его размеру.
+# Уже объединённые файлы запоминаются в merged_files.json и повторно не читаются.
+
+from datetime import datetime
+import json
 import os
 
-# Папка с файлами
-folder_path = r"C:\Users\424\Documents\custbase\data\raw\atlas"  
-file_list = glob.glob(os.path.join(folder_path, "*.xlsx"))
+import numpy as np
+import pandas as pd
+
+from utils.delta_utils import file_digest
+from utils.io import iter_excel_batches, iter_parquet_batches, save_to_parquet_file
+from utils.logging_utils import setup_logger
+
+logger = setup_logger()
+
+# --- Пути ---
+FOLDER_PATH = "data/raw/atlas"                       # исходные выгрузки *.xlsx
+OUTPUT_DIR = "data/raw/atlas.parquet"                # дедуплицированные строки (читает step1)
+DUPLICATES_DIR = "data/raw/atlas_duplicates.parquet"  # лог отброшенных дубликатов
+STATE_DIR = "data/raw/atlas_merge_state"
+HASHES_DIR = os.path.join(STATE_DIR, "row_hashes")   # хэши строк хранилища по файлам: <seq>.npy
+MERGED_FILES_PATH = os.path.join(STATE_DIR, "merged_files.json")
+EXCEL_EXPORT_PATH = None  # например, "data/raw/atlas.xlsx" — выгрузить листы "Данные"/"Дубликаты"
+
+BATCH_SIZE = 50_000
+SERVICE_COLUMNS = ["NO", "source_file"]  # не участвуют в сравнении строк
+HASH_COLUMN = "row_hash"
+
+# ---------------------------- ФУНКЦИИ ---------------------------- #
+
+def load_merged() -> dict:
+    """Журнал объединённых файлов: {имя файла: {digest, seq, rows, duplicates}}."""
+    if not os.path.exists(MERGED_FILES_PATH):
+        return {}
+    with open(MERGED_FILES_PATH, encoding='utf-8') as f:
+        return json.load(f)
+
+def save_merged(merged: dict):
+    os.makedirs(STATE_DIR, exist_ok=True)
+    with open(MERGED_FILES_PATH, 'w', encoding='utf-8') as f:
+        json.dump(merged, f, ensure_ascii=False, indent=2)
+
+def _hashes_path(seq: int) -> str:
+    return os.path.join(HASHES_DIR, f"{seq:06d}.npy")
+
+def load_file_hashes(seq: int) -> np.ndarray:
+    """Хэши строк, добавленных в хранилище файлом с номером seq."""
+    path = _hashes_path(seq)
+    return np.load(path) if os.path.exists(path) else np.empty(0, dtype=np.uint64)
+
+def save_file_hashes(seq: int, hashes: np.ndarray):
+    os.makedirs(HASHES_DIR, exist_ok=True)
+    np.save(_hashes_path(seq), hashes.astype(np.uint64))
+
+def load_known(merged: dict) -> np.ndarray:
+    """Отсортированный массив хэшей всех строк хранилища (собирается один раз за запуск)."""
+    parts = [load_file_hashes(entry["seq"]) for entry in merged.values()]
+    return np.sort(np.concatenate(parts)) if parts else np.empty(0, dtype=np.uint64)
+
+def _cell_key(value) -> str:
+    """
+    Каноническая строка значения ячейки: не зависит от типа, который pandas выбрал для
+    колонки батча (1 в int64-батче и 1.0 в float64-батче, где в колонке есть пропуск).
+    """
+    if value is None or value is pd.NaT or (isinstance(value, (float, np.floating)) and np.isnan(value)):
+        return '\x00'
+    if isinstance(value, (bool, np.bool_)):
+        return str(bool(value))
+    if isinstance(value, (int, np.integer)):
+        return str(int(value))
+    if isinstance(value, (float, np.floating)):
+        return str(int(value)) if float(value).is_integer() else repr(float(value))
+    if isinstance(value, (datetime, pd.Timestamp)):
+        return pd.Timestamp(value).isoformat()
+    return str(value)
+
+def row_hashes(df: pd.DataFrame) -> np.ndarray:
+    """
+    Хэш строки по всем колонкам, кроме служебных (порядок колонок не влияет).
+    Ячейки приводятся к канонической строке (_cell_key), поэтому одинаковые строки
+    из разных батчей и файлов получают одинаковый хэш.
+    """
+    cols = sorted(c for c in df.columns if c not in SERVICE_COLUMNS + [HASH_COLUMN])
+    keys = pd.DataFrame({c: df[c].astype(object).map(_cell_key) for c in cols}, index=df.index)
+    return pd.util.hash_pandas_object(keys, index=False).to_numpy()
+
+def _in_sorted(values: np.ndarray, sorted_values: np.ndarray) -> np.ndarray:
+    """values ∈ sorted_values бинарным поиском по отсортированному массиву."""
+    if not len(sorted_values):
+        return np.zeros(len(values), dtype=bool)
+    pos = np.searchsorted(sorted_values, values).clip(max=len(sorted_values) - 1)
+    return sorted_values[pos] == values
+
+def _part_name(seq: int, batch_no: int) -> str:
+    return f"{seq:06d}_{batch_no:05d}.parquet"
+
+def _part_seq(name: str) -> int | None:
+    prefix = name.split("_", 1)[0].split(".", 1)[0]
+    return int(prefix) if prefix.isdigit() else None
+
+def _remove_parts(seq: int):
+    """Удаляет части и хэши файла с номером seq (незавершённый запуск или прежняя версия файла)."""
+    for folder in (OUTPUT_DIR, DUPLICATES_DIR):
+        if os.path.isdir(folder):
+            for name in os.listdir(folder):
+                if name.startswith(f"{seq:06d}_"):
+                    os.remove(os.path.join(folder, name))
+    if os.path.exists(_hashes_path(seq)):
+        os.remove(_hashes_path(seq))
+
+def _remove_orphans(merged: dict):
+    """Удаляет части, не записанные в журнал: их оставил прерванный запуск."""
+    known_seqs = {entry["seq"] for entry in merged.values()}
+    orphans = set()
+    for folder in (OUTPUT_DIR, DUPLICATES_DIR, HASHES_DIR):
+        if os.path.isdir(folder):
+            orphans.update(_part_seq(name) for name in os.listdir(folder))
+    for seq in orphans - known_seqs - {None}:
+        _remove_parts(seq)
+
+def readmit_duplicates(removed: np.ndarray, merged: dict) -> int:
+    """
+    Возвращает в хранилище строки других файлов, которые были отброшены как дубликаты
+    строк удалённой версии файла (хэши removed): первое вхождение каждого хэша в логе
+    дубликатов переходит в данные своего файла, остальные остаются в логе.
+
+    Returns:
+        число возвращённых строк
+    """
+    if not len(removed) or not os.path.isdir(DUPLICATES_DIR):
+        return 0
+    removed = np.unique(removed)
+    by_seq = {entry["seq"]: entry for entry in merged.values()}
+    readmitted = set()
+    for name in sorted(os.listdir(DUPLICATES_DIR)):
+        path = os.path.join(DUPLICATES_DIR, name)
+        dups = pd.read_parquet(path)
+        hashes = dups[HASH_COLUMN].to_numpy(dtype=np.uint64)
+        candidate = _in_sorted(hashes, removed)
+        if not candidate.any():
+            continue
+        is_first = (
+            candidate
+            & ~pd.Series(hashes).duplicated().to_numpy()
+            & np.fromiter((h not in readmitted for h in hashes.tolist()), dtype=bool, count=len(hashes))
+        )
+        if not is_first.any():
+            continue
+        restored = dups[is_first]
+        data_path = os.path.join(OUTPUT_DIR, name)
+        if os.path.exists(data_path):
+            restored = pd.concat([pd.read_parquet(data_path), restored], ignore_index=True)
+        os.makedirs(OUTPUT_DIR, exist_ok=True)
+        save_to_parquet_file(restored, data_path)
+        if is_first.all():
+            os.remove(path)
+        else:
+            save_to_parquet_file(dups[~is_first], path)
+
+        seq = _part_seq(name)
+        save_file_hashes(seq, np.concatenate([load_file_hashes(seq), hashes[is_first]]))
+        readmitted.update(hashes[is_first].tolist())
+        if seq in by_seq:
+            by_seq[seq]["rows"] += int(is_first.sum())
+            by_seq[seq]["duplicates"] -= int(is_first.sum())
+    return len(readmitted)
+
+def merge_file(path: str, seq: int, known: np.ndarray, seen: set) -> tuple[np.ndarray, int, int]:
+    """
+    Потоково читает один файл Atlas, отбрасывает строки, чьи хэши уже есть в known
+    (отсортированный массив хранилища на начало запуска) или в seen (хэши, добавленные
+    в этом запуске, пополняется по ходу), и пишет батчи данных и дубликатов в Parquet-части.
+    Проверка батча — бинарный поиск по known и поиск в множестве: работа пропорциональна
+    размеру файла.
+
+    Returns:
+        (хэши новых строк, число новых строк, число дубликатов)
+    """
+    _remove_parts(seq)
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    os.makedirs(DUPLICATES_DIR, exist_ok=True)
+
+    file_hashes = []
+    rows = duplicates = 0
+    for batch_no, df in enumerate(iter_excel_batches(path, batch_size=BATCH_SIZE, skiprows=1)):
+        df['source_file'] = os.path.basename(path)
+
+        if "EXPORTER COUNTRY" not in df.columns:
+            raise ValueError("Столбец 'EXPORTER COUNTRY' не найден в данных")
+        df = df[df["EXPORTER COUNTRY"] != "Russian Federation"].reset_index(drop=True)
+        if df.empty:
+            continue
+
+        hashes = row_hashes(df)
+        is_duplicate = (
+            _in_sorted(hashes, known)
+            | np.fromiter((h in seen for h in hashes.tolist()), dtype=bool, count=len(hashes))
+            | pd.Series(hashes).duplicated().to_numpy()
+        )
+        df[HASH_COLUMN] = hashes
+
+        unique_df = df[~is_duplicate]
+        if not unique_df.empty:
+            save_to_parquet_file(unique_df, os.path.join(OUTPUT_DIR, _part_name(seq, batch_no)))
+            file_hashes.append(hashes[~is_duplicate])
+            seen.update(hashes[~is_duplicate].tolist())
+        if is_duplicate.any():
+            save_to_parquet_file(df[is_duplicate], os.path.join(DUPLICATES_DIR, _part_name(seq, batch_no)))
+
+        rows += len(unique_df)
+        duplicates += int(is_duplicate.sum())
+
+    new_hashes = np.concatenate(file_hashes) if file_hashes else np.empty(0, dtype=np.uint64)
+    return new_hashes, rows, duplicates
+
+def export_excel(path: str):
+    """
+    Выгрузка хранилища в Excel (листы "Данные" и "Дубликаты"), как раньше.
+    Первые вхождения продублированных строк находятся по row_hash.
+    """
+    data = pd.concat(iter_parquet_batches(OUTPUT_DIR, BATCH_SIZE), ignore_index=True)
+    dups = pd.concat(iter_parquet_batches(DUPLICATES_DIR, BATCH_SIZE), ignore_index=True) \
+        if os.path.isdir(DUPLICATES_DIR) and os.listdir(DUPLICATES_DIR) else data.iloc[0:0]
+    # Лог дубликатов включает все повторы, не только те, которые удаляются
+    dups = pd.concat([data[data[HASH_COLUMN].isin(dups[HASH_COLUMN])], dups], ignore_index=True)
+
+    with pd.ExcelWriter(path, engine="openpyxl") as writer:
+        data.drop(columns=HASH_COLUMN).to_excel(writer, sheet_name="Данные", index=False)
+        dups.drop(columns=HASH_COLUMN).to_excel(writer, sheet_name="Дубликаты", index=False)
 
-combined_df_list = []
+# ------------------------- ОСНОВНОЙ БЛОК -------------------------- #
 
-for file in file_list:
-    # Чтение первого листа, пропуская первую строку
-    df = pd.read_excel(file, sheet_name=0, skiprows=1)
-    df['source_file'] = os.path.basename(file)  
-    combined_df_list.append(df)
+def main():
+    start_time = datetime.now()
+    logger.info('--- Step 0: Объединение файлов Atlas ---')
 
-# Объединение всех датафреймов
-combined_df = pd.concat(combined_df_list, ignore_index=True)
+    merged = load_merged()
+    _remove_orphans(merged)
+    digests = {
+        name: file_digest(os.path.join(FOLDER_PATH, name))
+        for name in sorted(os.listdir(FOLDER_PATH)) if name.endswith(".xlsx")
+    }
+    pending = [name for name, digest in digests.items() if merged.get(name, {}).get("digest") != digest]
 
-if "EXPORTER COUNTRY" in combined_df.columns:
-    combined_df = combined_df[combined_df["EXPORTER COUNTRY"] != "Russian Federation"]
-else:
-    raise ValueError("Столбец 'EXPORTER COUNTRY' не найден в данных")
+    # прежние версии изменённых файлов уходят из хранилища целиком; строки других файлов,
+    # отброшенные как их дубликаты, возвращаются из лога дубликатов
+    changed = [name for name in pending if name in merged]
+    if changed:
+        removed = []
+        for name in changed:
+            logger.info(f"Файл изменился, повторное объединение: {name}")
+            seq = merged.pop(name)["seq"]
+            removed.append(load_file_hashes(seq))
+            _remove_parts(seq)
+        readmitted = readmit_duplicates(np.concatenate(removed), merged)
+        save_merged(merged)
+        if readmitted:
+            logger.info(f"Возвращено из лога дубликатов строк: {readmitted}")
 
-# Удаление дубликатов по всем столбцам, кроме "NO"
-cols_to_check = [col for col in combined_df.columns if col != "NO"]
-duplicated_mask = combined_df.duplicated(subset=cols_to_check, keep=False)
+    known = load_known(merged)
+    seen = set()
+    for name in pending:
+        seq = max((entry["seq"] for entry in merged.values()), default=-1) + 1
+        new_hashes, rows, duplicates = merge_file(os.path.join(FOLDER_PATH, name), seq, known, seen)
+        save_file_hashes(seq, new_hashes)
+        merged[name] = {"digest": digests[name], "seq": seq, "rows": rows, "duplicates": duplicates}
+        logger.info(f"{name}: добавлено строк {rows}, дубликатов {duplicates}")
+    save_merged(merged)
 
-# Лог дубликатов (включает все повторы, не только те, которые удаляются)
-duplicates_df = combined_df[duplicated_mask].copy()
+    logger.info(f"Всего строк в хранилище: {len(known) + len(seen)}")
+    if EXCEL_EXPORT_PATH:
+        export_excel(EXCEL_EXPORT_PATH)
+        logger.info(f"📁 Сохранено: {EXCEL_EXPORT_PATH}")
 
-# Удаляем дубликаты, оставляя первое вхождение
-deduplicated_df = combined_df.drop_duplicates(subset=cols_to_check, keep='first')
+    logger.info(f'Продолжительность: {datetime.now() - start_time}')
 
-# Сохраняем результат в Excel с двумя листами
-with pd.ExcelWriter(r'C:\Users\424\Documents\custbase\data\raw\atlas.xlsx', engine="openpyxl") as writer:
-    deduplicated_df.to_excel(writer, sheet_name="Данные", index=False)
-    duplicates_df.to_excel(writer, sheet_name="Дубликаты", index=False)
\ No newline at end of file
+if __name__ == '__main__':
+    main()
@@ -1,21 +1,43 @@
 # steps/step1_preprocess.py
 
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 import os
 import pandas as pd
+import pyarrow as pa
 
-from utils.io import read_excel_file, save_to_excel_file
+from utils import countries
+from utils.countries import COUNTRIES_PATH, COUNTRY_COLUMNS, unify_country_names
+from utils.io import (
+    ParquetStageWriter, iter_parquet_batches, iter_source_batches, read_stage, save_to_excel_file
+)
+from utils.delta_utils import ROW_KEY, VERSION_KEY, compute_row_keys, load_previous, stage_version
 from utils.logging_utils import setup_logger
-from utils.normalization_utils import normalize_company
+from utils import normalization_utils
+from utils.normalization_utils import CompanyNormalizer
 
 logger = setup_logger()
 
 INPUT_PATHS = {
     "eau": "data/raw/EAU.xlsx",
-    "atlas": "data/raw/atlas.xlsx",
+    "atlas": "data/raw/atlas.parquet",  # папка с Parquet-частями, собранная step0_merger_atlas
     "rf_world": "data/raw/rf_world_exp_2025.xlsx"
 }
-OUTPUT_PATH = "data/st1_cleaned/st1.xlsx"
+OUTPUT_PATH = "data/st1_cleaned/st1.parquet"
+SAVE_EXCEL_COPY = False  # дополнительно сохранить st1.xlsx для ручной проверки
+PARTS_DIR = "data/st1_cleaned/parts"  # потоковые выгрузки отдельных источников
+BATCH_SIZE = 50_000  # строк в батче при потоковом чтении/записи
+INGEST_WORKERS = 3  # процессов для параллельного чтения источников; 1 — последовательно
+COMPANY_CACHE_PATH = "data/cache/company_names.parquet"  # кэш нормализации компаний между запусками
+
+# Порядок склейки источников — определяет decl_id
+SOURCE_ORDER = ["eau", "atlas", "rf_world"]
+SOURCE_NAMES = {"rf_world": "РФ-Мир", "eau": "ЕАЭС", "atlas": "Атлас"}
+
+DATE_COLUMNS = ['decl_date']
+NUMERIC_COLUMNS = ['prod_netw', 'prod_price_statFOB', 'prod_quant']
+COMPANY_COLUMNS = ['exporter_name', 'importer_name']
+COUNTRY_TYPE = pa.dictionary(pa.int32(), pa.string())
 
 COLUMNS_MAPS = {
     "rf_world": {
@@ -79,43 +101,160 @@ COLUMNS_MAPS = {
     }
 }
 
-def process_source(name, path, columns_map, sheet_name):
-    logger.info(f'Читается источник: {name}')
-    df = read_excel_file(path, sheet_name)
-    if 'decl_date' in columns_map.values():
-        date_column = next(k for k, v in columns_map.items() if v == 'decl_date')
-        df[date_column] = pd.to_datetime(df[date_column], errors='coerce', dayfirst=True)
-    df = df[list(columns_map.keys())].rename(columns=columns_map)
-    df.insert(0, 'source', os.path.basename(path))
-    logger.info(f'{name}: {df.shape}')
+# --- Схема стадии ---
+def _column_type(col: str) -> pa.DataType:
+    if col in DATE_COLUMNS:
+        return pa.timestamp('ns')
+    if col in NUMERIC_COLUMNS:
+        return pa.float64()
+    return pa.string()
+
+def source_schema(columns_map: dict) -> pa.Schema:
+    """Схема выгрузки одного источника: source + переименованные колонки."""
+    return pa.schema([('source', pa.string())] + [(c, _column_type(c)) for c in columns_map.values()])
+
+def stage1_schema() -> pa.Schema:
+    """Схема st1: объединение колонок источников в порядке SOURCE_ORDER + поля нормализации."""
+    columns = []
+    for key in SOURCE_ORDER:
+        columns += [c for c in COLUMNS_MAPS[key].values() if c not in columns]
+    fields = [('decl_id', pa.int64()), (ROW_KEY, pa.uint64()), ('source', pa.string())]
+    # страны унифицируются при склейке и хранятся словарём (category в pandas)
+    fields += [(c, COUNTRY_TYPE if c in COUNTRY_COLUMNS else _column_type(c)) for c in columns]
+    for col in COMPANY_COLUMNS:
+        fields += [(f'{col}_orig', pa.string()), (f'{col}_opf', pa.string())]
+    return pa.schema(fields)
+
+def _to_text(value):
+    if value is None or (isinstance(value, float) and pd.isna(value)):
+        return None
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+def coerce_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """Приводит колонки батча к типам схемы (даты, числа, строки)."""
+    for col in df.columns:
+        if col in DATE_COLUMNS:
+            df[col] = pd.to_datetime(df[col], errors='coerce', dayfirst=True)
+        elif col in NUMERIC_COLUMNS:
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype('float64')
+        else:
+            df[col] = df[col].map(_to_text).astype(object)
     return df
 
+def part_path(key: str) -> str:
+    return os.path.join(PARTS_DIR, f'{key}.parquet')
+
+# --- Чтение источников ---
+def process_source(name, path, columns_map, sheet_name, output_path, batch_size=BATCH_SIZE):
+    """
+    Потоково читает источник (Excel в режиме read-only или Parquet-части), оставляя только колонки columns_map,
+    и пишет батчи в output_path (Parquet). Возвращает число строк.
+    """
+    logger.info(f'Читается источник: {name}')
+    with ParquetStageWriter(output_path, source_schema(columns_map)) as writer:
+        for batch in iter_source_batches(path, list(columns_map.keys()), sheet_name, batch_size):
+            batch = coerce_columns(batch.rename(columns=columns_map))
+            batch.insert(0, 'source', os.path.basename(path))
+            writer.write(batch)
+    logger.info(f'{name}: {(writer.rows, len(columns_map) + 1)}')
+    return writer.rows
+
+def load_sources(workers=INGEST_WORKERS) -> dict[str, int]:
+    """
+    Читает все источники INPUT_PATHS в отдельные выгрузки, при workers > 1 — в пуле процессов.
+    Каждый источник пишется в свой файл, поэтому порядок завершения воркеров
+    не влияет на результат: склейка и decl_id задаются SOURCE_ORDER в merge_sources.
+    """
+    jobs = {
+        key: (SOURCE_NAMES[key], INPUT_PATHS[key], COLUMNS_MAPS[key], 0, part_path(key))
+        for key in SOURCE_ORDER
+    }
+    if workers <= 1:
+        return {key: process_source(*args) for key, args in jobs.items()}
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as pool:
+        futures = {key: pool.submit(process_source, *args) for key, args in jobs.items()}
+        return {key: future.result() for key, future in futures.items()}
+
+company_normalizer = CompanyNormalizer()
+
 def normalize_company_columns(df):
-    for col in ['exporter_name', 'importer_name']:
+    for col in COMPANY_COLUMNS:
         df[f'{col}_orig'] = df[col]
-        normalized = df[col].apply(normalize_company)
-        df[f'{col}_opf'] = normalized['ОПФ']
-        df[col] = normalized['Нормализованное_название']
+        df[f'{col}_opf'], df[col] = company_normalizer.normalize_series(df[col])
     return df
 
-def main():
-    start_time = datetime.now()
-    logger.info('--- Step 1: Загрузка и нормализация ---')
+def _merge_known_rows(batch: pd.DataFrame, previous: pd.DataFrame, next_id: int) -> tuple[pd.DataFrame, int]:
+    """
+    Delta-режим: строки, уже бывшие в st1, берут decl_id и нормализацию из прошлой стадии;
+    новые строки получают decl_id после последнего и нормализуются.
+    """
+    known = batch[ROW_KEY].isin(previous.index).to_numpy()
+    result_columns = [c for c in previous.columns if c != 'decl_id']
+
+    old = batch[known].drop(columns=[c for c in result_columns if c in batch.columns])
+    old = old.join(previous, on=ROW_KEY)
+    new = batch[~known].copy()
+    new.insert(0, 'decl_id', range(next_id, next_id + len(new)))
+    new = normalize_company_columns(new) if len(new) else new
 
-    df_rf = process_source('РФ-Мир', INPUT_PATHS['rf_world'], COLUMNS_MAPS['rf_world'], 0)
-    df_eau = process_source('ЕАЭС', INPUT_PATHS['eau'], COLUMNS_MAPS['eau'], 0)
-    df_atlas = process_source('Атлас', INPUT_PATHS['atlas'], COLUMNS_MAPS['atlas'], 0)
+    merged = pd.concat([old, new])
+    return merged.loc[batch.index], next_id + len(new)
 
-    merged_df = pd.concat([df_eau, df_atlas, df_rf], ignore_index=True)
-    merged_df['decl_date'] = pd.to_datetime(merged_df['decl_date'], errors='coerce')
-    merged_df.insert(0, 'decl_id', range(len(merged_df)))
+def merge_sources(output_path, batch_size=BATCH_SIZE):
+    """
+    Склеивает выгрузки источников в порядке SOURCE_ORDER в одну стадию:
+    присваивает сквозной decl_id и row_key, нормализует компании и унифицирует страны
+    (utils.countries) батч за батчем. В delta-режиме компании нормализуются только
+    в строках, которых не было в прошлой st1; страны — по уникальным значениям батча.
+    """
+    schema = stage1_schema()
+    base_columns = [f.name for f in schema if f.name not in ('decl_id', ROW_KEY)][:-2 * len(COMPANY_COLUMNS)]
+    company_columns = [f.name for f in schema][-2 * len(COMPANY_COLUMNS):]
+    version = stage_version(None, COUNTRIES_PATH, __file__, normalization_utils.__file__, countries.__file__)
+
+    previous = load_previous(output_path, version, ['decl_id'] + COMPANY_COLUMNS + company_columns)
+    if previous is not None:
+        previous = previous.set_index(ROW_KEY)
+        next_id = int(previous['decl_id'].max()) + 1 if len(previous) else 0
+        logger.info(f'Δ режим: в прошлой st1 {len(previous)} строк')
+
+    seen, offset = {}, 0
+    with ParquetStageWriter(output_path, schema, metadata={VERSION_KEY: version}) as writer:
+        for key in SOURCE_ORDER:
+            for batch in iter_parquet_batches(part_path(key), batch_size):
+                for col in base_columns:
+                    if col not in batch.columns:
+                        batch[col] = pd.Series([None] * len(batch), dtype=object)
+                batch = batch[base_columns]
+                batch.insert(0, ROW_KEY, compute_row_keys(batch, base_columns, seen))
+                if previous is None:
+                    batch.insert(0, 'decl_id', range(offset, offset + len(batch)))
+                    offset += len(batch)
+                    batch = normalize_company_columns(batch)
+                else:
+                    batch, next_id = _merge_known_rows(batch, previous, next_id)
+                writer.write(unify_country_names(batch, COUNTRY_COLUMNS))
+    logger.info(f'Итоговая форма: {(writer.rows, len(schema))}')
+    logger.info(f'Колонки: {schema.names}')
+    return writer.rows
+
+def main(workers=INGEST_WORKERS):
+    start_time = datetime.now()
+    logger.info('--- Step 1: Загрузка и нормализация ---')
 
-    logger.info(f'Итоговая форма: {merged_df.shape}')
-    logger.info(f'Колонки: {merged_df.columns.tolist()}')
+    load_sources(workers)
 
-    merged_df = normalize_company_columns(merged_df)
+    cached = company_normalizer.load_cache(COMPANY_CACHE_PATH)
+    logger.info(f'Кэш нормализации компаний: {cached} названий')
+    merge_sources(OUTPUT_PATH)
+    added = company_normalizer.save_cache(COMPANY_CACHE_PATH)
+    logger.info(f'Новых названий компаний нормализовано: {added}')
+    if SAVE_EXCEL_COPY:
+        save_to_excel_file(read_stage(OUTPUT_PATH), OUTPUT_PATH.replace('.parquet', '.xlsx'))
 
-    save_to_excel_file(merged_df, OUTPUT_PATH)
     end_time = datetime.now()
     logger.info(f'Время начала: {start_time}')
     logger.info(f'Время окончания: {end_time}')
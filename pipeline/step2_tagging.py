@@ -3,113 +3,49 @@
 # Для запуска из venv
 # pipeline\venv\scripts\activate
 # python pipeline\step2_tagging.py
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
+from functools import cached_property
+from itertools import accumulate
+from multiprocessing import get_context
+import os
 import pandas as pd
 import re
-import unicodedata
 import pymorphy2
-from nltk import download
-from nltk.corpus import stopwords
-
-from utils.io import read_excel_file, save_to_excel_file
+from tqdm import tqdm
+from tqdm.contrib.logging import logging_redirect_tqdm
+
+from utils.delta_utils import VERSION_KEY, apply_row_local, load_previous, stage_version
+from utils.io import read_stage, save_stage
+from utils.lemma_cache import LEMMA_CACHE_PATH, LemmaCache
+from utils import normalization_utils
+from utils.normalization_utils import normalize_confusables
+from utils.stopwords import STOPWORDS_PATH, load_stopwords
+from utils.term_matcher import PrefixTermMatcher
 from utils.logging_utils import setup_logger
 
 DEBUG = True  # включи на один прогон: логируем схему и самотест
 
 logger = setup_logger()
-start_time = datetime.now()
-logger.info('--- Step 2: Текстовая классификация (negation + mixed-script) ---')
 
 # --- Пути ---
-INPUT_PATH = 'data/st1_cleaned/st1.xlsx'
-OUTPUT_PATH = 'data/st2_tagged/st2.xlsx'
+INPUT_PATH = 'data/st1_cleaned/st1.parquet'
+OUTPUT_PATH = 'data/st2_tagged/st2.parquet'
+SAVE_EXCEL_COPY = False  # дополнительно сохранить st2.xlsx для ручной проверки
 TAGS_PATH = 'data/utilities/word_tagger/tagged_words.csv'
 
-# --- Загрузка ресурсов ---
-morph = pymorphy2.MorphAnalyzer()
-download('stopwords')
-stop_words = set(stopwords.words("russian"))
-
-# --- Загрузка данных ---
-df = read_excel_file(INPUT_PATH)
-tags_df = pd.read_csv(TAGS_PATH)
-approved = set(tags_df[tags_df["tag"] == "approved"]["word"].str.lower())
-rejected = set(tags_df[tags_df["tag"] == "rejected"]["word"].str.lower())
-
-# =========================================================
-# НОРМАЛИЗАЦИЯ СМЕШАННЫХ ТОКЕНОВ (КИР/ЛАТ) — безопасная
-# =========================================================
-
-LAT_TO_CYR = {
-    'A':'А','a':'а','B':'В','E':'Е','e':'е','K':'К','k':'к',
-    'M':'М','m':'м','H':'Н','h':'н','O':'О','o':'о','P':'Р','p':'р',
-    'C':'С','c':'с','T':'Т','t':'т','X':'Х','x':'х','Y':'У','y':'у'
-}
-CYR_TO_LAT = {v: k for k, v in LAT_TO_CYR.items()}
-
-def _is_cyr(ch: str) -> bool:
-    return 'CYRILLIC' in unicodedata.name(ch, '')
-
-def _is_lat(ch: str) -> bool:
-    return 'LATIN' in unicodedata.name(ch, '')
-
-TOKEN_RE = re.compile(r"[0-9A-Za-zА-Яа-яЁё\-_/\.]+")
-SKIP_PATTERNS = [
-    re.compile(r"[A-Za-z]{2,}\d+"),   # DN50, PN16, G3/4, M20x1.5
-    re.compile(r"[A-Z]{3,}"),         # FANUC, PLC, CNC, SIEMENS
-    re.compile(r"\d+[A-Za-z\-]+"),    # LS59-1, 40Cr, 20#, 12X18H10T
-    re.compile(r"https?://|www\."),   # URL
-]
-
-def _token_should_be_skipped(tok: str) -> bool:
-    return any(p.search(tok) for p in SKIP_PATTERNS)
-
-def _normalize_mixed_token(tok: str) -> str:
-    lat = sum(_is_lat(ch) for ch in tok)
-    cyr = sum(_is_cyr(ch) for ch in tok)
-    if lat == 0 or cyr == 0 or _token_should_be_skipped(tok):
-        return tok
-    to_cyr = cyr >= lat
-    out = []
-    for ch in tok:
-        if to_cyr and _is_lat(ch) and ch in LAT_TO_CYR:
-            out.append(LAT_TO_CYR[ch])
-        elif not to_cyr and _is_cyr(ch) and ch in CYR_TO_LAT:
-            out.append(CYR_TO_LAT[ch])
-        else:
-            out.append(ch)
-    return "".join(out)
-
-def normalize_confusables(text: str) -> str:
-    if not isinstance(text, str):
-        return text
-    text = unicodedata.normalize('NFKC', text)
-    out, last = [], 0
-    for m in TOKEN_RE.finditer(text):
-        s, e = m.span()
-        out.append(text[last:s])
-        out.append(_normalize_mixed_token(m.group(0)))
-        last = e
-    out.append(text[last:])
-    return "".join(out)
+# --- Параллельная классификация ---
+TAG_WORKERS = max(1, (os.cpu_count() or 2) - 1)  # процессов; 1 — в текущем процессе
+TAG_CHUNK_SIZE = 2_000  # уникальных описаний на задачу воркера
 
 # =========================================================
 # ЛЕММАТИЗАЦИЯ
 # =========================================================
 
+# Токены для лемм (Tagger.extract_lemmas) и для окна отрицаний (NegationIndex)
 WORD_RE = re.compile(r"\b[а-яА-Яa-zA-ZЁё]+(?:-[а-яА-Яa-zA-ZЁё]+)*\b")
 
-def extract_lemmas(text: str) -> list[str]:
-    if not isinstance(text, str):
-        return []
-    text = normalize_confusables(text).lower()
-    tokens = WORD_RE.findall(text)
-    lemmas = []
-    for token in tokens:
-        if token not in stop_words and len(token) > 1:
-            lemmas.append(morph.parse(token)[0].normal_form)
-    return lemmas
-
 # =========================================================
 # ОТРИЦАНИЕ (NEGATION) ДЛЯ REJECTED-ТЕРМИНОВ
 # =========================================================
@@ -129,83 +65,136 @@ NEGATION_CONTEXT_TEMPLATES = [
     r"\b{term}\w*\b[^,;:.]{0,80}\bне\s+(предусмотр\w*|относ\w*|явля\w*)\b",
 ]
 
+# Слово, без которого шаблон не может сработать (в том же порядке, что и NEGATION_CONTEXT_TEMPLATES)
+NEGATION_TEMPLATE_ANCHORS = ["не", "не", "не", "не", "без", "не", "кроме", "исключением", "исключая", "не"]
+if len(NEGATION_TEMPLATE_ANCHORS) != len(NEGATION_CONTEXT_TEMPLATES):
+    raise ValueError("NEGATION_TEMPLATE_ANCHORS должен соответствовать NEGATION_CONTEXT_TEMPLATES")
+
 NEGATOR_TOKENS = {"не", "ни", "без"}
 EXCEPTION_TOKENS = {"кроме", "исключая"}
-
-def _spans_overlap(a, b) -> bool:
-    return not (a[1] <= b[0] or b[1] <= a[0])
+# Все слова, от которых зависит отрицание: если ни одного нет в тексте, отрицаний нет
+NEGATION_ANCHOR_RE = re.compile(
+    r"\b(?:" + "|".join(sorted(set(NEGATION_TEMPLATE_ANCHORS) | NEGATOR_TOKENS | EXCEPTION_TOKENS)) + r")\b"
+)
 
 def _term_occurrences(text: str, term: str):
     rx = re.compile(rf"\b{re.escape(term)}\w*\b")
     return [m.span() for m in rx.finditer(text)]
 
-def _find_negation_hits(text: str, term: str):
-    hits = []
-    term_esc = re.escape(term)
-    for i, patt in enumerate(NEGATION_CONTEXT_TEMPLATES, start=1):
-        rx = re.compile(patt.replace("{term}", term_esc))
-        for m in rx.finditer(text):
-            hits.append((m.start(), m.end(), f"NEG_{i}"))
-    return hits
-
-def _is_occurrence_negated(text: str, span, term: str, neg_hits):
-    for s, e, name in neg_hits:
-        if _spans_overlap(span, (s, e)):
-            return True, name
-
-    sent_bounds = [0]
-    for m in SENT_SPLIT_RE.finditer(text):
-        sent_bounds.append(m.end())
-    sent_bounds.append(len(text))
-    sent_bounds = sorted(set(sent_bounds))
-
-    sent_start, sent_end = 0, len(text)
-    for i in range(len(sent_bounds) - 1):
-        if sent_bounds[i] <= span[0] < sent_bounds[i + 1]:
-            sent_start, sent_end = sent_bounds[i], sent_bounds[i + 1]
-            break
-
-    sent = text[sent_start:sent_end]
-    toks = [t.lower() for t in WORD_RE.findall(sent)]
-
-    term_idx = None
-    for i, tok in enumerate(toks):
-        if tok.startswith(term):
-            term_idx = i
-            break
-    if term_idx is None:
+_negation_patterns_cache = {}
+
+def _negation_patterns(term: str) -> list[tuple[str, str, re.Pattern]]:
+    """Скомпилированные шаблоны отрицания для термина: (имя правила, опорное слово, regex)."""
+    patterns = _negation_patterns_cache.get(term)
+    if patterns is None:
+        term_esc = re.escape(term)
+        patterns = [
+            (f"NEG_{i}", anchor, re.compile(patt.replace("{term}", term_esc)))
+            for i, (patt, anchor) in enumerate(zip(NEGATION_CONTEXT_TEMPLATES, NEGATION_TEMPLATE_ANCHORS), start=1)
+        ]
+        _negation_patterns_cache[term] = patterns
+    return patterns
+
+class NegationIndex:
+    """
+    Разбор одного (нормализованного, в нижнем регистре) текста для проверки отрицаний.
+
+    Текст один раз сегментируется на предложения (SENT_SPLIT_RE) и токенизируется (WORD_RE),
+    опорные слова отрицаний находятся одним проходом. Дальше вопрос «отрицается ли вхождение
+    и каким правилом» решается бинарным поиском по срабатываниям шаблонов и префиксным
+    суммам отрицаний в окне токенов. Результат совпадает с построчной проверкой
+    (шаблоны NEG_1…NEG_10 по порядку, затем NEG_FALLBACK_*).
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        self.anchors = set(NEGATION_ANCHOR_RE.findall(text))
+        if not self.anchors:
+            return
+
+        self.sent_bounds = sorted({0, len(text)} | {m.end() for m in SENT_SPLIT_RE.finditer(text)})
+        # токены всего текста = токены предложений: границы предложений не делят слова
+        tokens = [(m.start(), m.group(0).lower()) for m in WORD_RE.finditer(text)]
+        self.token_starts = [start for start, _ in tokens]
+        self.tokens = [tok for _, tok in tokens]
+        self.negators = list(accumulate((tok in NEGATOR_TOKENS for tok in self.tokens), initial=0))
+        self.exceptions = list(accumulate((tok in EXCEPTION_TOKENS for tok in self.tokens), initial=0))
+        self._first_token = {}
+
+    def hits(self, term: str) -> list[tuple[str, list[int], list[int]]]:
+        """Срабатывания шаблонов для термина: (имя, начала, концы) — по порядку шаблонов."""
+        if not self.anchors:
+            return []
+        hits = []
+        for name, anchor, rx in _negation_patterns(term):
+            if anchor not in self.anchors:
+                continue
+            spans = [m.span() for m in rx.finditer(self.text)]
+            if spans:
+                hits.append((name, [s for s, _ in spans], [e for _, e in spans]))
+        return hits
+
+    def is_negated(self, span, term: str, hits) -> tuple[bool, str]:
+        if not self.anchors:
+            return False, ""
+
+        # срабатывания одного шаблона не пересекаются и упорядочены — проверяем последнее,
+        # начавшееся до конца вхождения
+        for name, starts, ends in hits:
+            k = bisect_left(starts, span[1]) - 1
+            if k >= 0 and ends[k] > span[0]:
+                return True, name
+
+        # запасной вариант: первый токен предложения, начинающийся с термина, и 6 токенов слева
+        i = bisect_right(self.sent_bounds, span[0]) - 1
+        term_idx = self._first_term_token(i, term)
+        if term_idx is None:
+            return False, ""
+        lo = max(self._sentence_tokens(i)[0], term_idx - 6)
+        if self.negators[term_idx] - self.negators[lo]:
+            return True, "NEG_FALLBACK_LEFT_NEGATOR"
+        if self.exceptions[term_idx] - self.exceptions[lo]:
+            return True, "NEG_FALLBACK_EXCEPTION"
         return False, ""
 
-    left = toks[max(0, term_idx - 6): term_idx]
-    if any(t in NEGATOR_TOKENS for t in left):
-        return True, "NEG_FALLBACK_LEFT_NEGATOR"
-    if any(t in EXCEPTION_TOKENS for t in left):
-        return True, "NEG_FALLBACK_EXCEPTION"
-    if "не" in left:
-        return True, "NEG_FALLBACK_NE_TERM"
-    return False, ""
+    def _sentence_tokens(self, i: int) -> tuple[int, int]:
+        return (bisect_left(self.token_starts, self.sent_bounds[i]),
+                bisect_left(self.token_starts, self.sent_bounds[i + 1]))
+
+    def _first_term_token(self, i: int, term: str) -> int | None:
+        key = (i, term)
+        if key not in self._first_token:
+            lo, hi = self._sentence_tokens(i)
+            self._first_token[key] = next((t for t in range(lo, hi) if self.tokens[t].startswith(term)), None)
+        return self._first_token[key]
 
-def filter_rejected_with_negation(raw_text: str, rejected_terms: list[str]):
+def filter_rejected_with_negation(raw_text: str, rejected_terms: list[str], occurrences: dict | None = None,
+                                  normalized: str | None = None):
     """
     Возвращает dict:
       - rejected_pos: запрещённые термины в ПОЛОЖИТЕЛЬНОМ контексте
       - rejected_neg: запрещённые термины, встретившиеся ТОЛЬКО в отрицании
       - triggers: список срабатываний правил (для дебага)
+
+    occurrences — уже найденные вхождения {термин: [спаны]} (PrefixTermMatcher.find);
+    если не переданы, ищутся регуляркой по каждому термину.
+    normalized — уже посчитанный normalize_confusables(raw_text), если есть.
     """
     res = {"rejected_pos": [], "rejected_neg": [], "triggers": []}
     if not raw_text or not isinstance(raw_text, str):
         return res
-    text = normalize_confusables(raw_text).lower()
+    text = (normalized if normalized is not None else normalize_confusables(raw_text)).lower()
+    negation = NegationIndex(text)
 
     for term in sorted(set(rejected_terms)):
-        occs = _term_occurrences(text, term)
+        occs = occurrences.get(term, []) if occurrences is not None else _term_occurrences(text, term)
         if not occs:
             continue
-        neg_hits = _find_negation_hits(text, term)
+        neg_hits = negation.hits(term)
         neg_count = pos_count = 0
         local_triggers = []
         for occ in occs:
-            is_neg, trig = _is_occurrence_negated(text, occ, term, neg_hits)
+            is_neg, trig = negation.is_negated(occ, term, neg_hits)
             if is_neg:
                 neg_count += 1
                 if trig:
@@ -224,88 +213,291 @@ def filter_rejected_with_negation(raw_text: str, rejected_terms: list[str]):
 # КЛАССИФИКАЦИЯ
 # =========================================================
 
-def classify_text(text: str) -> dict:
-    if pd.isna(text):
-        return {
-            "classification": "не определено",
-            "reason": "",
-            "matched_approved": [],
-            "matched_rejected": [],
-            "matched_rejected_negated": [],
-            "negation_triggers": [],
-        }
-
-    raw = str(text)
-    normalized = normalize_confusables(raw).lower()
-    lemmas = extract_lemmas(raw)
-
-    matched_approved = [l for l in lemmas if l in approved]
-
-    # кандидаты в rejected = (по леммам) ∪ (по прямому сканированию нормализованного текста)
-    rej_candidates = set(l for l in lemmas if l in rejected)
-    rej_candidates |= {term for term in rejected if re.search(rf"\b{re.escape(term)}\w*\b", normalized)}
-    rej_candidates = sorted(rej_candidates)
+CLASSIFY_COLUMNS = [
+    "classification", "reason", "matched_approved", "matched_rejected",
+    "matched_rejected_negated", "negation_triggers",
+]
+TAG_COLUMNS = CLASSIFY_COLUMNS + ["text_norm_preview"]
 
-    neg_res = filter_rejected_with_negation(raw, rej_candidates)
-    rejected_pos = neg_res["rejected_pos"]
-    rejected_neg = neg_res["rejected_neg"]
-    neg_triggers = neg_res["triggers"]
+class Tagger:
+    """
+    Классификатор описаний с ресурсами: морфоанализатор, кэш лемм, стоп-слова
+    и словари тегов. Ресурсы загружаются лениво при первом обращении и один раз
+    на экземпляр: импорт модуля и создание Tagger ничего не читают с диска.
+
+    Пример:
+        tagger = Tagger()
+        result = tagger.classify('КРАНЫ ШАРОВЫЕ ... НЕ ЯВЛЯЮТСЯ КЛАПАНОМ')
+        tagger.close()
+    """
 
-    if rejected_pos:
-        return {
-            "classification": "исключено",
-            "reason": rejected_pos[0],
-            "matched_approved": matched_approved,
-            "matched_rejected": rejected_pos,
-            "matched_rejected_negated": rejected_neg,
-            "negation_triggers": neg_triggers,
-        }
-    if matched_approved:
+    def __init__(self, tags_path: str = TAGS_PATH, stopwords_path: str = STOPWORDS_PATH,
+                 lemma_cache_path: str | None = LEMMA_CACHE_PATH, lemma_cache_readonly: bool = False):
+        self.tags_path = tags_path
+        self.stopwords_path = stopwords_path
+        self.lemma_cache_path = lemma_cache_path
+        self.lemma_cache_readonly = lemma_cache_readonly  # воркер пула: новые леммы пишет родитель
+
+    @cached_property
+    def morph(self):
+        return pymorphy2.MorphAnalyzer()
+
+    @cached_property
+    def lemma_cache(self) -> LemmaCache:
+        return LemmaCache(self.morph, path=self.lemma_cache_path, readonly=self.lemma_cache_readonly)
+
+    @cached_property
+    def stop_words(self) -> set[str]:
+        return load_stopwords(self.stopwords_path)
+
+    @cached_property
+    def _tags(self) -> tuple[set[str], set[str]]:
+        tags_df = pd.read_csv(self.tags_path)
+        approved = set(tags_df[tags_df["tag"] == "approved"]["word"].str.lower())
+        rejected = set(tags_df[tags_df["tag"] == "rejected"]["word"].str.lower())
+        return approved, rejected
+
+    @property
+    def approved(self) -> set[str]:
+        return self._tags[0]
+
+    @property
+    def rejected(self) -> set[str]:
+        return self._tags[1]
+
+    @cached_property
+    def rejected_matcher(self) -> PrefixTermMatcher:
+        # все вхождения rejected-терминов (\bterm\w*\b) за один проход по тексту
+        return PrefixTermMatcher(self.rejected)
+
+    def extract_lemmas(self, text: str, normalized: str | None = None) -> list[str]:
+        """Леммы текста; normalized — уже посчитанный normalize_confusables(text), если есть."""
+        if not isinstance(text, str):
+            return []
+        text = (normalized if normalized is not None else normalize_confusables(text)).lower()
+        stop_words = self.stop_words
+        lemmas = []
+        for token in WORD_RE.findall(text):
+            if token not in stop_words and len(token) > 1:
+                lemmas.append(self.lemma_cache.lemma(token))
+        return lemmas
+
+    def classify(self, text: str, normalized: str | None = None) -> dict:
+        """
+        Классификация описания. normalized — уже посчитанный normalize_confusables(text):
+        нормализация выполняется один раз и передаётся во все проверки.
+        """
+        if pd.isna(text):
+            return {
+                "classification": "не определено",
+                "reason": "",
+                "matched_approved": [],
+                "matched_rejected": [],
+                "matched_rejected_negated": [],
+                "negation_triggers": [],
+            }
+
+        raw = str(text)
+        if not isinstance(normalized, str):
+            normalized = normalize_confusables(raw)
+        lemmas = self.extract_lemmas(raw, normalized)
+        lowered = normalized.lower()
+
+        approved, rejected = self._tags
+        matched_approved = [l for l in lemmas if l in approved]
+
+        # кандидаты в rejected = (по леммам) ∪ (по прямому сканированию нормализованного текста)
+        occurrences = self.rejected_matcher.find(lowered)
+        rej_candidates = set(l for l in lemmas if l in rejected)
+        rej_candidates |= set(occurrences)
+        rej_candidates = sorted(rej_candidates)
+
+        neg_res = filter_rejected_with_negation(raw, rej_candidates, occurrences, normalized)
+        rejected_pos = neg_res["rejected_pos"]
+        rejected_neg = neg_res["rejected_neg"]
+        neg_triggers = neg_res["triggers"]
+
+        if rejected_pos:
+            return {
+                "classification": "исключено",
+                "reason": rejected_pos[0],
+                "matched_approved": matched_approved,
+                "matched_rejected": rejected_pos,
+                "matched_rejected_negated": rejected_neg,
+                "negation_triggers": neg_triggers,
+            }
+        if matched_approved:
+            return {
+                "classification": "одобрено",
+                "reason": matched_approved[0],
+                "matched_approved": matched_approved,
+                "matched_rejected": [],
+                "matched_rejected_negated": rejected_neg,
+                "negation_triggers": neg_triggers,
+            }
         return {
-            "classification": "одобрено",
-            "reason": matched_approved[0],
+            "classification": "не определено",
+            "reason": "",
             "matched_approved": matched_approved,
             "matched_rejected": [],
             "matched_rejected_negated": rejected_neg,
             "negation_triggers": neg_triggers,
         }
-    return {
-        "classification": "не определено",
-        "reason": "",
-        "matched_approved": matched_approved,
-        "matched_rejected": [],
-        "matched_rejected_negated": rejected_neg,
-        "negation_triggers": neg_triggers,
-    }
+
+    def classify_chunk(self, texts: list) -> tuple[list[dict], list, tuple[int, int, int], dict[str, str]]:
+        """
+        Классификация части уникальных описаний: результаты, нормализованные тексты,
+        счётчики кэша лемм и новые леммы (только для кэша readonly — их записывает родитель).
+        """
+        before = self.lemma_cache.counters()
+        previews = [normalize_confusables(text) for text in texts]
+        results = [self.classify(text, normalized) for text, normalized in zip(texts, previews)]
+        new_lemmas = self.lemma_cache.take_new() if self.lemma_cache_readonly else {}
+        self.lemma_cache.flush()
+        return results, previews, tuple(a - b for a, b in zip(self.lemma_cache.counters(), before)), new_lemmas
+
+    def close(self):
+        """Сбрасывает новые леммы на диск и закрывает кэш (если он был открыт)."""
+        if "lemma_cache" in self.__dict__:
+            self.lemma_cache.close()
+
+# Классификатор по умолчанию (для classify_text) и классификатор воркера пула
+_tagger = None
+
+def get_tagger() -> Tagger:
+    """Общий Tagger процесса с путями по умолчанию; создаётся при первом вызове."""
+    global _tagger
+    if _tagger is None:
+        _tagger = Tagger()
+    return _tagger
+
+def classify_text(text: str, normalized: str | None = None) -> dict:
+    """Классификация описания классификатором по умолчанию (см. Tagger.classify)."""
+    return get_tagger().classify(text, normalized)
+
+def _init_worker(tags_path: str, stopwords_path: str, lemma_cache_path: str | None):
+    global _tagger
+    _tagger = Tagger(tags_path, stopwords_path, lemma_cache_path, lemma_cache_readonly=True)
+
+def _classify_chunk(texts: list) -> tuple[list[dict], list, tuple[int, int, int], dict[str, str]]:
+    return _tagger.classify_chunk(texts)
 
 # =========================================================
 # ПРИМЕНЕНИЕ
 # =========================================================
 
-# Разворачиваем dict в столбцы надёжно
-meta = df["prod_details"].astype(str).apply(classify_text).apply(pd.Series)
-
-# Merge (перезаписываем одноимённые колонки, если вдруг были)
-df = pd.concat([df.drop(columns=[c for c in meta.columns if c in df.columns], errors="ignore"), meta], axis=1)
-
-# Предпросмотр нормализованного текста для контроля
-df["text_norm_preview"] = df["prod_details"].astype(str).apply(normalize_confusables).str[:200]
-
-# Логируем схему
-if DEBUG:
-    logger.info(f"Столбцы после классификации: {list(df.columns)}")
-    # Самотест на твоей фразе
-    sample = "АРМАТУРА ТРУБОПРОВОДНAЯ:КРАНЫ ШАРОВЫЕ, ДЛЯ УСТАНОВКИ НА ТРУБОПРОВОДАХ ВОДЫ И ГАЗА, КОРПУСЫ ИЗГОТОВЛЕНЫ ИЗ СТАЛИ МАРКИ СТ.20; И ЛАТУНИ МАРКИ ЛС59-1 НЕ СОДЕРЖИТ УПЛОТНЕНИЙ СИЛЬФОННОГО ТИПА И НЕ ЯВЛЯЮТСЯ КЛАПАНОМ"
-    test = classify_text(sample)
-    logger.info(f"SAMOTEST classification={test['classification']}; reason={test['reason']}; "
-                f"rej_pos={test['matched_rejected']}; rej_neg={test['matched_rejected_negated']}; "
-                f"triggers={test['negation_triggers']}")
-
-# --- Сохранение ---
-save_to_excel_file(df, OUTPUT_PATH)
-
-end_time = datetime.now()
-logger.info(f'Время начала: {start_time}')
-logger.info(f'Время окончания: {end_time}')
-logger.info(f'Продолжительность: {end_time - start_time}')
-logger.info(f'Готово: {OUTPUT_PATH}')
+def classify_unique(texts: list, tagger: Tagger, workers: int = TAG_WORKERS, chunk_size: int = TAG_CHUNK_SIZE):
+    """
+    Классифицирует тексты частями по chunk_size; при workers > 1 — в пуле процессов
+    (каждый воркер один раз создаёт свой Tagger с теми же путями). Порядок результатов
+    совпадает с порядком texts. Прогресс — по завершённым частям.
+    Кэш лемм на диске пишет только текущий процесс: воркеры читают его и возвращают
+    новые леммы вместе с результатами, они записываются одной транзакцией на часть.
+    """
+    chunks = [texts[i:i + chunk_size] for i in range(0, len(texts), chunk_size)]
+    parts = [None] * len(chunks)
+    with logging_redirect_tqdm(), tqdm(total=len(texts), desc="🏷️ Классификация", unit="текст") as bar:
+        if workers <= 1 or len(chunks) <= 1:
+            for i, chunk in enumerate(chunks):
+                parts[i] = tagger.classify_chunk(chunk)
+                bar.update(len(chunk))
+        else:
+            # spawn: воркеры не наследуют соединение SQLite кэша лемм и ведут себя одинаково на Windows/Linux;
+            # файл кэша создаётся до запуска воркеров, чтобы они открыли его на чтение
+            lemma_cache = tagger.lemma_cache
+            with ProcessPoolExecutor(max_workers=min(workers, len(chunks)), mp_context=get_context('spawn'),
+                                     initializer=_init_worker,
+                                     initargs=(tagger.tags_path, tagger.stopwords_path, tagger.lemma_cache_path)) as pool:
+                futures = {pool.submit(_classify_chunk, chunk): i for i, chunk in enumerate(chunks)}
+                for future in as_completed(futures):
+                    i = futures[future]
+                    parts[i] = future.result()
+                    bar.update(len(chunks[i]))
+                    lemma_cache.add_counters(parts[i][2])
+                    lemma_cache.add_new(parts[i][3])
+
+    results = [r for part in parts for r in part[0]]
+    previews = [p for part in parts for p in part[1]]
+    return results, previews
+
+def tag_frame(df: pd.DataFrame, tagger: Tagger | None = None, workers: int = TAG_WORKERS,
+              chunk_size: int = TAG_CHUNK_SIZE) -> pd.DataFrame:
+    """
+    Классифицирует prod_details. Описания сильно повторяются (один декларант подаёт
+    один и тот же текст сотни раз), поэтому каждый уникальный текст классифицируется
+    один раз, а результат раскладывается по строкам по кодам factorize.
+    """
+    tagger = tagger or get_tagger()
+    started = datetime.now()
+    texts = df["prod_details"].astype(str)
+    codes, uniques = pd.factorize(texts, use_na_sentinel=False)
+
+    results, previews = classify_unique(list(uniques), tagger, workers, chunk_size)
+    meta = pd.DataFrame(results, columns=CLASSIFY_COLUMNS)
+    # Предпросмотр нормализованного текста для контроля
+    meta["text_norm_preview"] = pd.Series(previews, dtype=texts.dtype).str[:200]
+    meta = meta.take(codes)
+    meta.index = df.index
+
+    # Merge (перезаписываем одноимённые колонки, если вдруг были)
+    df = pd.concat([df.drop(columns=[c for c in meta.columns if c in df.columns]), meta], axis=1)
+
+    seconds = max((datetime.now() - started).total_seconds(), 1e-6)
+    logger.info(f"Уникальных описаний: {len(uniques)} из {len(texts)} "
+                f"(дедупликация x{len(texts) / max(len(uniques), 1):.1f}), {len(texts) / seconds:,.0f} строк/с")
+    return df
+
+def run(input_path: str = INPUT_PATH, output_path: str = OUTPUT_PATH, tagger: Tagger | None = None,
+        workers: int = TAG_WORKERS, chunk_size: int = TAG_CHUNK_SIZE) -> pd.DataFrame:
+    """
+    Step 2 целиком: читает стадию input_path, классифицирует описания и сохраняет output_path.
+    Если tagger не передан, создаётся новый и закрывается по завершении; переданный
+    tagger остаётся открытым (его кэш лемм только сбрасывается на диск).
+    """
+    own_tagger = tagger is None
+    tagger = tagger or Tagger()
+    df = read_stage(input_path)
+
+    # В delta-режиме классифицируются только новые строки st1
+    version = stage_version(input_path, tagger.tags_path, tagger.stopwords_path, __file__, normalization_utils.__file__)
+    df = apply_row_local(
+        df, load_previous(output_path, version, TAG_COLUMNS),
+        lambda part: tag_frame(part, tagger, workers, chunk_size), TAG_COLUMNS,
+    )
+
+    # Логируем схему
+    if DEBUG:
+        logger.info(f"Столбцы после классификации: {list(df.columns)}")
+        # Самотест на твоей фразе
+        sample = "АРМАТУРА ТРУБОПРОВОДНAЯ:КРАНЫ ШАРОВЫЕ, ДЛЯ УСТАНОВКИ НА ТРУБОПРОВОДАХ ВОДЫ И ГАЗА, КОРПУСЫ ИЗГОТОВЛЕНЫ ИЗ СТАЛИ МАРКИ СТ.20; И ЛАТУНИ МАРКИ ЛС59-1 НЕ СОДЕРЖИТ УПЛОТНЕНИЙ СИЛЬФОННОГО ТИПА И НЕ ЯВЛЯЮТСЯ КЛАПАНОМ"
+        test = tagger.classify(sample)
+        logger.info(f"SAMOTEST classification={test['classification']}; reason={test['reason']}; "
+                    f"rej_pos={test['matched_rejected']}; rej_neg={test['matched_rejected_negated']}; "
+                    f"triggers={test['negation_triggers']}")
+
+    if own_tagger:
+        tagger.close()
+    else:
+        tagger.lemma_cache.flush()
+    logger.info(tagger.lemma_cache.stats_line())
+
+    # --- Сохранение ---
+    save_stage(df, output_path, excel_copy=SAVE_EXCEL_COPY, metadata={VERSION_KEY: version})
+    return df
+
+# ------------------------- ОСНОВНОЙ БЛОК -------------------------- #
+
+def main(workers: int = TAG_WORKERS, chunk_size: int = TAG_CHUNK_SIZE):
+    start_time = datetime.now()
+    logger.info('--- Step 2: Текстовая классификация (negation + mixed-script) ---')
+
+    run(INPUT_PATH, OUTPUT_PATH, workers=workers, chunk_size=chunk_size)
+
+    end_time = datetime.now()
+    logger.info(f'Время начала: {start_time}')
+    logger.info(f'Время окончания: {end_time}')
+    logger.info(f'Продолжительность: {end_time - start_time}')
+    logger.info(f'Готово: {OUTPUT_PATH}')
+
+if __name__ == '__main__':
+    main()
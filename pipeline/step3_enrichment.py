@@ -1,11 +1,24 @@
 # steps/step3_enrichment.py
 
+import numpy as np
 import pandas as pd
 from datetime import datetime
 import logging
-
-from utils.io import read_excel_file, save_to_excel_file
+import tempfile
+
+from utils import countries
+from utils.countries import COUNTRIES_PATH, COUNTRY_COLUMNS, unify_country_names
+from utils.delta_utils import ROW_KEY, VERSION_KEY, load_previous, stage_version
+from utils import entity_resolution
+from utils.entity_resolution import company_id_column, resolve_companies
+from utils.io import partition_parquet, read_stage, save_stage
+from utils import normalization_utils
+from utils.normalization_utils import CompanyNormalizer
 from utils.logging_utils import setup_logger
+from utils import price_anomalies
+from utils.price_anomalies import (
+    combine_stats, flag_unit_price_anomalies, load_price_stats, price_histogram, save_price_stats
+)
 
 # --- Логгер ---
 logger = setup_logger()
@@ -13,242 +26,80 @@ start_time = datetime.now()
 logger.info('--- Step 3: Обогащение и валидация ---')
 
 # --- Пути ---
-INPUT_PATH = 'data/st2_tagged/st2.xlsx'
-OUTPUT_PATH = 'data/st3_enriched/st3.xlsx'
+INPUT_PATH = 'data/st2_tagged/st2.parquet'
+OUTPUT_PATH = 'data/st3_enriched/st3.parquet'
+SAVE_EXCEL_COPY = False  # дополнительно сохранить st3.xlsx для ручной проверки
 BLACKLIST_PATH = 'data/utilities/blacklist_companies.csv'
+PRICE_STATS_PATH = 'data/st3_enriched/price_stats.parquet'  # сводка цен за кг по группам ТН ВЭД (для delta)
+BLACKLIST_COLUMNS = {'importer': 'importer_name', 'exporter': 'exporter_name'}  # type в блеклисте -> колонка
+DECL_GROUP_KEYS = ['decl_number', 'decl_date', 'importer_name', 'exporter_name', 'source']
+# > 1 — шаги 1–3 (страны, prod_hsc, дубликаты) выполняются по частям (по хэшу decl_number):
+# снижает пик памяти этих шагов; сведение компаний и флаги по-прежнему работают со всей стадией
+DECL_PARTITIONS = 0
+PARTITION_POSITION = '__row_position'  # номер строки во входной стадии (временная колонка частей)
 
 # ---------------------------- ФУНКЦИИ ---------------------------- #
 
-# --- Функция для унификации стран ---
-def unify_country_names(df: pd.DataFrame, columns_to_process: list) -> pd.DataFrame:
-    """
-    Унифицирует страны в указанных столбцах по словарю с вариантами написаний.
-    Поддержаны ISO‑коды alpha‑2/alpha‑3 (UZ, UZB, CN, CHN, MN, MNG и т.д.) и специфичные (таможенные) варианты.
-    """
-
-    groups = {
-        # СНГ/ЕАЭС и соседи
-        ('AM', 'ARM', 'Armenia', 'AM - АРМЕНИЯ'): 'Армения',
-        ('OS', 'South Ossetia'): 'Южная Осетия',
-        ('AB', 'ABH', 'Abkhazia'): 'Абхазия',
-        ('AZ', 'AZE', 'Azerbaijan'): 'Азербайджан',
-        ('BY', 'BLR', 'Belarus', 'BY - БЕЛАРУСЬ'): 'Беларусь',
-        ('GE', 'GEO', 'Georgia'): 'Грузия',
-        ('KZ', 'KAZ', 'Kazakhstan', 'KZ - КАЗАХСТАН'): 'Казахстан',
-        ('KG', 'KGZ', 'Kyrgyzstan', 'KG - КИРГИЗИЯ', 'KG - КЫРГЫЗСТАН', 'Киргизия', 'Кыргызстан'): 'Кыргызстан',
-        ('MN', 'MNG', 'Mongolia'): 'Монголия',
-        ('RU', 'RUS', 'Russian Federation', 'RU - РОССИЯ', 'Российская Федерация'): 'Россия',
-        ('TJ', 'TJK', 'Tajikistan', 'TJ - ТАДЖИКИСТАН'): 'Таджикистан',
-        ('TM', 'TKM', 'Turkmenistan'): 'Туркменистан',
-        ('UA', 'UKR', 'Ukraine', 'UA - УКРАИНА'): 'Украина',
-        ('UZ', 'UZB', 'Uzbekistan'): 'Узбекистан',
-
-        # Европа
-        ('DE', 'DEU', 'Germany', 'DE - ГЕРМАНИЯ'): 'Германия',
-        ('FO', 'FRO', 'Faroe Islands'): 'Фарерские острова',
-        ('IT', 'ITA', 'Italy', 'IT - ИТАЛИЯ'): 'Италия',
-        ('FR', 'FRA', 'France', 'FR - ФРАНЦИЯ'): 'Франция',
-        ('ES', 'ESP', 'Spain', 'ES - ИСПАНИЯ'): 'Испания',
-        ('PT', 'PRT', 'Portugal', 'PT - ПОРТУГАЛИЯ'): 'Португалия',
-        ('PL', 'POL', 'Poland', 'PL - ПОЛЬША'): 'Польша',
-        ('CZ', 'CZE', 'Czech Republic', 'CZ - ЧЕХИЯ'): 'Чехия',
-        ('SK', 'SVK', 'Slovakia', 'SK - СЛОВАКИЯ'): 'Словакия',
-        ('SI', 'SVN', 'Slovenia', 'SI - СЛОВЕНИЯ'): 'Словения',
-        ('HU', 'HUN', 'Hungary', 'HU - ВЕНГРИЯ'): 'Венгрия',
-        ('RO', 'ROU', 'Romania', 'RO - РУМЫНИЯ'): 'Румыния',
-        ('BG', 'BGR', 'Bulgaria', 'BG - БОЛГАРИЯ'): 'Болгария',
-        ('GR', 'GRC', 'Greece', 'GR - ГРЕЦИЯ'): 'Греция',
-        ('NL', 'NLD', 'Netherlands', 'NL - НИДЕРЛАНДЫ', 'НИДЕРЛАНДЫ, КОРОЛЕВСТВО'): 'Нидерланды',
-        ('BE', 'BEL', 'Belgium', 'BE - БЕЛЬГИЯ'): 'Бельгия',
-        ('LU', 'LUX', 'Luxembourg'): 'Люксембург',
-        ('IE', 'IRL', 'Ireland', 'IE - ИРЛАНДИЯ'): 'Ирландия',
-        ('GB', 'GBR', 'United Kingdom', 'GB - СОЕДИНЕННОЕ КОРОЛЕВСТВО'): 'Великобритания',
-        ('EE', 'EST', 'Estonia', 'EE - ЭСТОНИЯ'): 'Эстония',
-        ('LV', 'LVA', 'Latvia', 'LV - ЛАТВИЯ'): 'Латвия',
-        ('LT', 'LTU', 'Lithuania', 'LT - ЛИТВА'): 'Литва',
-        ('FI', 'FIN', 'Finland', 'FI - ФИНЛЯНДИЯ'): 'Финляндия',
-        ('SE', 'SWE', 'Sweden', 'SE - ШВЕЦИЯ'): 'Швеция',
-        ('NO', 'NOR', 'Norway', 'NO - НОРВЕГИЯ'): 'Норвегия',
-        ('DK', 'DNK', 'Denmark', 'DK - ДАНИЯ'): 'Дания',
-        ('CH', 'CHE', 'Switzerland', 'CH - ШВЕЙЦЕРИЯ'): 'Швейцария',
-        ('AD', 'AND', 'Andorra'): 'Андорра',
-        ('HR', 'HRV', 'Croatia', 'HR - ХОРВАТИЯ'): 'Хорватия',
-        ('SJ', 'SJM', 'Svalbard and Jan Mayen'): 'Шпицберген и Ян-Майен',
-        ('RS', 'SRB', 'Serbia', 'RS - СЕРБИЯ'): 'Сербия',
-        ('MK', 'MKD', 'Macedonia'): 'Северная Македония',
-        ('CY', 'CYP', 'Cyprus'): 'Кипр',
-        ('MD', 'MDA', 'Moldova'): 'Молдова',
-
-        # Азия
-        ('AF', 'AFG', 'Afghanistan'): 'Афганистан',
-        ('BO', 'BOL', 'Bolivia'): 'Боливия',
-        ('BD', 'BGD', 'Bangladesh'): 'Бангладеш',
-        ('AO', 'AGO', 'Angola'): 'Ангола',
-        ('CN', 'CHN', 'China', 'CN - КИТАЙ'): 'Китай',
-        ('HK', 'HKG', 'Hong Kong'): 'Гонконг',
-        ('MO', 'MAC', 'MO - МАКАО', 'Macao', 'Макао'): 'Макао',
-        ('JP', 'JPN', 'Japan', 'JP - ЯПОНИЯ'): 'Япония',
-        ('KR', 'KOR', 'South Korea', 'KR - КОРЕЯ, РЕСПУБЛИКА'): 'Южная Корея',
-        ('TW', 'TWN', 'Taiwan', 'TW - КИТАЙСКАЯ ПРОВИНЦИЯ ТАЙВАНЬ', 'TW - ТАЙВАНЬ (КИТАЙ)'): 'Тайвань',
-        ('VN', 'VNM', 'Viet Nam', 'VN - ВЬЕТНАМ'): 'Вьетнам',
-        ('TH', 'THA', 'Thailand', 'TH - ТАИЛАНД'): 'Таиланд',
-        ('SG', 'SGP', 'Singapore', 'SG - СИНГАПУР'): 'Сингапур',
-        ('MY', 'MYS', 'Malaysia', 'MY - МАЛАЙЗИЯ'): 'Малайзия',
-        ('ID', 'IDN', 'Indonesia', 'ID - ИНДОНЕЗИЯ'): 'Индонезия',
-        ('PH', 'PHL', 'Philippines', 'PH - ФИЛИППИНЫ'): 'Филиппины',
-        ('IN', 'IND', 'India', 'IN - ИНДИЯ'): 'Индия',
-        ('IR', 'IRN', 'Iran', 'IR - ИРАН (ИСЛАМСКАЯ РЕСПУБЛИКА)'): 'Иран',
-        ('IL', 'ISR', 'Israel', 'IL - ИЗРАИЛЬ'): 'Израиль',
-        ('IQ', 'IRQ', 'Iraq'): 'Ирак',
-        ('QA', 'QAT', 'Qatar'): 'Катар',
-        ('AE', 'ARE', 'United Arab Emirates'): 'Объединенные Арабские Эмираты',
-        ('TR', 'TUR', 'Turkiye', 'TR - ТУРЦИЯ'): 'Турция',
-        ('LB', 'LBN', 'Lebanon'): 'Ливан',
-        ('LK', 'LKA', 'Sri Lanka'): 'Шри-Ланка',
-        ('SA', 'SAU', 'Saudi Arabia'): 'Саудовская Аравия',
-        ('LA', 'LAO', 'Laos'): 'Лаос',
-        ('LY', 'LBY', 'Libya'): 'Ливия',
-        ('OM', 'OMN', 'Oman'): 'Оман',
-
-        # Африка
-        ('EG', 'EGY', 'Egypt'): 'Египет',
-        ('GN', 'GIN', 'Guinea'): 'Гвинея',
-        ('CD', 'COD', 'Congo (the Democratic Republic of the)'): 'Конго (ДРК)',
-        ('CG', 'COG', 'Congo (the)'): 'Конго',
-        ('MA', 'MAR', 'Morocco', 'MA - МАРОККО'): 'Марокко',
-        ('TN', 'TUN', 'Tunisia'): 'Тунис',
-        ('ZA', 'ZAF', 'South African Republic', 'ZA - ЮЖНАЯ АФРИКА', 'ZA - ЮЖНАЯАФРИКА'): 'Южно-Африканская Республика',
-        ('RW', 'RWA', 'RW - РУАНДА'): 'Руанда',
-        ('GA', 'GAB', 'Gabon'): 'Габон',
-        ('DZ', 'DZA', 'DZ - АЛЖИР'): 'Алжир',
-        ('SL', 'SLE', 'Sierra Leone'): 'Сьерра-Леоне',
-        ('SN', 'SEN', 'Senegal'): 'Сенегал',
-        ('UG', 'UGA', 'Uganda'): 'Уганда',
-
-        # Америка и Океания
-        ('US', 'USA', 'United States', 'US - СОЕДИНЕННЫЕ ШТАТЫ'): 'США',
-        ('EC', 'ECU', 'Ecuador'): 'Эквадор',
-        ('HN', 'HND', 'Honduras'): 'Гондурас',
-        ('BB', 'BRB', 'Barbados'): 'Барбадос',
-        ('CA', 'CAN', 'Canada'): 'Канада',
-        ('MX', 'MEX', 'Mexico', 'MX - МЕКСИКА'): 'Мексика',
-        ('PA', 'PAN', 'Panama', 'PA - ПАНАМА', 'Panama'): 'Панама',
-        ('BR', 'BRA', 'BR - БРАЗИЛИЯ', 'Brazil'): 'Бразилия',
-        ('AR', 'ARG', 'AR - АРГЕНТИНА', 'Argentina'): 'Аргентина',
-        ('CO', 'COL', 'Colombia'): 'Колумбия',
-        ('PE', 'PER', 'Peru'): 'Перу',
-        ('CL', 'CHL', 'Chile'): 'Чили',
-        ('AU', 'AUS', 'Australia'): 'Австралия',
-        ('SC', 'SYC', 'Seychelles'): 'Сейшельские Острова',
-        ('NZ', 'NZL', 'New Zealand'): 'Новая Зеландия',
-
-        # Прочее
-        ('EU', 'EU - СТРАНЫ ЕВРОСОЮЗА'): 'Страны Евросоюза',
-        ('Hong Kong',): 'Гонконг',
-    }
-
-    flat = {}
-    for variants, ru in groups.items():
-        for v in variants:
-            flat[str(v).strip().casefold()] = ru
-
-    def _map_val(x):
-        if isinstance(x, str):
-            return flat.get(x.strip().casefold(), x.strip())
-        return x
-
-    for col in columns_to_process:
-        if col in df.columns:
-            df[col] = df[col].map(_map_val)
-
-    return df
 # --- Функция перераспределения стоимости и веса ---
 def enrich_decl_duplicates(df: pd.DataFrame) -> pd.DataFrame:
-    df = df.copy()
-    group_keys = ['decl_number', 'decl_date', 'importer_name', 'exporter_name', 'source']
-    extended_keys = group_keys + ['prod_price_statFOB', 'prod_netw']
-
-    df['prod_quant'] = df['prod_quant'].fillna(0)
-    df['prod_price_statFOB'] = df['prod_price_statFOB'].fillna(0).round(2)
-    df['prod_netw'] = df['prod_netw'].fillna(0).round(3)
-
-    # Найдём строки, которые дублируются по extended_keys
-    df['__needs_adjustment'] = df.duplicated(subset=extended_keys, keep=False)
-    df_adj = df[df['__needs_adjustment']].copy()
-
-    # Группируем по extended_keys
-    agg = df_adj.groupby(extended_keys).agg(
-        total_quant=('prod_quant', 'sum'),
-        total_price=('prod_price_statFOB', 'first'),
-        total_netw=('prod_netw', 'first'),
-        num_rows=('prod_quant', 'count')
-    ).reset_index()
-
-    df_adj = df_adj.merge(agg, on=extended_keys, how='left')
-
-    # Пропорциональное распределение
-    df_adj['adj_price'] = df_adj.apply(
-        lambda row: (row['prod_quant'] / row['total_quant']) * row['total_price']
-        if row['total_quant'] > 0 else row['total_price'] / row['num_rows'],
-        axis=1
-    )
-    df_adj['adj_netw'] = df_adj.apply(
-        lambda row: (row['prod_quant'] / row['total_quant']) * row['total_netw']
-        if row['total_quant'] > 0 else row['total_netw'] / row['num_rows'],
-        axis=1
-    )
-    df_adj['was_adjusted'] = True
-    df_adj.drop(columns=['total_quant', 'total_price', 'total_netw', 'num_rows'], inplace=True)
-
-    # Остальные строки — без перерасчета
-    df_rest = df[~df['__needs_adjustment']].copy()
-    df_rest['adj_price'] = df_rest['prod_price_statFOB']
-    df_rest['adj_netw'] = df_rest['prod_netw']
-    df_rest['was_adjusted'] = False
-
-    # Объединение и финальные шаги
-    df_final = pd.concat([df_adj, df_rest], ignore_index=True)
-    df_final.drop(columns='__needs_adjustment', inplace=True)
-    df_final['adj_price'] = df_final['adj_price'].fillna(df_final['prod_price_statFOB'])
-    df_final['adj_netw'] = df_final['adj_netw'].fillna(df_final['prod_netw'])
-
-    return df_final
-# --- Функция тегирования аномалий ЦКГ ---
-def flag_unit_price_anomalies(df: pd.DataFrame) -> pd.DataFrame:
-    """
-    Вычисляет цену за кг и помечает записи с аномально низкой/высокой/нулевой ценой.
-    
-    Добавляет столбцы:
-        - unit_price_kg: цена за кг
-        - is_valid: True/False — признак валидности
-        - is_valid_reason: причина (если строка невалидна)
-    
-    Args:
-        df (pd.DataFrame): DataFrame с полями 'adj_price' и 'adj_netw'.
-        
-    Returns:
-        pd.DataFrame: DataFrame с новыми флагами и диагностикой.
     """
-    df = df.copy()
-    df['unit_price_kg'] = df['adj_price'] / df['adj_netw']
-
-    too_low = df['unit_price_kg'] < 1
-    too_high = df['unit_price_kg'] > 50
-    zero_or_negative = df['unit_price_kg'] <= 0
-
-    df['is_valid'] = ~(too_low | too_high | zero_or_negative)
+    Строки декларации, совпадающие по DECL_GROUP_KEYS + стоимость + вес, — одна позиция,
+    разнесённая на несколько строк: стоимость и вес делятся пропорционально prod_quant
+    (поровну, если количество не указано).
 
-    # Инициализация пустых причин
-    df['is_valid_reason'] = ''
-    df.loc[too_low, 'is_valid_reason'] = 'unit_price_kg < 1'
-    df.loc[too_high, 'is_valid_reason'] = 'unit_price_kg > 50'
-    df.loc[zero_or_negative, 'is_valid_reason'] = 'unit_price_kg <= 0'
+    Добавляет столбцы adj_price, adj_netw, was_adjusted. Считается на массивах NumPy
+    по номерам групп; строки с перерасчётом идут первыми, затем остальные (порядок
+    прежней реализации через merge + concat).
+    """
+    extended_keys = DECL_GROUP_KEYS + ['prod_price_statFOB', 'prod_netw']
+    df = df.assign(
+        prod_quant=df['prod_quant'].fillna(0),
+        prod_price_statFOB=df['prod_price_statFOB'].fillna(0).round(2),
+        prod_netw=df['prod_netw'].fillna(0).round(3),
+    )
 
-    return df
+    # Найдём строки, которые дублируются по extended_keys
+    needs_adjustment = df.duplicated(subset=extended_keys, keep=False).to_numpy()
+    adj_price = df['prod_price_statFOB'].to_numpy(dtype=float, copy=True)
+    adj_netw = df['prod_netw'].to_numpy(dtype=float, copy=True)
+
+    # Номер группы; NaN — пропуск в ключе: такие строки groupby не группирует, значения не меняются
+    rows = np.flatnonzero(needs_adjustment)
+    group = df[extended_keys].iloc[rows].groupby(extended_keys, sort=False, dropna=True).ngroup()
+    grouped = group.notna().to_numpy()
+    rows = rows[grouped]
+    group = group[grouped].to_numpy(dtype=np.int64)
+
+    if len(rows):
+        quant = df['prod_quant'].to_numpy(dtype=float)[rows]
+        total_quant = pd.Series(quant).groupby(group).sum().to_numpy()[group]
+        _, first = np.unique(group, return_index=True)
+        total_price = adj_price[rows][first][group]
+        total_netw = adj_netw[rows][first][group]
+        num_rows = np.bincount(group)[group]
+
+        # Пропорциональное распределение
+        with np.errstate(divide='ignore', invalid='ignore'):
+            share = quant / total_quant
+            by_quant = total_quant > 0
+            adj_price[rows] = np.where(by_quant, share * total_price, total_price / num_rows)
+            adj_netw[rows] = np.where(by_quant, share * total_netw, total_netw / num_rows)
+
+    df = df.assign(adj_price=adj_price, adj_netw=adj_netw, was_adjusted=needs_adjustment)
+    order = np.concatenate([np.flatnonzero(needs_adjustment), np.flatnonzero(~needs_adjustment)])
+    return df.take(order).reset_index(drop=True)
 # --- Функция тегирования компаний на основании классификации лемм ---
-def flag_suspect_companies(df: pd.DataFrame, min_records: int = 10, exclusion_threshold: float = 0.9) -> pd.DataFrame:
+def company_key(df: pd.DataFrame, role: str) -> str:
+    """Колонка, идентифицирующая компанию роли: company_id после сведения написаний, иначе название."""
+    column = company_id_column(role)
+    return column if column in df.columns else f'{role}_name'
+
+def flag_suspect_companies(df: pd.DataFrame, min_records: int = 10, exclusion_threshold: float = 0.9,
+                           companies: dict | None = None) -> pd.DataFrame:
     """
     Вычисляет долю записей с классификацией 'исключено' для каждой компании-импортера и экспортера.
+    Компания определяется по {role}_company_id (все написания одной компании вместе),
+    если его нет — по названию.
     Добавляет флаги:
         - is_bad_importer: True, если у импортера >90% исключенных записей и >= 10 строк
         - is_bad_exporter: аналогично для экспортера
@@ -257,14 +108,26 @@ def flag_suspect_companies(df: pd.DataFrame, min_records: int = 10, exclusion_th
         df (pd.DataFrame): Исходный DataFrame, содержащий колонку 'classification'
         min_records (int): Минимальное число строк для анализа
         exclusion_threshold (float): Порог доли 'исключено'
+        companies (dict | None): {'importer': {...}, 'exporter': {...}} — ключи компаний, для которых
+            пересчитать флаги (delta-режим); у остальных строк флаги не меняются
 
     Returns:
         pd.DataFrame: Обогащённый DataFrame с двумя новыми флагами
     """
     df = df.copy()
-    for entity in ['importer_name', 'exporter_name']:
+    for role in ['importer', 'exporter']:
+        entity = company_key(df, role)
+        flag_column = f'is_bad_{role}'
+        if companies is None:
+            mask = pd.Series(True, index=df.index)
+        else:
+            mask = df[entity].isin(companies.get(role, ()))
+            if flag_column not in df.columns:
+                df[flag_column] = False
+            df[flag_column] = df[flag_column].fillna(False).astype(bool)
+
         stats = (
-            df.groupby(entity)['classification']
+            df[mask].groupby(entity)['classification']
             .value_counts(normalize=False)
             .unstack(fill_value=0)
             .rename(columns=lambda x: f"_{x}")
@@ -274,30 +137,60 @@ def flag_suspect_companies(df: pd.DataFrame, min_records: int = 10, exclusion_th
         stats['excluded_ratio'] = stats.get('_исключено', 0) / stats['total']
         suspects = stats.query('total >= @min_records and excluded_ratio > @exclusion_threshold').index
 
-        flag_column = f'is_bad_{entity.split("_")[0]}'
-        df[flag_column] = df[entity].isin(suspects)
+        is_suspect = df[entity].isin(suspects).fillna(False).astype(bool)
+        if companies is None:
+            df[flag_column] = is_suspect
+        else:
+            df.loc[mask, flag_column] = is_suspect[mask]
 
     return df
 # --- Функция тегирования компаний из ручного блеклиста ---
-def apply_manual_blacklist(df: pd.DataFrame, path: str) -> pd.DataFrame:
-    df = df.copy()
-    df['is_blacklisted_manual'] = False
-    df['blacklist_reason'] = ""
+def compile_blacklist(path: str, normalizer: CompanyNormalizer | None = None) -> pd.DataFrame:
+    """
+    Индекс ручного блеклиста (company_name;type;reason, cp1251): по строке на (роль, ключ)
+    с номером строки файла и причиной. Ключи — название как в файле и, если передан
+    normalizer, его нормализованная форма (как importer_name/exporter_name после step1).
+    При повторе ключа действует последняя строка файла.
+    """
+    blacklist = pd.read_csv(path, sep=';', encoding='cp1251', dtype=str)
+    blacklist = blacklist.dropna(subset=['company_name', 'type']).reset_index(drop=True)
+    reason = blacklist['reason'] if 'reason' in blacklist.columns else pd.Series('', index=blacklist.index)
+    entries = pd.DataFrame({
+        'role': blacklist['type'].str.strip().str.lower(),
+        'key': blacklist['company_name'],
+        'position': np.arange(len(blacklist)),
+        'reason': reason.fillna(''),
+    })
+    entries = entries[entries['role'].isin(list(BLACKLIST_COLUMNS))]
+    if normalizer is not None:
+        _, normalized = normalizer.normalize_series(entries['key'])
+        entries = pd.concat([entries, entries.assign(key=normalized)], ignore_index=True)
+    return (
+        entries.dropna(subset=['key'])
+        .sort_values('position', kind='stable')
+        .drop_duplicates(['role', 'key'], keep='last')
+        .reset_index(drop=True)
+    )
+
+def apply_manual_blacklist(df: pd.DataFrame, path: str, normalizer: CompanyNormalizer | None = None) -> pd.DataFrame:
+    """
+    Помечает компании из ручного блеклиста: is_blacklisted_manual и blacklist_reason.
+    Импортёры и экспортёры сопоставляются с индексом compile_blacklist за один проход
+    (map по ключу); если строка попала под несколько записей, причина берётся из
+    последней по файлу.
+    """
+    df = df.assign(is_blacklisted_manual=False, blacklist_reason="")
     try:
-        blacklist = pd.read_csv(path)
-        blacklist = blacklist.dropna(subset=["company_name", "type"])
-        for _, row in blacklist.iterrows():
-            name = row["company_name"]
-            type_ = row["type"].lower()
-            reason = row.get("reason", "")
-            if type_ == "importer":
-                mask = df["importer_name"] == name
-            elif type_ == "exporter":
-                mask = df["exporter_name"] == name
-            else:
-                continue
-            df.loc[mask, "is_blacklisted_manual"] = True
-            df.loc[mask, "blacklist_reason"] = reason
+        entries = compile_blacklist(path, normalizer)
+        position = np.full(len(df), -1.0)
+        for role, column in BLACKLIST_COLUMNS.items():
+            keys = entries[entries['role'] == role].set_index('key')['position']
+            position = np.fmax(position, df[column].map(keys).to_numpy(dtype=float, na_value=np.nan))
+        matched = position >= 0
+        reasons = entries.drop_duplicates('position').set_index('position')['reason']
+        df['is_blacklisted_manual'] = matched
+        df.loc[matched, 'blacklist_reason'] = reasons.loc[position[matched].astype(int)].to_numpy()
+        logger.info(f"🚫 Ручной блеклист: {len(entries)} ключей, отмечено строк: {matched.sum()}")
     except Exception as e:
         logger.warning(f"⚠️ Не удалось применить ручной блеклист: {e}")
     return df
@@ -323,37 +216,125 @@ def truncate_long_prod_hsc(df: pd.DataFrame) -> pd.DataFrame:
         logger.warning("⚠️ Столбец 'prod_hsc' не найден в DataFrame — обрезка не выполнена.")
     return df
 
-# ------------------------- ОСНОВНОЙ БЛОК -------------------------- #
-
-def main():
-    try:
-        df_raw = read_excel_file(INPUT_PATH)
-        logger.info(f"✅ Прочитан файл: {INPUT_PATH} ({df_raw.shape})")
-    except Exception as e:
-        logger.error(f"❌ Ошибка при загрузке: {e}")
-        return
-
+# --- Построчная часть шага + пересчёт групп деклараций ---
+def enrich_rows(df: pd.DataFrame) -> pd.DataFrame:
     # 1. Унификация стран
-    df = unify_country_names(df_raw, ["prod_coo", "exporter_country", "importer_country"])
+    df = unify_country_names(df, COUNTRY_COLUMNS)
 
     # 2. Обрезка prod_hsc
     df = truncate_long_prod_hsc(df)
 
     # 3. Обогащение по дубликатам
-    df = enrich_decl_duplicates(df)
+    return enrich_decl_duplicates(df)
 
-    # 4. Аномалии unit_price_kg
-    df = flag_unit_price_anomalies(df)
-    logger.info(f"❗ Некорректных строк: {(~df['is_valid']).sum()}")
+def enrich_rows_partitioned(input_path: str, partitions: int = DECL_PARTITIONS) -> pd.DataFrame:
+    """
+    enrich_rows по частям: стадия раскладывается по хэшу decl_number во временные
+    Parquet-части (каждая группа DECL_GROUP_KEYS целиком попадает в одну часть), и части
+    обогащаются по одной — промежуточные данные шагов 1–3 занимают память одной части.
+    Обогащённые части склеиваются в памяти и упорядочиваются, как у enrich_rows по всей
+    стадии: строки с перерасчётом, затем остальные, каждые в порядке входа. Это не
+    out-of-core режим: последующие шаги (цены, сведение компаний, флаги) работают со всей стадией.
+    """
+    enriched = []
+    with tempfile.TemporaryDirectory(prefix='st3_parts_') as tmp_dir:
+        parts = partition_parquet(input_path, tmp_dir, 'decl_number', partitions, position_column=PARTITION_POSITION)
+        for i, path in enumerate(parts, start=1):
+            enriched.append(enrich_rows(read_stage(path)))
+            logger.info(f"Часть {i}/{len(parts)}: {len(enriched[-1])} строк")
+    df = pd.concat(enriched, ignore_index=True).sort_values(PARTITION_POSITION, ignore_index=True)
+    # у частей свои наборы категорий стран: категории строятся заново в порядке входа, как у enrich_rows
+    country_columns = [col for col in COUNTRY_COLUMNS if col in df.columns]
+    df[country_columns] = df[country_columns].astype(object)
+    df = unify_country_names(df, COUNTRY_COLUMNS)
+    adjusted = df['was_adjusted'].to_numpy(dtype=bool)
+    order = np.concatenate([np.flatnonzero(adjusted), np.flatnonzero(~adjusted)])
+    return df.take(order).drop(columns=PARTITION_POSITION).reset_index(drop=True)
+
+def enrich_incremental(df: pd.DataFrame, previous: pd.DataFrame,
+                       price_stats: pd.DataFrame | None) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Delta-режим: пересчитывает только группы деклараций (DECL_GROUP_KEYS), в которые
+    попали новые строки, и флаги компаний этих строк. Остальные строки берутся из прошлой st3.
+    Сводка цен за кг обновляется вкладом пересчитанных и удалённых строк; без сохранённой
+    сводки (price_stats=None) строится заново. Возвращает (st3, сводка цен).
+    """
+    new_rows = df[~df[ROW_KEY].isin(previous[ROW_KEY])]
+    logger.info(f"Δ новых строк: {len(new_rows)} из {len(df)}")
+
+    affected_groups = new_rows[DECL_GROUP_KEYS].drop_duplicates().assign(__affected=True)
+    affected = (
+        df[DECL_GROUP_KEYS].merge(affected_groups, on=DECL_GROUP_KEYS, how='left')['__affected']
+        .fillna(False).astype(bool).to_numpy()
+    )
+    logger.info(f"Δ пересчитывается строк в затронутых декларациях: {affected.sum()}")
+
+    kept = previous[previous[ROW_KEY].isin(df.loc[~affected, ROW_KEY])]
+    recomputed = enrich_rows(df[affected])
+    result = pd.concat([kept, recomputed], ignore_index=True).sort_values('decl_id', ignore_index=True)
+    result = unify_country_names(result, COUNTRY_COLUMNS)
+
+    # прежний вклад строк, которых нет среди сохранённых без изменений, заменяется новым
+    if price_stats is None:
+        logger.info("Δ сводка цен за кг не найдена — строится по всем строкам")
+        price_stats = price_histogram(result)
+    else:
+        replaced = previous[~previous[ROW_KEY].isin(kept[ROW_KEY])]
+        price_stats = combine_stats(price_stats, price_histogram(recomputed), price_histogram(replaced))
+    result = flag_unit_price_anomalies(result, price_stats)
+
+    # сведение написаний пересчитывается целиком: новые написания могут объединить группы,
+    # флаги пересчитываются для всех компаний, в которые попали новые строки
+    result = resolve_companies(result)
+    is_new = result[ROW_KEY].isin(new_rows[ROW_KEY])
+    companies = {
+        role: set(result.loc[is_new, company_key(result, role)].dropna()) for role in ['importer', 'exporter']
+    }
+    return flag_suspect_companies(result, companies=companies), price_stats
+
+# ------------------------- ОСНОВНОЙ БЛОК -------------------------- #
 
-    # 5. Подозрительные компании
-    df = flag_suspect_companies(df)
+def main():
+    version = stage_version(INPUT_PATH, BLACKLIST_PATH, COUNTRIES_PATH, __file__, entity_resolution.__file__,
+                            normalization_utils.__file__, countries.__file__, price_anomalies.__file__)
+    previous = load_previous(OUTPUT_PATH, version)
+    partitioned = previous is None and DECL_PARTITIONS > 1
+
+    if not partitioned:
+        try:
+            df_raw = read_stage(INPUT_PATH)
+            logger.info(f"✅ Прочитан файл: {INPUT_PATH} ({df_raw.shape})")
+        except Exception as e:
+            logger.error(f"❌ Ошибка при загрузке: {e}")
+            return
+
+    if previous is None:
+        # 1–3. Страны, prod_hsc, дубликаты
+        if partitioned:
+            logger.info(f"Обогащение по частям: {DECL_PARTITIONS} партиций decl_number")
+            df = enrich_rows_partitioned(INPUT_PATH, DECL_PARTITIONS)
+        else:
+            df = enrich_rows(df_raw)
+
+        # 4. Аномалии unit_price_kg по группам ТН ВЭД
+        price_stats = price_histogram(df)
+        df = flag_unit_price_anomalies(df, price_stats)
+
+        # 5. Сведение написаний компаний (company_id)
+        df = resolve_companies(df)
+
+        # 6. Подозрительные компании
+        df = flag_suspect_companies(df)
+    else:
+        df, price_stats = enrich_incremental(df_raw, previous, load_price_stats(PRICE_STATS_PATH, version))
+    logger.info(f"❗ Некорректных строк: {(~df['is_valid']).sum()}")
 
-    # 6. Ручной блеклист
-    df = apply_manual_blacklist(df, BLACKLIST_PATH)
+    # 7. Ручной блеклист
+    df = apply_manual_blacklist(df, BLACKLIST_PATH, CompanyNormalizer())
 
     try:
-        save_to_excel_file(df, OUTPUT_PATH)
+        save_stage(df, OUTPUT_PATH, excel_copy=SAVE_EXCEL_COPY, metadata={VERSION_KEY: version})
+        save_price_stats(price_stats, PRICE_STATS_PATH, version)
         end_time = datetime.now()
         logger.info(f"📁 Сохранено: {OUTPUT_PATH}")
         logger.info(f"🕒 Продолжительность: {end_time - start_time}")
@@ -361,4 +342,4 @@ def main():
         logger.error(f"❌ Ошибка при сохранении: {e}")
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
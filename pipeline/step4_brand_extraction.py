@@ -1,145 +1,198 @@
 # steps/step4_branding.py
 
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+import numpy as np
+import os
 import pandas as pd
-import re
 from datetime import datetime
-from thefuzz import process as fuzz_process
 from tqdm import tqdm
+from tqdm.contrib.logging import logging_redirect_tqdm
 import logging
 import traceback
 import psutil
 
-from utils.io import read_excel_file, save_to_excel_file
+from utils import brand_index
+from utils.brand_index import (
+    BRAND_DICT_CACHE_PATH, BRAND_DICT_PATH, FUZZY_TOKEN_RE, BrandDictionary, BrandIndex, load_brand_dictionary,
+)
+from utils.delta_utils import VERSION_KEY, apply_row_local, load_previous, stage_version
+from utils.io import read_stage, save_stage
 from utils.logging_utils import setup_logger
 
 # --- Логгер ---
 logger = setup_logger()
-start_time = datetime.now()
-logger.info('--- Step 4: Определение брендов ---')
 
 # --- Пути и параметры ---
-INPUT_PATH = "data/st3_enriched/st3.xlsx"
-OUTPUT_PATH = "data/st4_branded/st4.xlsx"
-BRAND_DICT_PATH = "data/utilities/dict_brand.csv"
-FUZZY_MIN_ALIAS_LEN = 3
+INPUT_PATH = "data/st3_enriched/st3.parquet"
+OUTPUT_PATH = "data/st4_branded/st4.parquet"
+SAVE_EXCEL_COPY = False  # дополнительно сохранить st4.xlsx для ручной проверки
+BRAND_COLUMNS = ['brand_extracted', 'brand_candidates', 'brand_mixed', 'brand_column_reason']
+SEARCH_FIELDS = ['prod_brand', 'prod_man', 'exporter_name', 'prod_details']
+FUZZY_FIELDS = ['prod_brand', 'prod_man']
+BRAND_WORKERS = max(1, (os.cpu_count() or 2) - 1)  # процессов; 1 — в текущем процессе
+BRAND_CHUNK_SIZE = 5_000  # уникальных сочетаний полей на задачу воркера
+UNDEFINED_BRAND = 'не определено'
+MIXED_BRAND = 'смешанный'
 
 # ---------------------------- ФУНКЦИИ ---------------------------- #
 
-def load_brand_aliases(excel_path: str) -> tuple[dict, dict]:
-    df = pd.read_csv(excel_path)
-    df = df.dropna(subset=['brand', 'aliases'])
-    df['brand'] = df['brand'].str.strip().str.lower()
-    df['match_type'] = df['match_type'].str.strip().str.lower()
-
-    exact_aliases = {}
-    fuzzy_aliases = {}
-
-    for _, row in df.iterrows():
-        brand = row['brand']
-        match_type = row['match_type']
-        aliases = [alias.strip().lower() for alias in str(row['aliases']).split(',') if alias.strip()]
-
-        for alias in aliases:
-            if match_type in ['exact', 'both']:
-                exact_aliases[alias] = brand
-            if match_type in ['fuzzy', 'both']:
-                fuzzy_aliases[alias] = brand
-
-    return exact_aliases, fuzzy_aliases
-
-def get_adaptive_threshold(token: str) -> int:
-    length = len(token)
-    if length <= 3:
-        return 100
-    elif length <= 5:
-        return 97
-    elif length <= 7:
-        return 95
-    else:
-        return 90
-
-def extract_brand_from_row(row: pd.Series, exact_dict: dict, fuzzy_dict: dict, fuzzy_keys: list[str]) -> tuple[str, list[str], str]:
+def fuzzy_tokens(df: pd.DataFrame) -> set[str]:
+    """Уникальные токены полей FUZZY_FIELDS (по уникальным значениям колонок)."""
+    tokens = set()
+    for field in FUZZY_FIELDS:
+        if field in df.columns:
+            for val in df[field].dropna().unique():
+                tokens.update(FUZZY_TOKEN_RE.findall(str(val).lower()))
+    return tokens
+
+def extract_brand_from_row(row: dict, exact_index: BrandIndex, fuzzy_brands: dict[str, str | None]) -> tuple[str, list[str], str]:
     try:
-        search_fields = ['prod_brand', 'prod_man', 'exporter_name', 'prod_details']
         found = set()
         column_reasons = []
 
         # --- Точное совпадение ---
-        for field in search_fields:
+        for field in SEARCH_FIELDS:
             val = row.get(field)
             if pd.isna(val):
                 continue
-            val = str(val).lower()[:1000]
-            for alias, brand in exact_dict.items():
-                alias_words = alias.split()
-                if all(re.search(r'\b' + re.escape(word) + r'\b', val) for word in alias_words):
-                    found.add(brand)
-                    column_reasons.append(field)
+            brands = exact_index.match(str(val).lower()[:1000])
+            if brands:
+                found |= brands
+                column_reasons.append(field)
 
         if found:
             return (
-                found.pop() if len(found) == 1 else "смешанный",
+                found.pop() if len(found) == 1 else MIXED_BRAND,
                 sorted(found),
                 ', '.join(sorted(set(column_reasons)))
             )
 
         # --- Нечеткое сопоставление ---
-        for field in ['prod_brand', 'prod_man']:
+        # токены уже сопоставлены со словарем в assign_brands (FuzzyBrandMatcher)
+        for field in FUZZY_FIELDS:
             val = row.get(field)
             if pd.isna(val):
                 continue
-            tokens = re.findall(r'\b\w{3,}\b', str(val).lower())
-            for token in tokens:
-                threshold = get_adaptive_threshold(token)
-                result = fuzz_process.extractOne(token, fuzzy_keys, score_cutoff=threshold)
-                if result:
-                    match, _, *rest = result
-                    found.add(fuzzy_dict[match])
+            for token in FUZZY_TOKEN_RE.findall(str(val).lower()):
+                brand = fuzzy_brands.get(token)
+                if brand:
+                    found.add(brand)
                     column_reasons.append(field)
 
         if not found:
-            return 'не определено', [], ', '.join(column_reasons)
+            return UNDEFINED_BRAND, [], ', '.join(column_reasons)
 
         return (
-            found.pop() if len(found) == 1 else "смешанный",
+            found.pop() if len(found) == 1 else MIXED_BRAND,
             sorted(found),
             ', '.join(sorted(set(column_reasons)))
         )
 
     except Exception as e:
         logger.error(f"Ошибка при обработке строки: {e}")
-        return 'не определено', [], ''
-
-def assign_brands(df: pd.DataFrame, exact_dict: dict, fuzzy_dict: dict) -> pd.DataFrame:
+        return UNDEFINED_BRAND, [], ''
+
+def extract_chunk(rows: list[dict], exact_index: BrandIndex, fuzzy_brands: dict[str, str]) -> list[tuple]:
+    """extract_brand_from_row для части уникальных сочетаний полей."""
+    return [extract_brand_from_row(row, exact_index, fuzzy_brands) for row in rows]
+
+# --- Пул процессов ---
+# Воркер один раз при запуске (initializer) загружает скомпилированный словарь брендов
+# из артефакта и получает найденные нечетким поиском токены; задачи содержат только
+# сочетания полей.
+_exact_index = None
+_fuzzy_brands = {}
+
+def _init_worker(dict_path: str | None, cache_path: str | None, fuzzy_brands: dict[str, str],
+                 exact_index: BrandIndex | None = None):
+    global _exact_index, _fuzzy_brands
+    # словарь, собранный не из файла (dict_path=None), передаётся воркеру целиком
+    if exact_index is None:
+        exact_index = load_brand_dictionary(dict_path, cache_path).exact_index
+    _exact_index = exact_index
+    _fuzzy_brands = fuzzy_brands
+
+def _extract_chunk(rows: list[dict]) -> list[tuple]:
+    return extract_chunk(rows, _exact_index, _fuzzy_brands)
+
+def extract_unique(rows: list[dict], brand_dict: BrandDictionary, fuzzy_brands: dict[str, str],
+                   workers: int = BRAND_WORKERS, chunk_size: int = BRAND_CHUNK_SIZE) -> list[tuple]:
+    """
+    Бренды для уникальных сочетаний полей частями по chunk_size; при workers > 1 —
+    в пуле процессов. Порядок результатов совпадает с порядком rows.
+    """
+    chunks = [rows[i:i + chunk_size] for i in range(0, len(rows), chunk_size)]
+    parts = [None] * len(chunks)
+    with logging_redirect_tqdm(), tqdm(total=len(rows), desc="🔍 Поиск брендов", unit="сочет.") as bar:
+        if workers <= 1 or len(chunks) <= 1:
+            for i, chunk in enumerate(chunks):
+                parts[i] = extract_chunk(chunk, brand_dict.exact_index, fuzzy_brands)
+                bar.update(len(chunk))
+        else:
+            with ProcessPoolExecutor(max_workers=min(workers, len(chunks)), mp_context=get_context('spawn'),
+                                     initializer=_init_worker,
+                                     initargs=(brand_dict.path, brand_dict.cache_path, fuzzy_brands,
+                                               None if brand_dict.path else brand_dict.exact_index)) as pool:
+                futures = {pool.submit(_extract_chunk, chunk): i for i, chunk in enumerate(chunks)}
+                for future in as_completed(futures):
+                    i = futures[future]
+                    parts[i] = future.result()
+                    bar.update(len(chunks[i]))
+    return [result for part in parts for result in part]
+
+def assign_brands(df: pd.DataFrame, brand_dict: BrandDictionary,
+                  workers: int = BRAND_WORKERS, chunk_size: int = BRAND_CHUNK_SIZE) -> pd.DataFrame:
+    """
+    Определяет бренд по полям SEARCH_FIELDS. Одни и те же сочетания полей повторяются
+    во многих декларациях, поэтому бренд считается один раз на уникальное сочетание,
+    а результат раскладывается по строкам по номеру сочетания.
+    """
     df = df.copy()
-    fuzzy_keys = [alias for alias in fuzzy_dict.keys() if len(alias) >= FUZZY_MIN_ALIAS_LEN]
-    tqdm.pandas(desc="🔍 Поиск брендов")
-
-    logger.info("▶️ Обработка строк...")
-    results = df.progress_apply(lambda row: extract_brand_from_row(row, exact_dict, fuzzy_dict, fuzzy_keys), axis=1)
+    tokens = fuzzy_tokens(df)
+    logger.info(f"▶️ Нечеткое сопоставление: {len(tokens)} уникальных токенов")
+    fuzzy_brands = {token: brand for token, brand in brand_dict.fuzzy_matcher.match_tokens(tokens).items() if brand}
+
+    fields = df.reindex(columns=SEARCH_FIELDS)
+    codes = fields.groupby(SEARCH_FIELDS, dropna=False, sort=False).ngroup().to_numpy()
+    _, first = np.unique(codes, return_index=True)
+    rows = fields.iloc[first].to_dict('records')
+    logger.info(f"▶️ Уникальных сочетаний полей: {len(rows)} из {len(df)}")
+    results = extract_unique(rows, brand_dict, fuzzy_brands, workers, chunk_size)
     logger.info("✅ Обработка завершена")
 
-    df['brand_extracted'] = results.apply(lambda x: x[0])
-    df['brand_candidates'] = results.apply(lambda x: ', '.join(x[1]) if x[1] else '')
-    df['brand_mixed'] = df['brand_extracted'].apply(lambda x: x == 'смешанный')
-    df['brand_column_reason'] = results.apply(lambda x: x[2])
+    extracted = np.array([r[0] for r in results], dtype=object)
+    candidates = np.array([', '.join(r[1]) for r in results], dtype=object)
+    reasons = np.array([r[2] for r in results], dtype=object)
+    df['brand_extracted'] = extracted[codes]
+    df['brand_candidates'] = candidates[codes]
+    df['brand_mixed'] = (extracted == MIXED_BRAND)[codes]
+    df['brand_column_reason'] = reasons[codes]
 
     return df
 
 # ------------------------- ОСНОВНОЙ БЛОК -------------------------- #
 
 def main():
+    start_time = datetime.now()
+    logger.info('--- Step 4: Определение брендов ---')
     try:
-        exact_dict, fuzzy_dict = load_brand_aliases(BRAND_DICT_PATH)
-        df = read_excel_file(INPUT_PATH)
+        brand_dict = load_brand_dictionary(BRAND_DICT_PATH, BRAND_DICT_CACHE_PATH)
+        logger.info(f"📚 Словарь брендов: {len(brand_dict.exact_aliases)} точных и {len(brand_dict.fuzzy_aliases)} нечетких алиасов")
+        df = read_stage(INPUT_PATH)
         logger.info(f"📥 Прочитано: {INPUT_PATH} — {df.shape}")
 
-        df_with_brands = assign_brands(df, exact_dict, fuzzy_dict)
+        # В delta-режиме бренды ищутся только для новых строк
+        version = stage_version(INPUT_PATH, BRAND_DICT_PATH, __file__, brand_index.__file__)
+        previous = load_previous(OUTPUT_PATH, version, BRAND_COLUMNS)
+        df_with_brands = apply_row_local(
+            df, previous, lambda part: assign_brands(part, brand_dict), BRAND_COLUMNS
+        )
 
         mem_used = psutil.Process().memory_info().rss / 1024 / 1024
         logger.info(f"📊 Использовано памяти: {mem_used:.1f} MB")
 
-        save_to_excel_file(df_with_brands, OUTPUT_PATH)
+        save_stage(df_with_brands, OUTPUT_PATH, excel_copy=SAVE_EXCEL_COPY, metadata={VERSION_KEY: version})
         logger.info(f"📁 Сохранено: {OUTPUT_PATH}")
 
         end_time = datetime.now()
@@ -1,14 +1,20 @@
 import re
 from datetime import datetime
 import logging
+import numpy as np
 import pandas as pd
-from utils.io import read_excel_file, save_to_excel_file
+from utils.delta_utils import VERSION_KEY, apply_row_local, load_previous, stage_version
+from utils.io import read_stage, save_stage
 from utils.logging_utils import setup_logger
 
 
 # --- Пути ---
-INPUT_PATH = 'data/st4_branded/st4.xlsx'
-OUTPUT_PATH = 'data/st5_attributes/st5.xlsx'
+INPUT_PATH = 'data/st4_branded/st4.parquet'
+OUTPUT_PATH = 'data/st5_attributes/st5.parquet'
+SAVE_EXCEL_COPY = False  # дополнительно сохранить st5.xlsx для ручной проверки
+ATTRIBUTE_COLUMNS = [
+    'attribute_dn', 'attribute_pn', 'attribute_material', 'attribute_prodtype', 'attribute_sealing'
+]
 
 # --- Логгер ---
 logger = setup_logger()
@@ -54,43 +60,77 @@ SEAL_PATTERNS = {
     "NBR": ['nbr', 'каучук']
 }
 
-def parse_numeric_attribute(text: str, keys: list[str]) -> str | None:
-    if not isinstance(text, str):
-        try:
-            text = str(text)
-        except:
-            return None
-    text = text.lower()
-    for key in keys:
-        pattern = rf"{key}\s*[:\-]?\s*(\d{{1,4}})"
-        match = re.search(pattern, text)
-        if match:
-            return match.group(1)
-    return None
-
-def parse_from_patterns(text: str, patterns_dict: dict) -> str | None:
-    """Поиск нормализованного значения по словарю синонимов."""
-    if not isinstance(text, str):
-        return None
-    text = text.lower()
-    for normalized_value, synonyms in patterns_dict.items():
-        for synonym in synonyms:
-            if synonym.lower() in text:
-                return normalized_value
-    return None
+# --- Движок атрибутов ---
+# Все пять атрибутов извлекаются одной регуляркой за один проход по уникальным описаниям.
+# Каждый ключ DN/PN и каждое нормализованное значение материала/типа/уплотнения — своя
+# именованная группа внутри опережающей проверки от начала текста: (?=.*?шаблон) находит
+# первое вхождение, как re.search. Приоритет прежний: из найденных берётся первый ключ
+# (значение) в порядке списка, а не самое левое вхождение в тексте.
+NUMERIC_ATTRIBUTES = {'attribute_dn': DN_KEYS, 'attribute_pn': PN_KEYS}
+PATTERN_ATTRIBUTES = {
+    'attribute_material': MATERIAL_PATTERNS,
+    'attribute_prodtype': PRODUCT_TYPE_PATTERNS,
+    'attribute_sealing': SEAL_PATTERNS,
+}
+
+def compile_attribute_pattern() -> tuple[re.Pattern, dict[str, list[tuple[str, str | None]]]]:
+    """
+    Общая регулярка атрибутов и группы каждого атрибута в порядке приоритета:
+    {колонка: [(имя группы, нормализованное значение или None для числа), ...]}.
+    """
+    parts, groups = [], {}
+    for column, keys in NUMERIC_ATTRIBUTES.items():
+        groups[column] = []
+        for key in keys:
+            name = f'g{len(parts)}'
+            parts.append(f'(?:(?=.*?{key}\\s*[:\\-]?\\s*(?P<{name}>\\d{{1,4}}))|)')
+            groups[column].append((name, None))
+    for column, patterns_dict in PATTERN_ATTRIBUTES.items():
+        groups[column] = []
+        for normalized_value, synonyms in patterns_dict.items():
+            name = f'g{len(parts)}'
+            alternatives = '|'.join(re.escape(synonym.lower()) for synonym in synonyms)
+            parts.append(f'(?:(?=.*?(?:{alternatives})(?P<{name}>))|)')
+            groups[column].append((name, normalized_value))
+    return re.compile(r'(?s)\A' + ''.join(parts)), groups
+
+ATTRIBUTE_PATTERN, ATTRIBUTE_GROUPS = compile_attribute_pattern()
+
+def extract_attributes(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Заполняет ATTRIBUTE_COLUMNS по prod_details. Описания повторяются, поэтому
+    регулярка применяется к уникальным значениям, результат раскладывается по строкам.
+    """
+    codes, uniques = pd.factorize(df['prod_details'], use_na_sentinel=False)
+    uniques = pd.Series(uniques, dtype=object)
+    is_text = uniques.map(lambda v: isinstance(v, str)).to_numpy(dtype=bool)
+    # DN/PN ищутся и в нетекстовых значениях (как str(x)), словарные атрибуты — только в тексте
+    found = uniques.map(str).str.lower().str.extract(ATTRIBUTE_PATTERN)
+    logger.info(f"Уникальных описаний: {len(uniques)} из {len(df)}")
+
+    for column, groups in ATTRIBUTE_GROUPS.items():
+        values = np.full(len(uniques), None, dtype=object)
+        pending = np.ones(len(uniques), dtype=bool)
+        for name, normalized_value in groups:
+            hit = pending & found[name].notna().to_numpy()
+            values[hit] = found[name].to_numpy(dtype=object)[hit] if normalized_value is None else normalized_value
+            pending &= ~hit
+        if groups[0][1] is not None:
+            values[~is_text] = None
+        df[column] = values[codes]
+    return df
 
 def main():
     try:
-        df = read_excel_file(INPUT_PATH)
+        df = read_stage(INPUT_PATH)
         logger.info(f"📥 Прочитано: {INPUT_PATH} — {df.shape}")
 
-        df["attribute_dn"] = df['prod_details'].apply(lambda x: parse_numeric_attribute(x, DN_KEYS))
-        df["attribute_pn"] = df['prod_details'].apply(lambda x: parse_numeric_attribute(x, PN_KEYS))
-        df["attribute_material"] = df['prod_details'].apply(lambda x: parse_from_patterns(x, MATERIAL_PATTERNS))
-        df["attribute_prodtype"] = df['prod_details'].apply(lambda x: parse_from_patterns(x, PRODUCT_TYPE_PATTERNS))
-        df["attribute_sealing"] = df['prod_details'].apply(lambda x: parse_from_patterns(x, SEAL_PATTERNS))
+        # В delta-режиме атрибуты извлекаются только для новых строк
+        version = stage_version(INPUT_PATH, __file__)
+        previous = load_previous(OUTPUT_PATH, version, ATTRIBUTE_COLUMNS)
+        df = apply_row_local(df, previous, extract_attributes, ATTRIBUTE_COLUMNS)
 
-        save_to_excel_file(df, OUTPUT_PATH)
+        save_stage(df, OUTPUT_PATH, excel_copy=SAVE_EXCEL_COPY, metadata={VERSION_KEY: version})
         logger.info(f"📁 Сохранено: {OUTPUT_PATH}")
 
         end_time = datetime.now()
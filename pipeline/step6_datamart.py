@@ -2,14 +2,15 @@
 
 from datetime import datetime
 
-from utils.io import read_excel_file, save_to_excel_file
+from utils.io import read_stage, save_stage
 from utils.logging_utils import setup_logger
 
 logger = setup_logger()
 
-INPUT_PATH = 'data/st5_attributes/st5.xlsx'
+INPUT_PATH = 'data/st5_attributes/st5.parquet'
 OUTPUT_PATH = 'data/st6_datamart/st6.xlsx'
 COLUMNS_TO_DROP = [
+    'row_key',
     'brand_candidates', 'brand_mixed', 'brand_column_reason',
     'was_adjusted', '__same_price','__same_netw',
     'is_valid', 'is_valid_reason',
@@ -61,10 +62,10 @@ def main():
     start_time = datetime.now()
     logger.info('--- Step 6: Формирование датамарта ---')
 
-    df = read_excel_file(INPUT_PATH)
+    df = read_stage(INPUT_PATH)
     df = add_is_relevant_column(df)
     df = df.drop(columns=COLUMNS_TO_DROP, errors='ignore')
-    save_to_excel_file(df, OUTPUT_PATH)
+    save_stage(df, OUTPUT_PATH)
 
     end_time = datetime.now()
     logger.info(f'Время начала: {start_time}')
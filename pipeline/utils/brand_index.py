@@ -0,0 +1,260 @@
+# utils/brand_index.py
+
+import os
+import pickle
+import re
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+from rapidfuzz import fuzz, process
+from rapidfuzz.utils import default_process
+
+from utils.delta_utils import file_digest
+
+# --- Словарь брендов ---
+# data/utilities/dict_brand.csv: brand;aliases;match_type (cp1251), алиасы через запятую,
+# match_type — exact, fuzzy или both. Скомпилированный словарь (индексы точного и нечеткого
+# поиска) сохраняется в data/cache/brand_dict.pickle с ключом — хэшем CSV и кода этого
+# модуля: при правке словаря или кода артефакт пересобирается автоматически.
+BRAND_DICT_PATH = 'data/utilities/dict_brand.csv'
+BRAND_DICT_ENCODING = 'cp1251'
+BRAND_DICT_CACHE_PATH = 'data/cache/brand_dict.pickle'
+EXACT_MODES = ('exact', 'both')
+FUZZY_MODES = ('fuzzy', 'both')
+
+TOKEN_RE = re.compile(r'\w+')
+
+class BrandIndex:
+    """
+    Точный поиск брендов по словарю алиасов {алиас: бренд}. Алиас найден, если каждое
+    его слово (alias.split()) встречается в тексте как отдельное слово — эквивалент
+    all(re.search(rf"\\b{re.escape(word)}\\b", text) for word in alias.split()).
+
+    Индекс строится один раз: обратный индекс токен → алиасы (по одному ключевому
+    токену алиаса). Текст разбивается на токены \\w+ один раз, и проверяются только
+    алиасы, ключевой токен которых в тексте есть. Слово из одних \\w-символов найдено
+    ровно тогда, когда оно есть среди токенов; слова с другими символами («ari-armaturen»,
+    «s.p.a.») проверяются заранее скомпилированной регуляркой с \\b, как раньше.
+
+    Пример:
+        index = BrandIndex(exact_aliases)
+        brands = index.match(text)  # {бренд, ...}
+    """
+
+    def __init__(self, aliases: dict[str, str]):
+        self.aliases = dict(aliases)
+        self._entries = []     # (бренд, слова-токены, регулярки для остальных слов)
+        self._index = {}       # ключевой токен -> номера алиасов
+        self._unindexed = []   # алиасы без слов-токенов: проверяются для любого текста
+        for alias, brand in self.aliases.items():
+            words = alias.split()
+            tokens = frozenset(word for word in words if TOKEN_RE.fullmatch(word))
+            patterns = tuple(
+                re.compile(r'\b' + re.escape(word) + r'\b') for word in dict.fromkeys(words)
+                if word not in tokens
+            )
+            i = len(self._entries)
+            self._entries.append((brand, tokens, patterns))
+            if tokens:
+                # самый длинный токен алиаса обычно и самый редкий в текстах
+                key = max(sorted(tokens), key=len)
+                self._index.setdefault(key, []).append(i)
+            elif patterns:
+                self._unindexed.append(i)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def match(self, text: str) -> set[str]:
+        """Бренды, все слова хотя бы одного алиаса которых есть в тексте."""
+        tokens = set(TOKEN_RE.findall(text))
+        candidates = [i for token in tokens for i in self._index.get(token, ())]
+        found = set()
+        for i in candidates + self._unindexed:
+            brand, words, patterns = self._entries[i]
+            if brand in found:
+                continue
+            if words <= tokens and all(p.search(text) for p in patterns):
+                found.add(brand)
+        return found
+
+# --- Нечеткий поиск ---
+# Токены prod_brand/prod_man сравниваются с алиасами fuzzy-словаря по fuzz.WRatio.
+# Уникальные токены всего набора оцениваются одной матрицей rapidfuzz.process.cdist
+# (в несколько потоков), каждый токен разрешается один раз. Предобработка строк
+# повторяет thefuzz.process.extractOne, которым шаг пользовался раньше: нижний регистр,
+# не буквы/цифры → пробел, символы U+0080–U+00FF отбрасываются.
+FUZZY_TOKEN_RE = re.compile(r'\b\w{3,}\b')
+FUZZY_MIN_ALIAS_LEN = 3
+FUZZY_SCORER = fuzz.WRatio
+FUZZY_WORKERS = -1           # потоков cdist (-1 — все ядра)
+FUZZY_BATCH = 5_000          # токенов матрицы сходства за один вызов cdist
+# порог сходства по длине токена: (максимальная длина, порог); длиннее — FUZZY_DEFAULT_THRESHOLD
+ADAPTIVE_THRESHOLDS = [(3, 100), (5, 97), (7, 95)]
+FUZZY_DEFAULT_THRESHOLD = 90
+_LATIN1_TABLE = {i: None for i in range(128, 256)}
+
+def _fuzzy_process(value: str) -> str:
+    return default_process(value.translate(_LATIN1_TABLE))
+
+def adaptive_thresholds(tokens: list[str]) -> np.ndarray:
+    """Порог сходства для каждого токена: короткие токены требуют почти полного совпадения."""
+    lengths = np.fromiter(map(len, tokens), dtype=np.int64, count=len(tokens))
+    return np.select(
+        [lengths <= max_len for max_len, _ in ADAPTIVE_THRESHOLDS],
+        [threshold for _, threshold in ADAPTIVE_THRESHOLDS],
+        FUZZY_DEFAULT_THRESHOLD,
+    )
+
+class FuzzyBrandMatcher:
+    """
+    Нечеткий поиск бренда по токену: лучший алиас (первый при равенстве оценок)
+    с оценкой не ниже адаптивного порога — как extractOne(token, aliases, score_cutoff=порог).
+
+    Пример:
+        matcher = FuzzyBrandMatcher(fuzzy_aliases)
+        brands = matcher.match_tokens(tokens)  # {токен: бренд или None}
+    """
+
+    def __init__(self, aliases: dict[str, str], workers: int = FUZZY_WORKERS):
+        self.keys = [alias for alias in aliases if len(alias) >= FUZZY_MIN_ALIAS_LEN]
+        self.brands = [aliases[alias] for alias in self.keys]
+        self.workers = workers
+        self._choices = [_fuzzy_process(alias) for alias in self.keys]
+        self._cache = {}
+
+    def match_tokens(self, tokens) -> dict[str, str | None]:
+        """Бренд для каждого токена (None — совпадения нет); уже оцененные токены берутся из кэша."""
+        tokens = list(dict.fromkeys(tokens))
+        new = [token for token in tokens if token not in self._cache]
+        if new and self._choices:
+            queries = [_fuzzy_process(default_process(token)) for token in new]
+            thresholds = adaptive_thresholds(new)
+            for start in range(0, len(new), FUZZY_BATCH):
+                scores = process.cdist(
+                    queries[start:start + FUZZY_BATCH], self._choices,
+                    scorer=FUZZY_SCORER, dtype=np.float64, workers=self.workers,
+                )
+                best = scores.argmax(axis=1)
+                passed = scores[np.arange(len(best)), best] >= thresholds[start:start + FUZZY_BATCH]
+                for token, i, ok in zip(new[start:start + FUZZY_BATCH], best, passed):
+                    self._cache[token] = self.brands[i] if ok else None
+        else:
+            self._cache.update(dict.fromkeys(new))
+        return {token: self._cache[token] for token in tokens}
+
+# --- Скомпилированный словарь ---
+def read_brand_entries(path: str = BRAND_DICT_PATH) -> list[tuple[int, str, str, str]]:
+    """Алиасы словаря в порядке файла: (строка файла, бренд, алиас, match_type); всё в нижнем регистре."""
+    df = pd.read_csv(path, sep=';', encoding=BRAND_DICT_ENCODING, dtype=str)
+    df = df.dropna(subset=['brand', 'aliases'])
+    brands = df['brand'].str.strip().str.lower()
+    match_types = df['match_type'].str.strip().str.lower()
+    entries = []
+    for line, brand, aliases, match_type in zip(df.index + 2, brands, df['aliases'], match_types):
+        for alias in aliases.split(','):
+            if alias.strip():
+                entries.append((int(line), brand, alias.strip().lower(), match_type))
+    return entries
+
+def load_brand_aliases(path: str = BRAND_DICT_PATH) -> tuple[dict, dict]:
+    """({алиас: бренд} для точного поиска, {алиас: бренд} для нечеткого); при повторе алиаса действует последний."""
+    exact_aliases, fuzzy_aliases = {}, {}
+    for _, brand, alias, match_type in read_brand_entries(path):
+        if match_type in EXACT_MODES:
+            exact_aliases[alias] = brand
+        if match_type in FUZZY_MODES:
+            fuzzy_aliases[alias] = brand
+    return exact_aliases, fuzzy_aliases
+
+class BrandDictionary:
+    """Скомпилированный словарь брендов: индекс точного поиска и нечеткий поиск."""
+
+    def __init__(self, exact_aliases: dict[str, str], fuzzy_aliases: dict[str, str]):
+        self.exact_aliases = exact_aliases
+        self.fuzzy_aliases = fuzzy_aliases
+        self.exact_index = BrandIndex(exact_aliases)
+        self.fuzzy_matcher = FuzzyBrandMatcher(fuzzy_aliases)
+        self.path = None
+        self.cache_path = None
+
+    @classmethod
+    def from_csv(cls, path: str = BRAND_DICT_PATH) -> 'BrandDictionary':
+        dictionary = cls(*load_brand_aliases(path))
+        dictionary.path = path
+        return dictionary
+
+def brand_dictionary_key(path: str = BRAND_DICT_PATH) -> str:
+    """Ключ артефакта: хэш CSV словаря и кода компиляции."""
+    return f'{file_digest(path)}:{file_digest(__file__)}'
+
+def read_brand_artifact(cache_path: str, key: str) -> BrandDictionary | None:
+    """Скомпилированный словарь из артефакта, если он собран для того же ключа; иначе None."""
+    if not cache_path or not os.path.exists(cache_path):
+        return None
+    try:
+        with open(cache_path, 'rb') as f:
+            artifact = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+        return None
+    return artifact['dictionary'] if artifact.get('key') == key else None
+
+def save_brand_artifact(dictionary: BrandDictionary, cache_path: str, key: str):
+    os.makedirs(os.path.dirname(cache_path) or '.', exist_ok=True)
+    tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump({'key': key, 'dictionary': dictionary}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, cache_path)
+
+def load_brand_dictionary(path: str = BRAND_DICT_PATH,
+                          cache_path: str | None = BRAND_DICT_CACHE_PATH) -> BrandDictionary:
+    """
+    Словарь брендов из артефакта cache_path; если артефакта нет или он собран по другой
+    версии CSV/кода — компилируется из path и сохраняется. cache_path=None — без артефакта.
+    """
+    key = brand_dictionary_key(path)
+    dictionary = read_brand_artifact(cache_path, key)
+    if dictionary is None:
+        dictionary = BrandDictionary.from_csv(path)
+        if cache_path:
+            save_brand_artifact(dictionary, cache_path, key)
+    dictionary.path, dictionary.cache_path = path, cache_path
+    return dictionary
+
+# --- Проверка словаря ---
+def validate_brand_entries(entries: list[tuple[int, str, str, str]]) -> dict[str, list[str]]:
+    """
+    Замечания к словарю по категориям:
+        - duplicates: алиас повторяется в одном режиме поиска (действует последняя строка)
+        - exact_and_fuzzy: алиас в разных строках задан для точного и для нечеткого поиска
+        - short_fuzzy: алиасы нечеткого поиска короче FUZZY_MIN_ALIAS_LEN (не используются)
+        - unknown_match_type: match_type не exact/fuzzy/both (алиас не используется)
+    """
+    issues = {'duplicates': [], 'exact_and_fuzzy': [], 'short_fuzzy': [], 'unknown_match_type': []}
+    by_mode = {'exact': defaultdict(list), 'fuzzy': defaultdict(list)}
+    for line, brand, alias, match_type in entries:
+        if match_type in EXACT_MODES:
+            by_mode['exact'][alias].append((line, brand))
+        if match_type in FUZZY_MODES:
+            by_mode['fuzzy'][alias].append((line, brand))
+            if len(alias) < FUZZY_MIN_ALIAS_LEN:
+                issues['short_fuzzy'].append(f"'{alias}' ({brand}): строка {line}")
+        if match_type not in EXACT_MODES + FUZZY_MODES:
+            issues['unknown_match_type'].append(f"'{alias}' ({brand}): строка {line}, match_type={match_type!r}")
+
+    for mode, aliases in by_mode.items():
+        for alias, rows in aliases.items():
+            if len(rows) > 1:
+                lines = ', '.join(str(line) for line, _ in rows)
+                brands = ', '.join(dict.fromkeys(brand for _, brand in rows))
+                issues['duplicates'].append(f"'{alias}' ({mode}): строки {lines}; бренды: {brands}; действует {rows[-1][1]}")
+
+    for alias, exact_rows in by_mode['exact'].items():
+        fuzzy_rows = by_mode['fuzzy'].get(alias)
+        if fuzzy_rows and {line for line, _ in exact_rows} != {line for line, _ in fuzzy_rows}:
+            issues['exact_and_fuzzy'].append(
+                f"'{alias}': exact — строки {', '.join(str(line) for line, _ in exact_rows)} ({exact_rows[-1][1]}), "
+                f"fuzzy — строки {', '.join(str(line) for line, _ in fuzzy_rows)} ({fuzzy_rows[-1][1]})"
+            )
+    return issues
@@ -0,0 +1,71 @@
+# utils/countries.py
+
+import csv
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+# --- Справочник стран ---
+# Варианты написаний (ISO alpha-2/alpha-3, английские названия, таможенные «KZ - КАЗАХСТАН»)
+# хранятся в data/utilities/countries.csv: region;country;variant. Сравнение без учёта
+# регистра и пробелов по краям; при повторе варианта действует последняя строка файла.
+COUNTRIES_PATH = 'data/utilities/countries.csv'
+COUNTRY_COLUMNS = ["prod_coo", "exporter_country", "importer_country"]
+
+def _variant_key(value: str) -> str:
+    return value.strip().casefold()
+
+class CountryRegistry:
+    """
+    Унификация названий стран по справочнику. Значения колонки сопоставляются
+    только по уникальным значениям, результат — категориальная колонка.
+
+    Пример:
+        registry = load_country_registry()
+        df = registry.apply(df, COUNTRY_COLUMNS)
+    """
+
+    def __init__(self, variants: dict[str, str]):
+        self.variants = {_variant_key(variant): country for variant, country in variants.items()}
+
+    @classmethod
+    def from_csv(cls, path: str = COUNTRIES_PATH) -> 'CountryRegistry':
+        with open(path, encoding='utf-8', newline='') as f:
+            return cls({row['variant']: row['country'] for row in csv.DictReader(f, delimiter=';')})
+
+    def unify(self, value):
+        """Название страны для одного значения; неизвестные строки — без пробелов по краям."""
+        if isinstance(value, str):
+            return self.variants.get(_variant_key(value), value.strip())
+        return value
+
+    def unify_series(self, values: pd.Series) -> pd.Series:
+        """Унифицирует колонку: считаются только уникальные значения, результат — category."""
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            codes, uniques = values.cat.codes.to_numpy(), list(values.cat.categories)
+        else:
+            codes, uniques = pd.factorize(values)
+        # как в Parquet-стадиях: нестроковые значения (коды-числа) хранятся строками
+        unified = [value if isinstance(value, str) else str(value) for value in map(self.unify, uniques)]
+        categories = pd.Index(unified, dtype=object).unique()
+        remap = categories.get_indexer(unified)
+        new_codes = np.where(codes >= 0, remap[codes] if len(remap) else -1, -1)
+        return pd.Series(pd.Categorical.from_codes(new_codes, categories), index=values.index, name=values.name)
+
+    def apply(self, df: pd.DataFrame, columns: list[str] = COUNTRY_COLUMNS) -> pd.DataFrame:
+        """Унифицирует страны в колонках columns (отсутствующие колонки пропускаются)."""
+        for col in columns:
+            if col in df.columns:
+                df[col] = self.unify_series(df[col])
+        return df
+
+@lru_cache(maxsize=None)
+def load_country_registry(path: str = COUNTRIES_PATH) -> CountryRegistry:
+    """Справочник стран; файл читается один раз на процесс."""
+    return CountryRegistry.from_csv(path)
+
+def unify_country_names(df: pd.DataFrame, columns: list[str] = COUNTRY_COLUMNS,
+                        path: str = COUNTRIES_PATH) -> pd.DataFrame:
+    """Унифицирует страны в колонках df по справочнику path (см. CountryRegistry)."""
+    return load_country_registry(path).apply(df, columns)
@@ -0,0 +1,99 @@
+# utils/delta_utils.py
+
+import hashlib
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from utils.io import read_parquet_file, read_parquet_metadata
+
+# --- Инкрементальный (delta) режим ---
+# Каждая строка st1 получает row_key — хэш (source, decl_number, decl_date, содержимое строки)
+# с номером повтора одинаковых строк, поэтому ключ уникален и стабилен между запусками.
+# В delta-режиме построчные шаги (1, 2, 4, 5) считают только строки с новым row_key,
+# а результаты по старым берут из сохранённой стадии; step3 пересчитывает только
+# затронутые группы деклараций и компании.
+# Включается переменной окружения CUSTBASE_DELTA_MODE=1 (или `python main.py --delta`).
+DELTA_MODE = os.environ.get('CUSTBASE_DELTA_MODE') == '1'
+
+ROW_KEY = 'row_key'
+KEY_COLUMNS = ['source', 'decl_number', 'decl_date']
+VERSION_KEY = 'custbase_version'
+
+logger = logging.getLogger(__name__)
+
+def compute_row_keys(df: pd.DataFrame, content_columns: list[str], seen: dict) -> np.ndarray:
+    """
+    row_key для строк df. seen — счётчик уже встреченных хэшей содержимого
+    (общий для всех батчей одного прогона), чтобы одинаковые строки получали разные ключи.
+    """
+    columns = KEY_COLUMNS + [c for c in content_columns if c not in KEY_COLUMNS]
+    content = pd.util.hash_pandas_object(df[columns], index=False).to_numpy()
+    occurrence = np.empty(len(content), dtype=np.uint64)
+    for i, h in enumerate(content):
+        n = seen.get(h, 0)
+        occurrence[i] = n
+        seen[h] = n + 1
+    keys = pd.DataFrame({'content': content, 'occurrence': occurrence})
+    return pd.util.hash_pandas_object(keys, index=False).to_numpy()
+
+# --- Версии стадий ---
+def file_digest(path) -> str:
+    """sha256 содержимого файла (читается блоками); общий для main.py, step0 и версий стадий."""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def stage_version(upstream_path, *dependency_paths) -> str:
+    """
+    Версия правил стадии: версия входной стадии + хэш справочников и кода шага.
+    Если версия изменилась (правили словарь или код), сохранённые результаты
+    недействительны и шаг пересчитывается целиком.
+    """
+    h = hashlib.sha256()
+    if upstream_path and os.path.exists(upstream_path):
+        h.update(read_parquet_metadata(upstream_path).get(VERSION_KEY, '').encode())
+    for path in dependency_paths:
+        h.update(file_digest(path).encode())
+    return h.hexdigest()
+
+def load_previous(stage_path, version: str, columns: list[str] | None = None) -> pd.DataFrame | None:
+    """
+    Прошлый результат шага для delta-режима. None — если delta выключен,
+    стадии нет или она посчитана по другой версии правил.
+    """
+    if not DELTA_MODE or not os.path.exists(stage_path):
+        return None
+    if read_parquet_metadata(stage_path).get(VERSION_KEY) != version:
+        return None
+    if columns is not None:
+        columns = [ROW_KEY] + [c for c in columns if c != ROW_KEY]
+    return read_parquet_file(stage_path, columns=columns)
+
+def apply_row_local(df: pd.DataFrame, previous: pd.DataFrame | None, compute, columns: list[str]) -> pd.DataFrame:
+    """
+    Применяет построчный шаг compute(df) -> df (+ columns), считая только новые строки.
+
+    Args:
+        df: полный вход шага (с колонкой row_key)
+        previous: прошлый выход шага (row_key + columns) или None — полный пересчёт
+        compute: функция шага, добавляющая columns
+        columns: колонки, которые добавляет шаг
+    """
+    if previous is None:
+        return compute(df)
+
+    new_mask = ~df[ROW_KEY].isin(previous[ROW_KEY])
+    logger.info(f'Δ новых строк: {new_mask.sum()} из {len(df)}')
+    lookup = previous[[ROW_KEY] + columns]
+    if new_mask.any():
+        computed = compute(df[new_mask].copy())[[ROW_KEY] + columns]
+        lookup = pd.concat([lookup, computed], ignore_index=True)
+    lookup = lookup.drop_duplicates(ROW_KEY)
+
+    base = df.drop(columns=[c for c in columns if c in df.columns])
+    return base.merge(lookup, on=ROW_KEY, how='left')
@@ -0,0 +1,152 @@
+# utils/entity_resolution.py
+
+import logging
+import re
+
+import numpy as np
+import pandas as pd
+from rapidfuzz import fuzz, process
+
+# --- Сведение написаний компаний (entity resolution) ---
+# Одна и та же компания приходит из ЕАЭС, Атласа и РФ-Мир под разными написаниями.
+# Кандидаты на объединение ищутся только внутри блоков, без сравнения всех пар:
+#   1) одинаковый ИНН/ID — одна компания;
+#   2) страна + первые буквы нормализованного названия — названия внутри блока
+#      сравниваются матрицей rapidfuzz.process.cdist (батчами строк).
+# Компании с разными ИНН по названию не объединяются.
+ROLES = ['importer', 'exporter']
+NAME_THRESHOLD = 92          # минимальное сходство названий (0-100)
+NAME_SCORER = fuzz.ratio
+PREFIX_LEN = 3               # длина префикса названия для блока
+MAX_BLOCK_SIZE = 5_000       # блоки крупнее дробятся по более длинному префиксу
+CDIST_BATCH = 2_000          # строк матрицы сходства за один вызов cdist
+MIN_TIN_LEN = 5
+TIN_CLEAN_RE = re.compile(r'[^0-9A-Za-z]')
+
+logger = logging.getLogger(__name__)
+
+def company_id_column(role: str) -> str:
+    return f'{role}_company_id'
+
+def normalize_tin(value) -> str | None:
+    """ИНН/ID без разделителей; пустые, короткие и нулевые значения — None."""
+    if value is None or pd.isna(value):
+        return None
+    tin = TIN_CLEAN_RE.sub('', str(value).removesuffix('.0')).upper()
+    if len(tin) < MIN_TIN_LEN or not tin.strip('0'):
+        return None
+    return tin
+
+class _DisjointSet:
+    """Объединение компаний; у каждого корня не больше одного ИНН."""
+
+    def __init__(self, tins: list[str | None]):
+        self.parent = list(range(len(tins)))
+        self.tin = list(tins)
+
+    def find(self, i: int) -> int:
+        while self.parent[i] != i:
+            self.parent[i] = self.parent[self.parent[i]]
+            i = self.parent[i]
+        return i
+
+    def union(self, i: int, j: int) -> bool:
+        ri, rj = self.find(i), self.find(j)
+        if ri == rj:
+            return False
+        if self.tin[ri] and self.tin[rj] and self.tin[ri] != self.tin[rj]:
+            return False
+        if rj < ri:
+            ri, rj = rj, ri
+        self.parent[rj] = ri
+        self.tin[ri] = self.tin[ri] or self.tin[rj]
+        return True
+
+def _name_blocks(entities: pd.DataFrame, prefix_len: int = PREFIX_LEN):
+    """Индексы уникальных названий по блокам (страна, префикс названия)."""
+    keys = entities['country'].fillna('') + '|' + entities['name'].str[:prefix_len]
+    for _, idx in entities.groupby(keys, sort=False).indices.items():
+        if len(idx) > MAX_BLOCK_SIZE and entities['name'].iloc[idx].str.len().max() > prefix_len:
+            yield from (idx[sub] for sub in _name_blocks(entities.iloc[idx], prefix_len + 2))
+        elif len(idx) > 1:
+            yield idx
+
+def _match_block(names: list[str]):
+    """Пары (i, j), i < j, с похожими названиями внутри блока."""
+    for start in range(0, len(names), CDIST_BATCH):
+        scores = process.cdist(
+            names[start:start + CDIST_BATCH], names[start:],
+            scorer=NAME_SCORER, score_cutoff=NAME_THRESHOLD, workers=-1,
+        )
+        rows, cols = np.nonzero(scores)
+        upper = cols > rows
+        yield from zip(rows[upper] + start, cols[upper] + start)
+
+def _entity_frame(df: pd.DataFrame, role: str) -> pd.DataFrame:
+    """(название, ИНН, страна) строк df для роли; пропуски — пустые строки."""
+    def column(name, convert=None):
+        if name not in df.columns:
+            return pd.Series('', index=df.index)
+        values = df[name].astype(object)  # страны после step1 — category
+        values = values.map(convert) if convert else values
+        return values.map(lambda v: '' if v is None or pd.isna(v) else str(v))
+
+    return pd.DataFrame({
+        'name': column(f'{role}_name'),
+        'tin': column(f'{role}_tin', normalize_tin),
+        'country': column(f'{role}_country'),
+    })
+
+def resolve_companies(df: pd.DataFrame, roles: list[str] = ROLES) -> pd.DataFrame:
+    """
+    Добавляет {role}_company_id — общий идентификатор компании для всех её написаний.
+    Использует нормализованные {role}_name, {role}_tin и {role}_country (после step1 и унификации стран).
+    Импортеры и экспортеры сводятся в одном пространстве идентификаторов.
+    """
+    df = df.copy()
+    frames = [_entity_frame(df, role) for role in roles]
+    entities = pd.concat(frames, ignore_index=True).drop_duplicates(ignore_index=True)
+    entities = entities[(entities['name'] != '') | (entities['tin'] != '')].reset_index(drop=True)
+
+    sets = _DisjointSet(entities['tin'].replace('', None).tolist())
+
+    # 1. Блоки по ИНН
+    for idx in entities[entities['tin'] != ''].groupby('tin', sort=False).indices.values():
+        for j in idx[1:]:
+            sets.union(idx[0], j)
+
+    # 2. Одинаковые название и страна (с ИНН и без)
+    named = entities.index[entities['name'] != ''].to_numpy()
+    codes, _ = pd.factorize(entities['name'].iloc[named] + '|' + entities['country'].iloc[named])
+    _, first = np.unique(codes, return_index=True)
+    for i, j in zip(named[first[codes]], named):
+        if i != j:
+            sets.union(i, j)
+
+    # 3. Блоки по стране и префиксу: похожие названия, сравниваются только уникальные
+    representatives = named[first]
+    unique_names = entities.iloc[representatives].reset_index(drop=True)
+    names = unique_names['name'].tolist()
+    merged = 0
+    for idx in _name_blocks(unique_names):
+        for i, j in _match_block([names[k] for k in idx]):
+            merged += sets.union(representatives[idx[i]], representatives[idx[j]])
+
+    # идентификатор — хэш канонического ключа группы (ИНН или минимальное название),
+    # не зависит от порядка строк и стабилен между запусками
+    roots = pd.Series([sets.find(i) for i in range(len(entities))])
+    name_keys = 'name:' + entities['country'] + '|' + entities['name']
+    first_key = (
+        pd.DataFrame({'root': roots, 'key': name_keys})
+        .sort_values('key').drop_duplicates('root').set_index('root')['key']
+    )
+    canonical = roots.map(first_key)
+    group_tins = roots.map(lambda root: sets.tin[root])
+    canonical = canonical.where(group_tins.isna(), 'tin:' + group_tins.fillna(''))
+    entities['company_id'] = pd.util.hash_array(canonical.to_numpy(dtype=object)).astype(np.int64)
+    logger.info(f'Компании: {len(entities)} написаний → {roots.nunique()} (по сходству названий объединено {merged})')
+
+    for role, frame in zip(roles, frames):
+        ids = frame.merge(entities, on=['name', 'tin', 'country'], how='left')['company_id']
+        df[company_id_column(role)] = pd.array(ids, dtype='Int64')
+    return df
@@ -1,14 +1,247 @@
 # utils/io.py
 
+from pathlib import Path
+
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from openpyxl import load_workbook
+
+# --- Формат промежуточных стадий ---
+# st1–st5 по умолчанию пишутся в Parquet: быстрее openpyxl, без лимита строк Excel,
+# сохраняет типы (в т.ч. списочные колонки step2). Excel — только для датамарта
+# и по явному запросу (excel_copy=True) для остальных стадий.
+DEFAULT_STAGE_FORMAT = 'parquet'
+PARQUET_COMPRESSION = 'zstd'
+PARQUET_COLUMN_COMPRESSION = {}  # {колонка: кодек}, переопределяет PARQUET_COMPRESSION
 
 def read_excel_file(path, sheet_name=0) -> pd.DataFrame:
     """Чтение Excel-файла в DataFrame."""
     return pd.read_excel(
-        path, 
+        path,
         sheet_name
     )
 
 def save_to_excel_file(df: pd.DataFrame, path: str, index=False):
     """Сохранение DataFrame в Excel-файл."""
-    df.to_excel(path, index=index)
\ No newline at end of file
+    df.to_excel(path, index=index)
+
+# --- Parquet ---
+def _is_list_column(series: pd.Series) -> bool:
+    sample = series.dropna()
+    return not sample.empty and isinstance(sample.iloc[0], (list, tuple))
+
+def _prepare_for_parquet(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Приводит object-колонки со смешанными типами (например, decl_number int/str
+    из разных источников) к строкам — иначе pyarrow не построит схему.
+    Списочные колонки остаются списками.
+    """
+    df = df.copy()
+    for col in df.columns[df.dtypes == object]:
+        if _is_list_column(df[col]):
+            continue
+        if pd.api.types.infer_dtype(df[col], skipna=True).startswith('mixed'):
+            df[col] = df[col].map(lambda v: v if pd.isna(v) else str(v))
+    return df
+
+def _column_compression(schema: pa.Schema, compression: str | dict | None) -> dict:
+    """Кодек для каждой колонки Parquet (для списков — по пути '<col>.list.element')."""
+    overrides = dict(PARQUET_COLUMN_COMPRESSION)
+    if isinstance(compression, dict):
+        overrides.update(compression)
+        default = PARQUET_COMPRESSION
+    else:
+        default = compression or PARQUET_COMPRESSION
+
+    codecs = {}
+    for field in schema:
+        path = f'{field.name}.list.element' if pa.types.is_list(field.type) else field.name
+        codecs[path] = overrides.get(field.name, default)
+    return codecs
+
+def read_parquet_file(path, columns=None) -> pd.DataFrame:
+    """Чтение Parquet-файла в DataFrame; списочные колонки возвращаются как list."""
+    table = pq.read_table(path, columns=columns)
+    df = table.to_pandas()
+    for field in table.schema:
+        if pa.types.is_list(field.type) or pa.types.is_large_list(field.type):
+            df[field.name] = df[field.name].map(lambda v: v if v is None else list(v))
+    return df
+
+def _with_metadata(schema: pa.Schema, metadata: dict | None) -> pa.Schema:
+    if not metadata:
+        return schema
+    extra = {str(k).encode(): str(v).encode() for k, v in metadata.items()}
+    return schema.with_metadata({**(schema.metadata or {}), **extra})
+
+def read_parquet_metadata(path) -> dict:
+    """Пользовательские метаданные Parquet-файла (например, версия стадии)."""
+    metadata = pq.read_schema(path).metadata or {}
+    return {k.decode(): v.decode() for k, v in metadata.items() if k != b'pandas'}
+
+def save_to_parquet_file(df: pd.DataFrame, path, compression: str | dict | None = None, metadata: dict | None = None):
+    """
+    Сохранение DataFrame в Parquet.
+
+    Args:
+        compression: общий кодек ('zstd', 'snappy', ...) или словарь {колонка: кодек}
+        metadata: пары ключ-значение, сохраняемые в схеме файла
+    """
+    table = pa.Table.from_pandas(_prepare_for_parquet(df), preserve_index=False)
+    table = table.replace_schema_metadata(_with_metadata(table.schema, metadata).metadata)
+    pq.write_table(table, path, compression=_column_compression(table.schema, compression))
+
+def iter_parquet_batches(path, batch_size: int, columns=None):
+    """
+    Потоковое чтение Parquet батчами DataFrame. path — файл или папка
+    с частями (*.parquet читаются в порядке имён).
+    """
+    files = sorted(Path(path).glob('*.parquet')) if Path(path).is_dir() else [path]
+    for file in files:
+        for batch in pq.ParquetFile(file).iter_batches(batch_size=batch_size, columns=columns):
+            yield batch.to_pandas()
+
+def iter_source_batches(path, columns: list[str] | None = None, sheet_name=0, batch_size: int = 50_000):
+    """Потоковое чтение источника: Excel-файл или Parquet (файл или папка с частями)."""
+    if Path(path).is_dir() or Path(path).suffix.lower() == '.parquet':
+        return iter_parquet_batches(path, batch_size, columns)
+    return iter_excel_batches(path, columns, sheet_name, batch_size)
+
+class ParquetStageWriter:
+    """
+    Потоковая запись стадии в Parquet: батчи DataFrame дописываются в один файл
+    с фиксированной схемой, весь набор данных в памяти не держится.
+
+    Пример:
+        with ParquetStageWriter(path, schema) as writer:
+            for batch in batches:
+                writer.write(batch)
+    """
+
+    def __init__(self, path, schema: pa.Schema, compression: str | dict | None = None, metadata: dict | None = None):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        schema = _with_metadata(schema, metadata)
+        self.schema = schema
+        self.rows = 0
+        self._writer = pq.ParquetWriter(path, schema, compression=_column_compression(schema, compression))
+
+    def write(self, df: pd.DataFrame):
+        table = pa.Table.from_pandas(df, schema=self.schema, preserve_index=False)
+        self._writer.write_table(table)
+        self.rows += len(df)
+
+    def close(self):
+        self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def partition_parquet(path, out_dir, key: str, partitions: int, batch_size: int = 100_000,
+                      position_column: str | None = None) -> list[Path]:
+    """
+    Раскладывает Parquet-файл на части по хэшу колонки key (строки с одинаковым
+    значением key — в одной части), читая его батчами. Части пишутся в out_dir
+    со схемой исходного файла; возвращаются пути непустых частей.
+    position_column — добавить колонку с номером строки в исходном файле
+    (чтобы после обработки частей восстановить исходный порядок).
+    """
+    source = pq.ParquetFile(path)
+    schema = source.schema_arrow
+    if position_column:
+        schema = schema.append(pa.field(position_column, pa.int64()))
+    paths = [Path(out_dir) / f'part_{i:04d}.parquet' for i in range(partitions)]
+    writers = {}
+    offset = 0
+    try:
+        for batch in source.iter_batches(batch_size=batch_size):
+            if position_column:
+                positions = pa.array(np.arange(offset, offset + batch.num_rows, dtype=np.int64))
+                batch = pa.RecordBatch.from_arrays(batch.columns + [positions], schema=schema)
+            offset += batch.num_rows
+            # хэш строкового представления: не зависит от того, как pandas прочитал батч (int/float при пропусках)
+            values = batch.column(key).cast(pa.string()).to_pandas()
+            part = pd.util.hash_pandas_object(values, index=False).to_numpy() % partitions
+            for i in map(int, set(part)):
+                if i not in writers:
+                    writers[i] = pq.ParquetWriter(paths[i], schema)
+                writers[i].write_batch(batch.filter(pa.array(part == i)))
+    finally:
+        for writer in writers.values():
+            writer.close()
+    return [paths[i] for i in sorted(writers)]
+
+# --- Потоковое чтение Excel ---
+def iter_excel_batches(path, columns: list[str] | None = None, sheet_name=0, batch_size: int = 50_000,
+                       skiprows: int = 0):
+    """
+    Потоковое чтение листа Excel (openpyxl read-only) батчами DataFrame.
+    Читаются только колонки columns (по заголовку, следующему за skiprows строками),
+    остальные отбрасываются уже при разборе строк; columns=None — все колонки.
+    """
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        ws = wb.worksheets[sheet_name] if isinstance(sheet_name, int) else wb[sheet_name]
+        rows = ws.iter_rows(values_only=True)
+        for _ in range(skiprows):
+            next(rows, None)
+        header = [name if name is not None else f'Unnamed: {i}' for i, name in enumerate(next(rows, ()))]
+        if columns is None:
+            columns, idx = header, list(range(len(header)))
+        else:
+            # повтор названия в заголовке: берётся первая колонка, как у pd.read_excel(usecols=...)
+            positions = {name: i for i, name in reversed(list(enumerate(header)))}
+            missing = [c for c in columns if c not in positions]
+            if missing:
+                raise KeyError(f"В {path} нет колонок: {missing}")
+            idx = [positions[c] for c in columns]
+
+        buffer = []
+        for row in rows:
+            buffer.append([row[i] if i < len(row) else None for i in idx])
+            if len(buffer) >= batch_size:
+                yield pd.DataFrame(buffer, columns=columns)
+                buffer = []
+        if buffer:
+            yield pd.DataFrame(buffer, columns=columns)
+    finally:
+        wb.close()
+
+# --- Слой стадий ---
+STAGE_READERS = {
+    'parquet': read_parquet_file,
+    'xlsx': read_excel_file,
+}
+STAGE_WRITERS = {
+    'parquet': save_to_parquet_file,
+    'xlsx': save_to_excel_file,
+}
+
+def _stage_format(path, fmt: str | None) -> str:
+    if fmt:
+        return fmt
+    suffix = Path(path).suffix.lstrip('.').lower()
+    return suffix if suffix in STAGE_READERS else DEFAULT_STAGE_FORMAT
+
+def read_stage(path, fmt: str | None = None) -> pd.DataFrame:
+    """Чтение промежуточной стадии; формат определяется по расширению файла."""
+    return STAGE_READERS[_stage_format(path, fmt)](path)
+
+def save_stage(df: pd.DataFrame, path, fmt: str | None = None, excel_copy: bool = False, **kwargs):
+    """
+    Сохранение промежуточной стадии.
+
+    Args:
+        fmt: формат ('parquet', 'xlsx'); по умолчанию — по расширению path
+        excel_copy: дополнительно сохранить рядом .xlsx для ручной проверки
+        **kwargs: параметры writer'а (например, compression для Parquet)
+    """
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    fmt = _stage_format(path, fmt)
+    STAGE_WRITERS[fmt](df, path, **kwargs)
+    if excel_copy and fmt != 'xlsx':
+        save_to_excel_file(df, Path(path).with_suffix('.xlsx'))
@@ -0,0 +1,126 @@
+# utils/lemma_cache.py
+
+import os
+import sqlite3
+from pathlib import Path
+
+from cachetools import LRUCache
+
+# --- Кэш лемм pymorphy2 ---
+# Словарь описаний товаров невелик по сравнению с числом токенов, поэтому лемма
+# каждого токена считается один раз: сначала ищем в LRU в памяти, затем в SQLite
+# на диске (общем для step2, word_ui.py и tagging_tester.py), и только потом
+# вызываем morph.parse. Файл можно удалить в любой момент — он пересоздастся.
+# Пишет в файл только один процесс: воркеры пула step2 открывают его на чтение
+# (readonly=True) и возвращают новые леммы родителю, который записывает их одной
+# транзакцией на часть. Журнал WAL не блокирует читателей на время записи.
+LEMMA_CACHE_PATH = 'data/cache/lemmas.sqlite'
+LEMMA_CACHE_SIZE = 200_000  # токенов в памяти
+FLUSH_EVERY = 10_000        # новых лемм между записями на диск
+
+class LemmaCache:
+    """
+    Кэш нормальных форм pymorphy2 с ограниченным LRU в памяти и необязательным
+    хранилищем на диске.
+
+    Пример:
+        lemmas = LemmaCache(morph, path=LEMMA_CACHE_PATH)
+        lemma = lemmas.lemma('клапаны')
+        ...
+        lemmas.close()
+        logger.info(lemmas.stats_line())
+    """
+
+    def __init__(self, morph, path: str | None = None, maxsize: int = LEMMA_CACHE_SIZE, readonly: bool = False):
+        self.morph = morph
+        self.path = path
+        self.readonly = readonly
+        self._memory = LRUCache(maxsize=maxsize)
+        self._pending = {}
+        self.hits = self.disk_hits = self.misses = 0
+
+        self._db = None
+        if path and readonly:
+            if os.path.exists(path):
+                uri = f'{Path(path).resolve().as_uri()}?mode=ro'
+                self._db = sqlite3.connect(uri, uri=True, timeout=60, check_same_thread=False)
+        elif path:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            self._db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('CREATE TABLE IF NOT EXISTS lemmas (token TEXT PRIMARY KEY, lemma TEXT NOT NULL)')
+            self._db.commit()
+
+    def lemma(self, token: str) -> str:
+        """Нормальная форма токена (morph.parse(token)[0].normal_form)."""
+        lemma = self._memory.get(token)
+        if lemma is not None:
+            self.hits += 1
+            return lemma
+
+        lemma = self._pending.get(token)
+        if lemma is None and self._db is not None:
+            row = self._db.execute('SELECT lemma FROM lemmas WHERE token = ?', (token,)).fetchone()
+            lemma = row[0] if row else None
+        if lemma is not None:
+            self.disk_hits += 1
+        else:
+            self.misses += 1
+            lemma = self.morph.parse(token)[0].normal_form
+            if self.path:
+                self._pending[token] = lemma
+                if len(self._pending) >= FLUSH_EVERY:
+                    self.flush()
+
+        self._memory[token] = lemma
+        return lemma
+
+    def flush(self):
+        """Записывает новые леммы на диск (в режиме readonly они копятся до take_new)."""
+        if self._db is None or self.readonly or not self._pending:
+            return
+        self._db.executemany('INSERT OR IGNORE INTO lemmas VALUES (?, ?)', self._pending.items())
+        self._db.commit()
+        self._pending.clear()
+
+    def take_new(self) -> dict[str, str]:
+        """Новые леммы, ещё не записанные на диск; список очищается (воркер отдаёт их родителю)."""
+        new, self._pending = self._pending, {}
+        return new
+
+    def add_new(self, lemmas: dict[str, str]):
+        """Леммы, посчитанные другим процессом: в память и на диск одной записью."""
+        for token, lemma in lemmas.items():
+            self._memory[token] = lemma
+        if self._db is not None and not self.readonly:
+            self._pending.update(lemmas)
+            self.flush()
+
+    def close(self):
+        self.flush()
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def counters(self) -> tuple[int, int, int]:
+        """(попадания в памяти, попадания на диске, промахи)."""
+        return self.hits, self.disk_hits, self.misses
+
+    def add_counters(self, counters: tuple[int, int, int]):
+        """Добавляет счётчики другого экземпляра (например, из воркера пула)."""
+        self.hits, self.disk_hits, self.misses = (a + b for a, b in zip(self.counters(), counters))
+
+    def stats(self) -> dict:
+        total = self.hits + self.disk_hits + self.misses
+        return {
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_ratio': (self.hits + self.disk_hits) / total if total else 0.0,
+            'memory_size': self._memory.currsize,
+        }
+
+    def stats_line(self) -> str:
+        s = self.stats()
+        return (f"Кэш лемм: попаданий {s['hits']} (в памяти) + {s['disk_hits']} (на диске), "
+                f"промахов {s['misses']}, доля попаданий {s['hit_ratio']:.1%}")
@@ -1,21 +1,36 @@
 # utils/io.py
+import hashlib
+import json
+import os
 import re
+import string
+import unicodedata
+import numpy as np
 import pandas as pd
 
+from utils.io import read_parquet_file, read_parquet_metadata, save_to_parquet_file
+
+CLEAN_CHARS_RE = re.compile(r'[",«»()&?<>“”|/-]')
+APOSTROPHE_RE = re.compile(r"'")
+SPACES_RE = re.compile(r'\s+')
+LEADING_SEPARATORS_RE = re.compile(r'^[\s,-]+')
+DOTS_COMMAS_RE = re.compile(r'[.,]')
+MULTISPACE_RE = re.compile(r'\s\s+')
+
+KEYWORDS_AFTER = ["по поручению", "по поруч", "по пручению", "для", "b/o", "by order", "by"]
+KEYWORDS_BEFORE = ["через"]
+
 # --- Очистка названия компании ---
 def clean_and_extract(name: str) -> str:
-    cleaned_name = re.sub(r'[",«»()&?<>“”|/-]', '', name)
-    cleaned_name = re.sub(r"'", '', cleaned_name)
-    cleaned_name = re.sub(r'\s+', ' ', cleaned_name).strip().lower()
-
-    keywords_after = ["по поручению", "по поруч", "по пручению", "для", "b/o", "by order", "by"]
-    keywords_before = ["через"]
+    cleaned_name = CLEAN_CHARS_RE.sub('', name)
+    cleaned_name = APOSTROPHE_RE.sub('', cleaned_name)
+    cleaned_name = SPACES_RE.sub(' ', cleaned_name).strip().lower()
 
-    for keyword in keywords_after:
+    for keyword in KEYWORDS_AFTER:
         if keyword in cleaned_name:
             return cleaned_name.split(keyword, maxsplit=1)[1].strip()
 
-    for keyword in keywords_before:
+    for keyword in KEYWORDS_BEFORE:
         if keyword in cleaned_name:
             return cleaned_name.split(keyword, maxsplit=1)[0].strip()
 
@@ -171,3 +186,312 @@ def normalize_company(name: str) -> pd.Series:
     normalized_name_str = re.sub(r'\s\s+', ' ', normalized_name_str).strip()
 
     return pd.Series([opf, normalized_name_str], index=['ОПФ', 'Нормализованное_название'])
+
+
+# =========================================================
+# СКОМПИЛИРОВАННЫЙ НОРМАЛИЗАТОР (для массовой обработки)
+# =========================================================
+
+STICKY_NEXT_CHARS = r'[«"“A-Za-zА-Яа-яЁё0-9]'
+# Увеличить при изменении логики нормализации (не справочников) — сбрасывает кэш на диске
+NORMALIZER_REVISION = 1
+CACHE_VERSION_KEY = 'rules_version'
+
+def rules_version() -> str:
+    """Хэш правил нормализации: OPF_MAPPING, склеенные ОПФ и ключевые слова clean_and_extract."""
+    rules = {
+        'revision': NORMALIZER_REVISION,
+        'opf_mapping': list(OPF_MAPPING.items()),
+        # порядок кандидатов одной длины зависит от хэширования set — для версии не важен
+        'sticking_opfs': sorted(STICKING_OPFS_CANDIDATES),
+        'keywords_after': KEYWORDS_AFTER,
+        'keywords_before': KEYWORDS_BEFORE,
+    }
+    return hashlib.sha256(json.dumps(rules, ensure_ascii=False).encode()).hexdigest()
+
+class CompanyNormalizer:
+    """
+    Быстрая версия normalize_company с тем же результатом:
+      - все регулярки компилируются один раз;
+      - склеенные ОПФ ищутся одной общей регуляркой, построчные замены
+        выполняются только для реально найденных ОПФ и в том же порядке, что и раньше;
+      - ОПФ определяется упорядоченной альтернативой по OPF_MAPPING
+        (побеждает паттерн с наивысшим приоритетом, как в цикле normalize_company);
+      - результаты кэшируются по исходному названию; кэш можно сохранять
+        между запусками (load_cache / save_cache), он привязан к rules_version().
+    """
+
+    def __init__(self):
+        # Склеенные ОПФ: по одной группе на кандидата, индекс группы = порядок в STICKING_OPFS_CANDIDATES
+        self._sticky = [
+            re.compile(r'(\b' + re.escape(opf) + r')(?=' + STICKY_NEXT_CHARS + r')', re.IGNORECASE)
+            for opf in STICKING_OPFS_CANDIDATES
+        ]
+        self._sticky_any = re.compile(
+            r'\b(?:' + '|'.join(f'({re.escape(opf)})' for opf in STICKING_OPFS_CANDIDATES) + r')'
+            + r'(?=' + STICKY_NEXT_CHARS + r')',
+            re.IGNORECASE,
+        )
+
+        # ОПФ: порядок приоритета как в normalize_company (длинные паттерны первыми)
+        items = sorted(OPF_MAPPING.items(), key=lambda item: len(item[0]), reverse=True)
+        self._opf_values = [mapped for _, mapped in items]
+        self._opf_patterns = [re.compile(pattern, re.IGNORECASE) for pattern, _ in items]
+        # все паттерны начинаются с \b — выносим его за альтернативу, чтобы ветки
+        # перебирались только на границах слов
+        if not all(pattern.startswith(r'\b') for pattern, _ in items):
+            raise ValueError("Все паттерны OPF_MAPPING должны начинаться с \\b")
+        self._opf_any = re.compile(
+            r'\b(?:' + '|'.join(f'(?P<o{i}>{pattern[2:]})' for i, (pattern, _) in enumerate(items)) + ')',
+            re.IGNORECASE,
+        )
+
+        self._cache = {}
+        self._saved = 0  # записей кэша, уже сохранённых на диск
+
+    def load_cache(self, path) -> int:
+        """
+        Подгружает кэш нормализации с диска. Кэш другой версии правил игнорируется
+        (и будет перезаписан при save_cache). Возвращает число загруженных названий.
+        """
+        if not os.path.exists(path) or read_parquet_metadata(path).get(CACHE_VERSION_KEY) != rules_version():
+            return 0
+        df = read_parquet_file(path)
+        opfs = df['opf'].astype(object).where(df['opf'].notna(), None)
+        self._cache.update(zip(df['name'], zip(opfs, df['normalized'])))
+        self._saved = len(self._cache)
+        return len(df)
+
+    def save_cache(self, path) -> int:
+        """Сохраняет кэш, если появились новые названия. Возвращает число новых записей."""
+        added = len(self._cache) - self._saved
+        if added <= 0:
+            return 0
+        names = [name for name in self._cache if isinstance(name, str)]
+        df = pd.DataFrame({
+            'name': names,
+            'opf': [self._cache[name][0] for name in names],
+            'normalized': [self._cache[name][1] for name in names],
+        })
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        save_to_parquet_file(df, path, metadata={CACHE_VERSION_KEY: rules_version()})
+        self._saved = len(self._cache)
+        return added
+
+    def _unstick(self, name: str) -> str:
+        """
+        Вставляет пробел после склеенных ОПФ. Повторяет последовательные замены
+        normalize_company: замена для кандидата k может открыть совпадения только
+        для кандидатов после k, поэтому каждый раз берётся минимальный индекс > last.
+        """
+        last = -1
+        while True:
+            nxt = None
+            pos = 0
+            # поиск с перекрытием: совпадение "АО СП" не должно скрывать "СП" внутри себя
+            while (m := self._sticky_any.search(name, pos)) is not None:
+                idx = m.lastindex - 1
+                if idx > last and (nxt is None or idx < nxt):
+                    nxt = idx
+                pos = m.start() + 1
+            if nxt is None:
+                return name
+            last = nxt
+            name = self._sticky[last].sub(r'\1 ', name)
+
+    def _detect_opf(self, name: str) -> int | None:
+        """Индекс паттерна ОПФ с наивысшим приоритетом, совпавшего где-либо в строке."""
+        best = None
+        pos = 0
+        while (m := self._opf_any.search(name, pos)) is not None:
+            idx = int(m.lastgroup[1:])
+            if best is None or idx < best:
+                best = idx
+            pos = m.start() + 1
+        return best
+
+    def normalize(self, name) -> tuple[str | None, str | None]:
+        """(ОПФ, нормализованное название) — как normalize_company, но кортежем."""
+        if pd.isna(name):
+            return None, None
+        cached = self._cache.get(name)
+        if cached is not None:
+            return cached
+
+        clean_name_str = clean_and_extract(self._unstick(str(name)))
+        opf = None
+        normalized_name_str = clean_name_str
+
+        idx = self._detect_opf(normalized_name_str)
+        if idx is not None:
+            opf = self._opf_values[idx]
+            normalized_name_str = self._opf_patterns[idx].sub('', normalized_name_str, count=1).strip()
+            normalized_name_str = LEADING_SEPARATORS_RE.sub('', normalized_name_str)
+
+        normalized_name_str = DOTS_COMMAS_RE.sub('', normalized_name_str)
+        normalized_name_str = MULTISPACE_RE.sub(' ', normalized_name_str).strip()
+
+        result = (opf, normalized_name_str)
+        self._cache[name] = result
+        return result
+
+    def normalize_series(self, names: pd.Series) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Нормализует колонку: считаются только уникальные значения (factorize),
+        результат раскладывается обратно. Возвращает (ОПФ, нормализованное название).
+        """
+        codes, uniques = pd.factorize(names)
+        results = [self.normalize(name) for name in uniques]
+        opfs = np.array([r[0] for r in results] + [None], dtype=object)
+        normalized = np.array([r[1] for r in results] + [None], dtype=object)
+        # код -1 (пропуск) указывает на последний элемент — None
+        return opfs[codes], normalized[codes]
+
+
+# =========================================================
+# НОРМАЛИЗАЦИЯ СМЕШАННЫХ ТОКЕНОВ (КИР/ЛАТ) — безопасная
+# =========================================================
+# Токен, в котором смешаны латиница и кириллица («ТРУБОПРОВОДНAЯ» с латинской A),
+# приводится к преобладающему алфавиту по таблице похожих букв.
+# Токены TOKEN_RE состоят только из A-Za-z, А-Яа-яЁё, цифр и -_/. — поэтому
+# алфавит символа определяется по фиксированным наборам букв, а замена
+# выполняется str.translate.
+
+LAT_TO_CYR = {
+    'A':'А','a':'а','B':'В','E':'Е','e':'е','K':'К','k':'к',
+    'M':'М','m':'м','H':'Н','h':'н','O':'О','o':'о','P':'Р','p':'р',
+    'C':'С','c':'с','T':'Т','t':'т','X':'Х','x':'х','Y':'У','y':'у'
+}
+CYR_TO_LAT = {v: k for k, v in LAT_TO_CYR.items()}
+
+LATIN_LETTERS = string.ascii_letters
+CYRILLIC_LETTERS = ''.join(chr(code) for code in range(ord('А'), ord('я') + 1)) + 'Ёё'
+DROP_LATIN = str.maketrans('', '', LATIN_LETTERS)
+DROP_CYRILLIC = str.maketrans('', '', CYRILLIC_LETTERS)
+LAT_TO_CYR_TABLE = str.maketrans(LAT_TO_CYR)
+CYR_TO_LAT_TABLE = str.maketrans(CYR_TO_LAT)
+LATIN_LETTER_RE = re.compile(r"[A-Za-z]")
+
+TOKEN_RE = re.compile(r"[0-9A-Za-zА-Яа-яЁё\-_/\.]+")
+SKIP_PATTERNS = [
+    re.compile(r"[A-Za-z]{2,}\d+"),   # DN50, PN16, G3/4, M20x1.5
+    re.compile(r"[A-Z]{3,}"),         # FANUC, PLC, CNC, SIEMENS
+    re.compile(r"\d+[A-Za-z\-]+"),    # LS59-1, 40Cr, 20#, 12X18H10T
+    re.compile(r"https?://|www\."),   # URL
+]
+
+def _token_should_be_skipped(tok: str) -> bool:
+    return any(p.search(tok) for p in SKIP_PATTERNS)
+
+def _normalize_mixed_token(tok: str) -> str:
+    if tok.isascii():  # только латиница/цифры
+        return tok
+    lat = len(tok) - len(tok.translate(DROP_LATIN))
+    if lat == 0:  # только кириллица/цифры
+        return tok
+    cyr = len(tok) - len(tok.translate(DROP_CYRILLIC))
+    if cyr == 0 or _token_should_be_skipped(tok):
+        return tok
+    return tok.translate(LAT_TO_CYR_TABLE if cyr >= lat else CYR_TO_LAT_TABLE)
+
+def _normalize_token_match(m: re.Match) -> str:
+    return _normalize_mixed_token(m.group(0))
+
+def normalize_confusables(text: str) -> str:
+    """NFKC + замена похожих букв в токенах со смешанной латиницей/кириллицей."""
+    if not isinstance(text, str):
+        return text
+    text = unicodedata.normalize('NFKC', text)
+    # без латиницы или без кириллицы смешанных токенов быть не может
+    if text.isascii() or LATIN_LETTER_RE.search(text) is None:
+        return text
+    return TOKEN_RE.sub(_normalize_token_match, text)
+
+
+# =========================================================
+# БЕНЧМАРК: PYTHONPATH=./pipeline python -m utils.normalization_utils [st1.parquet]
+# На колонках st1 сравнивает прежние реализации с текущими (результат должен
+# совпадать побайтно): normalize_company и CompanyNormalizer на компаниях,
+# посимвольную (unicodedata.name) и табличную normalize_confusables на prod_details.
+# =========================================================
+
+if __name__ == '__main__':
+    import sys
+    import time
+
+    from utils.io import read_stage
+
+    path = sys.argv[1] if len(sys.argv) > 1 else 'data/st1_cleaned/st1.parquet'
+    columns = ['exporter_name_orig', 'importer_name_orig']
+    df = read_stage(path)
+    names = pd.concat([df[c] for c in columns if c in df.columns], ignore_index=True)
+    print(f'Названий: {len(names)}, уникальных: {names.nunique()}')
+
+    start = time.perf_counter()
+    legacy = names.apply(normalize_company)
+    legacy_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    opfs, normalized = CompanyNormalizer().normalize_series(names)
+    new_time = time.perf_counter() - start
+
+    def _same(a, b):
+        return (pd.isna(a) and pd.isna(b)) or a == b
+
+    mismatches = sum(
+        not (_same(a, b) and _same(c, d))
+        for a, b, c, d in zip(legacy['ОПФ'], opfs, legacy['Нормализованное_название'], normalized)
+    )
+    print(f'normalize_company: {legacy_time:.2f} с; CompanyNormalizer: {new_time:.2f} с; '
+          f'ускорение x{legacy_time / max(new_time, 1e-9):.1f}; расхождений: {mismatches}')
+
+    def _is_cyr(ch: str) -> bool:
+        return 'CYRILLIC' in unicodedata.name(ch, '')
+
+    def _is_lat(ch: str) -> bool:
+        return 'LATIN' in unicodedata.name(ch, '')
+
+    def _normalize_mixed_token_legacy(tok: str) -> str:
+        lat = sum(_is_lat(ch) for ch in tok)
+        cyr = sum(_is_cyr(ch) for ch in tok)
+        if lat == 0 or cyr == 0 or _token_should_be_skipped(tok):
+            return tok
+        to_cyr = cyr >= lat
+        out = []
+        for ch in tok:
+            if to_cyr and _is_lat(ch) and ch in LAT_TO_CYR:
+                out.append(LAT_TO_CYR[ch])
+            elif not to_cyr and _is_cyr(ch) and ch in CYR_TO_LAT:
+                out.append(CYR_TO_LAT[ch])
+            else:
+                out.append(ch)
+        return "".join(out)
+
+    def normalize_confusables_legacy(text: str) -> str:
+        if not isinstance(text, str):
+            return text
+        text = unicodedata.normalize('NFKC', text)
+        out, last = [], 0
+        for m in TOKEN_RE.finditer(text):
+            s, e = m.span()
+            out.append(text[last:s])
+            out.append(_normalize_mixed_token_legacy(m.group(0)))
+            last = e
+        out.append(text[last:])
+        return "".join(out)
+
+    if 'prod_details' in df.columns:
+        texts = df['prod_details'].dropna().astype(str).tolist()
+        print(f'Описаний: {len(texts)}, уникальных: {len(set(texts))}')
+
+        start = time.perf_counter()
+        legacy = [normalize_confusables_legacy(text) for text in texts]
+        legacy_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        fast = [normalize_confusables(text) for text in texts]
+        new_time = time.perf_counter() - start
+
+        mismatches = sum(a != b for a, b in zip(legacy, fast))
+        print(f'normalize_confusables: посимвольно {legacy_time:.2f} с; по таблицам {new_time:.2f} с; '
+              f'ускорение x{legacy_time / max(new_time, 1e-9):.1f}; расхождений: {mismatches}')
@@ -0,0 +1,195 @@
+# utils/price_anomalies.py
+
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+from utils.delta_utils import VERSION_KEY
+from utils.io import read_parquet_file, read_parquet_metadata, save_to_parquet_file
+
+# --- Аномалии цены за кг по группам ТН ВЭД ---
+# Нормальная цена за кг у товарных групп отличается на порядки (лом и станки),
+# поэтому границы считаются по группе: префикс prod_hsc (и, по желанию, страна
+# происхождения). Статистика группы — гистограмма log10(цены за кг) с фиксированными
+# корзинами: гистограммы складываются и вычитаются, поэтому в delta-режиме сводка
+# обновляется по изменившимся строкам без пересчёта всей истории.
+# Границы — заборы Тьюки по квантилям гистограммы в логарифмической шкале.
+HSC_PREFIX_LEN = 4           # товарная позиция ТН ВЭД
+BY_COUNTRY = False           # дополнительно различать группы по prod_coo
+COUNTRY_COLUMN = 'prod_coo'
+LOG_MIN, LOG_MAX = -4.0, 8.0  # диапазон log10(USD/кг); цены вне него попадают в крайние корзины
+BIN_WIDTH = 0.02             # ≈ 4.7% цены
+NUM_BINS = int(round((LOG_MAX - LOG_MIN) / BIN_WIDTH))
+MIN_GROUP_ROWS = 30          # меньше — границы берутся с более общего уровня
+IQR_FACTOR = 3.0             # «дальние» выбросы
+MIN_LOG_IQR = 0.15           # нижняя граница IQR: однородная группа не бракует соседние цены
+STAT_COLUMNS = ['hsc', 'country', 'bin', 'count']
+NON_DIGIT_RE = re.compile(r'\D')
+
+def group_levels(by_country: bool = BY_COUNTRY) -> list[tuple[int, bool]]:
+    """Уровни групп от частного к общему: (длина префикса prod_hsc, учитывать ли страну)."""
+    levels = [(HSC_PREFIX_LEN, False), (2, False), (0, False)]
+    return [(HSC_PREFIX_LEN, True)] + levels if by_country else levels
+
+def unit_prices(df: pd.DataFrame) -> np.ndarray:
+    """adj_price / adj_netw; NaN, если вес не положительный или значения нет (вместо ±inf)."""
+    price = pd.to_numeric(df['adj_price'], errors='coerce').to_numpy(dtype=float)
+    netw = pd.to_numeric(df['adj_netw'], errors='coerce').to_numpy(dtype=float)
+    result = np.full(len(df), np.nan)
+    np.divide(price, netw, out=result, where=netw > 0)
+    return result
+
+def _hsc_prefix(df: pd.DataFrame) -> pd.Series:
+    """Первые HSC_PREFIX_LEN цифр prod_hsc (по уникальным значениям); пропуск — ''."""
+    if 'prod_hsc' not in df.columns:
+        return pd.Series('', index=df.index, dtype=object)
+    codes, uniques = pd.factorize(df['prod_hsc'])
+    prefixes = np.array([NON_DIGIT_RE.sub('', str(v))[:HSC_PREFIX_LEN] for v in uniques] + [''], dtype=object)
+    return pd.Series(prefixes[codes], index=df.index, dtype=object)
+
+def _country(df: pd.DataFrame, by_country: bool) -> pd.Series:
+    if not by_country or COUNTRY_COLUMN not in df.columns:
+        return pd.Series('', index=df.index, dtype=object)
+    return df[COUNTRY_COLUMN].astype(object).where(df[COUNTRY_COLUMN].notna(), '').astype(str)
+
+def _price_bins(prices: np.ndarray) -> np.ndarray:
+    with np.errstate(divide='ignore', invalid='ignore'):
+        bins = np.floor((np.log10(prices) - LOG_MIN) / BIN_WIDTH)
+    return np.clip(bins, 0, NUM_BINS - 1).astype(np.int64)
+
+def empty_stats() -> pd.DataFrame:
+    return pd.DataFrame({'hsc': pd.Series(dtype=object), 'country': pd.Series(dtype=object),
+                         'bin': pd.Series(dtype=np.int64), 'count': pd.Series(dtype=np.int64)})
+
+def price_histogram(df: pd.DataFrame, by_country: bool = BY_COUNTRY) -> pd.DataFrame:
+    """
+    Сводка цен за кг строк df: число строк в каждой корзине log10(цены) по самой частной
+    группе (hsc, country). Строки без положительной цены за кг не учитываются.
+    Один groupby по строкам; более общие уровни считаются из сводки.
+    """
+    prices = unit_prices(df)
+    valid = prices > 0
+    if not valid.any():
+        return empty_stats()
+    frame = pd.DataFrame({
+        'hsc': _hsc_prefix(df).to_numpy()[valid],
+        'country': _country(df, by_country).to_numpy()[valid],
+        'bin': _price_bins(prices[valid]),
+    })
+    return frame.groupby(['hsc', 'country', 'bin'], sort=True).size().rename('count').reset_index()
+
+def combine_stats(base: pd.DataFrame, added: pd.DataFrame | None = None,
+                  removed: pd.DataFrame | None = None) -> pd.DataFrame:
+    """base + added − removed (по корзинам групп); пустые корзины отбрасываются."""
+    parts = [base]
+    if added is not None:
+        parts.append(added)
+    if removed is not None:
+        parts.append(removed.assign(count=-removed['count']))
+    stats = pd.concat(parts, ignore_index=True).groupby(['hsc', 'country', 'bin'], sort=True)['count'].sum()
+    return stats[stats > 0].reset_index()
+
+def _bin_quantile(stats: pd.DataFrame, keys: list[str], q: float) -> pd.Series:
+    """Квантиль log10(цены) по гистограмме (центр корзины) для каждой группы keys."""
+    cumulative = stats.groupby(keys, sort=False)['count'].cumsum()
+    total = stats.groupby(keys, sort=False)['count'].transform('sum')
+    reached = stats[cumulative >= q * total]
+    bins = reached.groupby(keys, sort=False)['bin'].first()
+    return LOG_MIN + (bins + 0.5) * BIN_WIDTH
+
+def price_bounds(stats: pd.DataFrame, prefix_len: int, by_country: bool) -> pd.DataFrame:
+    """
+    Границы нормальной цены за кг для уровня групп: индекс — (hsc, country) уровня,
+    колонки rows, low, high (USD/кг).
+    """
+    level = stats.assign(
+        hsc=stats['hsc'].str[:prefix_len],
+        country=stats['country'] if by_country else '',
+    ).groupby(['hsc', 'country', 'bin'], sort=True)['count'].sum().reset_index()
+    keys = ['hsc', 'country']
+    q1 = _bin_quantile(level, keys, 0.25)
+    q3 = _bin_quantile(level, keys, 0.75)
+    iqr = np.maximum(q3 - q1, MIN_LOG_IQR)
+    return pd.DataFrame({
+        'rows': level.groupby(keys, sort=False)['count'].sum(),
+        'low': 10 ** (q1 - IQR_FACTOR * iqr),
+        'high': 10 ** (q3 + IQR_FACTOR * iqr),
+    })
+
+def flag_unit_price_anomalies(df: pd.DataFrame, stats: pd.DataFrame, by_country: bool = BY_COUNTRY) -> pd.DataFrame:
+    """
+    Вычисляет цену за кг и помечает записи с нулевой/отрицательной ценой, без веса
+    или с ценой вне границ своей группы ТН ВЭД.
+
+    Добавляет столбцы:
+        - unit_price_kg: цена за кг (NaN, если вес не положительный)
+        - is_valid: True/False — признак валидности
+        - is_valid_reason: причина (если строка невалидна)
+
+    Args:
+        df (pd.DataFrame): DataFrame с полями 'adj_price', 'adj_netw', 'prod_hsc'.
+        stats (pd.DataFrame): сводка price_histogram/combine_stats по всем строкам стадии.
+
+    Returns:
+        pd.DataFrame: DataFrame с новыми флагами и диагностикой.
+    """
+    df = df.copy()
+    prices = unit_prices(df)
+    df['unit_price_kg'] = prices
+
+    hsc = _hsc_prefix(df).to_numpy(dtype=object)
+    country = _country(df, by_country).to_numpy(dtype=object)
+    low = np.full(len(df), np.nan)
+    high = np.full(len(df), np.nan)
+    group = np.full(len(df), '', dtype=object)
+    pending = np.ones(len(df), dtype=bool)
+    levels = group_levels(by_country)
+    for i, (prefix_len, with_country) in enumerate(levels):
+        if not pending.any() or stats.empty:
+            break
+        bounds = price_bounds(stats, prefix_len, with_country)
+        if i < len(levels) - 1:
+            bounds = bounds[bounds['rows'] >= MIN_GROUP_ROWS]
+        keys = pd.MultiIndex.from_arrays([
+            pd.Index(hsc[pending]).str[:prefix_len],
+            country[pending] if with_country else np.full(pending.sum(), '', dtype=object),
+        ])
+        position = bounds.index.get_indexer(keys)
+        found = np.flatnonzero(pending)[position >= 0]
+        position = position[position >= 0]
+        labels = np.array([f"{h or '*'}{'/' + c if c else ''}" for h, c in bounds.index], dtype=object)
+        low[found] = bounds['low'].to_numpy()[position]
+        high[found] = bounds['high'].to_numpy()[position]
+        group[found] = labels[position]
+        pending[found] = False
+
+    price = pd.to_numeric(df['adj_price'], errors='coerce').to_numpy(dtype=float)
+    netw = pd.to_numeric(df['adj_netw'], errors='coerce').to_numpy(dtype=float)
+    no_weight = ~(netw > 0)
+    zero_or_negative = ~no_weight & ~(price > 0)
+    too_low = (prices < low) & ~zero_or_negative
+    too_high = prices > high
+
+    df['is_valid'] = ~(no_weight | zero_or_negative | too_low | too_high)
+
+    # Причины: граница и группа, по которой она посчитана
+    reason = np.full(len(df), '', dtype=object)
+    for mask, sign, bound in [(too_low, '<', low), (too_high, '>', high)]:
+        reason[mask] = [f'unit_price_kg {sign} {b:.3g} ({g})' for b, g in zip(bound[mask], group[mask])]
+    reason[zero_or_negative] = 'unit_price_kg <= 0'
+    reason[no_weight] = 'adj_netw <= 0'
+    df['is_valid_reason'] = reason
+    return df
+
+# --- Сводка на диске ---
+def load_price_stats(path: str, version: str) -> pd.DataFrame | None:
+    """Сохранённая сводка, если она посчитана для той же версии стадии; иначе None."""
+    if not os.path.exists(path) or read_parquet_metadata(path).get(VERSION_KEY) != version:
+        return None
+    return read_parquet_file(path)[STAT_COLUMNS]
+
+def save_price_stats(stats: pd.DataFrame, path: str, version: str):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    save_to_parquet_file(stats[STAT_COLUMNS], path, metadata={VERSION_KEY: version})
@@ -0,0 +1,12 @@
+# utils/stopwords.py
+
+# --- Стоп-слова ---
+# Список русских стоп-слов NLTK хранится в репозитории: загрузка не требует сети
+# и nltk.download при каждом запуске. Файл пересоздаётся скриптом
+# data/utilities/word_tagger/nltk_setup.py.
+STOPWORDS_PATH = 'data/utilities/stopwords_ru.txt'
+
+def load_stopwords(path: str = STOPWORDS_PATH) -> set[str]:
+    """Стоп-слова из файла: по одному на строку, строки с # — комментарии."""
+    with open(path, encoding='utf-8') as f:
+        return {line.strip() for line in f if line.strip() and not line.startswith('#')}
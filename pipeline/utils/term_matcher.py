@@ -0,0 +1,69 @@
+# utils/term_matcher.py
+
+import re
+
+WORD_TAIL_RE = re.compile(r'\w*')
+_END = ''  # метка конца термина в узле префиксного дерева (символом быть не может)
+
+def _is_word(ch: str) -> bool:
+    # то же, что \w в re для str
+    return ch.isalnum() or ch == '_'
+
+class PrefixTermMatcher:
+    """
+    Поиск всех терминов словаря в тексте за один проход — эквивалент
+    re.finditer(rf"\\b{re.escape(term)}\\w*\\b", text) для каждого термина.
+
+    Термины хранятся в префиксном дереве. Одна скомпилированная регулярка
+    находит границы слов, с которых может начинаться термин; от каждой такой
+    позиции дерево проходится по символам текста, и собираются все термины,
+    заканчивающиеся на пути (термин — префикс слова, как в term\\w*).
+
+    Пример:
+        matcher = PrefixTermMatcher(rejected)
+        spans = matcher.find(text)  # {термин: [(start, end), ...]}
+    """
+
+    def __init__(self, terms):
+        self.terms = sorted({term for term in terms if term})
+        self._trie = {}
+        for term in self.terms:
+            node = self._trie
+            for ch in term:
+                node = node.setdefault(ch, {})
+            node[_END] = term
+        first_chars = ''.join(sorted(self._trie))
+        self._starts = re.compile(r'\b(?=[' + re.escape(first_chars) + '])') if first_chars else None
+
+    def find(self, text: str) -> dict[str, list[tuple[int, int]]]:
+        """
+        Все вхождения терминов: {термин: [(start, end), ...]}.
+        Спаны совпадают с m.span() для rf"\\b{term}\\w*\\b" (вхождения одного термина не пересекаются).
+        """
+        found = {}
+        if self._starts is None or not isinstance(text, str):
+            return found
+        n = len(text)
+        for m in self._starts.finditer(text):
+            start = i = m.start()
+            node = self._trie
+            while i < n:
+                node = node.get(text[i])
+                if node is None:
+                    break
+                i += 1
+                term = node.get(_END)
+                if term is None:
+                    continue
+                end = WORD_TAIL_RE.match(text, i).end()
+                # \b после term\w*: выполняется всегда, если хвост непустой
+                if end == i and _is_word(text[i - 1]) == (i < n and _is_word(text[i])):
+                    continue
+                spans = found.setdefault(term, [])
+                if not spans or start >= spans[-1][1]:
+                    spans.append((start, end))
+        return found
+
+    def search(self, text: str) -> set[str]:
+        """Термины, встречающиеся в тексте."""
+        return set(self.find(text))
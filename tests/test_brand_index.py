@@ -0,0 +1,80 @@
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT / "pipeline"))
+from utils import brand_index
+from utils.brand_index import FUZZY_MIN_ALIAS_LEN, BrandIndex, FuzzyBrandMatcher, load_brand_aliases
+
+DICT_PATH = REPO_ROOT / "data" / "utilities" / "dict_brand.csv"
+# Решения thefuzz.process.extractOne(token, алиасы, score_cutoff=get_adaptive_threshold(token))
+# по словарю dict_brand.csv: алиасы, их опечатки, усечения и суффиксы, случайные токены
+FUZZY_GOLDEN_PATH = REPO_ROOT / "tests" / "fixtures" / "step4_fuzzy_golden.json"
+# Результаты цикла по алиасам с re.search(r'\b' + re.escape(word) + r'\b', val) для каждого слова
+# (step4 до BrandIndex): match — найденные бренды по текстам (алиасы в тексте, с соседними
+# буквами и знаками, многословные алиасы врозь и вразбивку, несколько алиасов сразу);
+# rows — точная ветка extract_brand_from_row по четырем полям, включая «смешанный»
+EXACT_GOLDEN_PATH = REPO_ROOT / "tests" / "fixtures" / "step4_exact_golden.json"
+
+@pytest.fixture(scope="module")
+def aliases():
+    return load_brand_aliases(str(DICT_PATH))
+
+def get_adaptive_threshold(token: str) -> int:
+    # порог, с которым step4 вызывал extractOne до перехода на rapidfuzz
+    length = len(token)
+    if length <= 3:
+        return 100
+    elif length <= 5:
+        return 97
+    elif length <= 7:
+        return 95
+    else:
+        return 90
+
+def test_fuzzy_matcher_matches_golden(aliases):
+    expected = json.loads(FUZZY_GOLDEN_PATH.read_text(encoding="utf-8"))
+    matcher = FuzzyBrandMatcher(aliases[1])
+    assert matcher.match_tokens(list(expected)) == expected
+
+def test_fuzzy_matcher_matches_extract_one(aliases, monkeypatch):
+    fuzz_process = pytest.importorskip("thefuzz.process")
+    fuzzy_aliases = aliases[1]
+    keys = [alias for alias in fuzzy_aliases if len(alias) >= FUZZY_MIN_ALIAS_LEN]
+    tokens = list(json.loads(FUZZY_GOLDEN_PATH.read_text(encoding="utf-8")))
+    expected = {}
+    for token in tokens:
+        result = fuzz_process.extractOne(token, keys, score_cutoff=get_adaptive_threshold(token))
+        expected[token] = fuzzy_aliases[result[0]] if result else None
+    # несколько батчей cdist и повторный вызов с частью токенов уже в кэше
+    monkeypatch.setattr(brand_index, "FUZZY_BATCH", 64)
+    matcher = FuzzyBrandMatcher(fuzzy_aliases, workers=1)
+    assert matcher.match_tokens(tokens[:100]) == {token: expected[token] for token in tokens[:100]}
+    assert matcher.match_tokens(tokens) == expected
+
+@pytest.fixture(scope="module")
+def exact_golden():
+    return json.loads(EXACT_GOLDEN_PATH.read_text(encoding="utf-8"))
+
+def test_brand_index_matches_golden(aliases, exact_golden):
+    index = BrandIndex(aliases[0])
+    for case in exact_golden["match"]:
+        assert sorted(index.match(case["text"].lower()[:1000])) == case["brands"], case["text"]
+
+def test_golden_covers_multi_word_and_mixed(exact_golden):
+    multi_word = [case for case in exact_golden["match"] if " " in case["text"] and case["brands"]]
+    mixed = [case for case in exact_golden["rows"] if case["expected"] and case["expected"][0] == "смешанный"]
+    assert multi_word and mixed
+
+def test_exact_branch_matches_golden(aliases, exact_golden):
+    pytest.importorskip("psutil")
+    import step4_brand_extraction as step4
+
+    index = BrandIndex(aliases[0])
+    for case in exact_golden["rows"]:
+        # нечеткая ветка отключена (пустой словарь токенов): строки без точного совпадения — «не определено»
+        expected = tuple(case["expected"]) if case["expected"] else (step4.UNDEFINED_BRAND, [], "")
+        assert step4.extract_brand_from_row(case["row"], index, {}) == expected, case["row"]
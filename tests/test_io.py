@@ -0,0 +1,27 @@
+import sys
+from pathlib import Path
+
+import pandas as pd
+from openpyxl import Workbook
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT / "pipeline"))
+from utils.io import iter_excel_batches
+
+def write_xlsx(path: Path, rows: list[list]):
+    wb = Workbook()
+    for row in rows:
+        wb.active.append(row)
+    wb.save(path)
+
+def test_duplicated_header_takes_first_column(tmp_path):
+    path = tmp_path / "dup.xlsx"
+    write_xlsx(path, [["NAME", "QTY", "NAME"], ["first", 1, "second"]])
+    df = pd.concat(iter_excel_batches(path, columns=["NAME", "QTY"]))
+    assert list(df["NAME"]) == ["first"]
+
+def test_all_columns_keep_duplicated_header(tmp_path):
+    path = tmp_path / "dup.xlsx"
+    write_xlsx(path, [["NAME", "QTY", "NAME"], ["first", 1, "second"]])
+    df = pd.concat(iter_excel_batches(path))
+    assert df.values.tolist() == [["first", 1, "second"]]
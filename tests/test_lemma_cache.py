@@ -0,0 +1,56 @@
+import sqlite3
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT / "pipeline"))
+from utils.lemma_cache import LemmaCache
+
+class UpperMorph:
+    """Вместо pymorphy2: «лемма» — токен в верхнем регистре, вызовы считаются."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def parse(self, token):
+        self.calls += 1
+        return [SimpleNamespace(normal_form=token.upper())]
+
+def stored(path) -> dict:
+    with sqlite3.connect(path) as db:
+        return dict(db.execute("SELECT token, lemma FROM lemmas"))
+
+def test_readonly_cache_does_not_write(tmp_path):
+    path = str(tmp_path / "lemmas.sqlite")
+    parent = LemmaCache(UpperMorph(), path=path)
+    worker = LemmaCache(UpperMorph(), path=path, readonly=True)
+    assert worker.lemma("кот") == "КОТ"
+    worker.flush()
+    assert stored(path) == {}
+    # воркер отдаёт новые леммы, родитель записывает их одной транзакцией
+    new = worker.take_new()
+    assert new == {"кот": "КОТ"} and worker.take_new() == {}
+    parent.add_new(new)
+    assert stored(path) == {"кот": "КОТ"}
+    parent.close()
+    worker.close()
+
+def test_readonly_cache_reads_parent_writes(tmp_path):
+    path = str(tmp_path / "lemmas.sqlite")
+    parent = LemmaCache(UpperMorph(), path=path)
+    parent.add_new({"пёс": "ПЁС"})
+    morph = UpperMorph()
+    worker = LemmaCache(morph, path=path, readonly=True)
+    assert worker.lemma("пёс") == "ПЁС"
+    assert morph.calls == 0 and worker.disk_hits == 1
+    parent.close()
+    worker.close()
+
+def test_readonly_cache_without_file(tmp_path):
+    path = tmp_path / "lemmas.sqlite"
+    worker = LemmaCache(UpperMorph(), path=str(path), readonly=True)
+    assert worker.lemma("кот") == "КОТ"
+    assert worker.take_new() == {"кот": "КОТ"}
+    worker.close()
+    assert not path.exists()
@@ -0,0 +1,104 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+from openpyxl import Workbook
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT / "pipeline"))
+import step0_merger_atlas as step0
+
+HEADER = ["NO", "EXPORTER COUNTRY", "QTY", "NAME"]
+
+def write_atlas(path: Path, rows: list[list]):
+    """Выгрузка Atlas: служебная первая строка, затем заголовок и данные."""
+    wb = Workbook()
+    ws = wb.active
+    ws.append(["Atlas export"])
+    ws.append(HEADER)
+    for row in rows:
+        ws.append(row)
+    wb.save(path)
+
+@pytest.fixture
+def atlas_dirs(tmp_path, monkeypatch):
+    monkeypatch.setattr(step0, "FOLDER_PATH", str(tmp_path / "atlas"))
+    monkeypatch.setattr(step0, "OUTPUT_DIR", str(tmp_path / "atlas.parquet"))
+    monkeypatch.setattr(step0, "DUPLICATES_DIR", str(tmp_path / "atlas_duplicates.parquet"))
+    monkeypatch.setattr(step0, "STATE_DIR", str(tmp_path / "state"))
+    monkeypatch.setattr(step0, "HASHES_DIR", str(tmp_path / "state" / "row_hashes"))
+    monkeypatch.setattr(step0, "MERGED_FILES_PATH", str(tmp_path / "state" / "merged_files.json"))
+    (tmp_path / "atlas").mkdir()
+    return tmp_path
+
+def read_dir(path) -> pd.DataFrame:
+    return pd.concat(step0.iter_parquet_batches(path, 1_000), ignore_index=True)
+
+def test_row_hash_does_not_depend_on_batch_dtypes():
+    int_batch = pd.DataFrame({"QTY": [1, 2], "NAME": ["a", "b"]})
+    float_batch = pd.DataFrame({"QTY": [1, np.nan], "NAME": ["a", "c"]})
+    assert int_batch["QTY"].dtype == np.int64 and float_batch["QTY"].dtype == np.float64
+    assert step0.row_hashes(int_batch)[0] == step0.row_hashes(float_batch)[0]
+
+def test_duplicates_across_batches_with_different_dtypes(atlas_dirs, monkeypatch):
+    monkeypatch.setattr(step0, "BATCH_SIZE", 2)
+    # второй батч: QTY с пропуском читается как float64, первый — как int64
+    write_atlas(atlas_dirs / "atlas" / "a.xlsx", [
+        [1, "China", 1, "a"],
+        [2, "China", 2, "b"],
+        [3, "China", 1, "a"],
+        [4, "China", None, "c"],
+    ])
+    step0.main()
+    data = read_dir(step0.OUTPUT_DIR)
+    dups = read_dir(step0.DUPLICATES_DIR)
+    assert sorted(data["NO"]) == [1, 2, 4]
+    assert list(dups["NO"]) == [3]
+
+def test_duplicates_across_files(atlas_dirs):
+    write_atlas(atlas_dirs / "atlas" / "a.xlsx", [[1, "China", 1, "a"], [2, "China", 2, "b"]])
+    write_atlas(atlas_dirs / "atlas" / "b.xlsx", [[1, "China", 1.0, "a"], [2, "China", None, "c"]])
+    step0.main()
+    assert len(read_dir(step0.OUTPUT_DIR)) == 3
+    assert list(read_dir(step0.DUPLICATES_DIR)["source_file"]) == ["b.xlsx"]
+
+def test_changed_file_replaces_its_previous_rows(atlas_dirs):
+    path = atlas_dirs / "atlas" / "a.xlsx"
+    write_atlas(path, [[1, "China", 1, "a"], [2, "China", 2, "b"]])
+    step0.main()
+    write_atlas(path, [[1, "China", 1, "a"], [3, "China", 3, "c"]])
+    step0.main()
+    data = read_dir(step0.OUTPUT_DIR)
+    assert sorted(data["NAME"]) == ["a", "c"]
+    assert not Path(step0.DUPLICATES_DIR).exists() or not list(Path(step0.DUPLICATES_DIR).iterdir())
+    known = step0.load_known(step0.load_merged())
+    assert np.array_equal(known, np.sort(data[step0.HASH_COLUMN].to_numpy(dtype=np.uint64)))
+
+def test_changed_file_readmits_rows_dropped_as_its_duplicates(atlas_dirs):
+    path_a = atlas_dirs / "atlas" / "a.xlsx"
+    write_atlas(path_a, [[1, "China", 1, "a"], [2, "China", 2, "b"]])
+    write_atlas(atlas_dirs / "atlas" / "b.xlsx", [[1, "China", 1, "a"], [2, "China", 1, "a"], [3, "China", 3, "c"]])
+    step0.main()
+    assert len(read_dir(step0.DUPLICATES_DIR)) == 2
+
+    # новая версия a.xlsx не содержит строку "a": её первый дубликат из b.xlsx возвращается
+    write_atlas(path_a, [[2, "China", 2, "b"]])
+    step0.main()
+    data = read_dir(step0.OUTPUT_DIR)
+    assert sorted(zip(data["source_file"], data["NAME"])) == [("a.xlsx", "b"), ("b.xlsx", "a"), ("b.xlsx", "c")]
+    dups = read_dir(step0.DUPLICATES_DIR)
+    assert list(zip(dups["source_file"], dups["NO"])) == [("b.xlsx", 2)]
+    merged = step0.load_merged()
+    assert merged["b.xlsx"]["rows"] == 2 and merged["b.xlsx"]["duplicates"] == 1
+    known = step0.load_known(merged)
+    assert np.array_equal(known, np.sort(data[step0.HASH_COLUMN].to_numpy(dtype=np.uint64)))
+
+def test_state_is_kept_per_file(atlas_dirs):
+    write_atlas(atlas_dirs / "atlas" / "a.xlsx", [[1, "China", 1, "a"]])
+    step0.main()
+    write_atlas(atlas_dirs / "atlas" / "b.xlsx", [[1, "China", 2, "b"]])
+    step0.main()
+    assert sorted(p.name for p in Path(step0.HASHES_DIR).iterdir()) == ["000000.npy", "000001.npy"]
+    assert len(step0.load_file_hashes(1)) == 1
@@ -0,0 +1,31 @@
+import json
+import sys
+from pathlib import Path
+
+import pandas as pd
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT / "pipeline"))
+from utils.normalization_utils import CompanyNormalizer
+
+# (ОПФ, нормализованное название) от normalize_company до CompanyNormalizer: названия
+# из блеклиста и сочетания названий с ОПФ (до/после, в кавычках, склеенные),
+# ключевыми словами «по поручению»/«через»/«by order», лишними пробелами и знаками
+GOLDEN_PATH = REPO_ROOT / "tests" / "fixtures" / "step1_company_names_golden.json"
+GOLDEN = json.loads(GOLDEN_PATH.read_text(encoding="utf-8"))
+
+def test_normalize_series_matches_golden():
+    names = pd.Series([case["name"] for case in GOLDEN] + [None])
+    opfs, normalized = CompanyNormalizer().normalize_series(names)
+    assert list(zip(opfs[:-1], normalized[:-1])) == [(case["opf"], case["normalized"]) for case in GOLDEN]
+    assert opfs[-1] is None and normalized[-1] is None
+
+def test_normalize_series_repeats_and_cache():
+    normalizer = CompanyNormalizer()
+    names = pd.Series([case["name"] for case in GOLDEN[:50]] * 3)
+    first = normalizer.normalize_series(names)
+    # второй вызов берёт результаты из кэша по исходному названию
+    second = normalizer.normalize_series(names)
+    for expected, result in zip(first, second):
+        assert list(expected) == list(result)
+    assert list(first[1][:50]) == [case["normalized"] for case in GOLDEN[:50]]
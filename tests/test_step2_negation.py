@@ -0,0 +1,47 @@
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT / "pipeline"))
+pytest.importorskip("pymorphy2")
+import step2_tagging as step2
+from utils.normalization_utils import normalize_confusables
+from utils.term_matcher import PrefixTermMatcher
+
+# Результаты построчной проверки отрицаний (шаблоны NEG_1…NEG_10 компилировались для каждого
+# термина, предложение токенизировалось для каждого вхождения), зафиксированные до перехода
+# на NegationIndex: правила по отдельности и случайные тексты из слов-отрицаний и терминов.
+GOLDEN_PATH = REPO_ROOT / "tests" / "fixtures" / "step2_negation_golden.json"
+GOLDEN = json.loads(GOLDEN_PATH.read_text(encoding="utf-8"))
+
+def as_columns(res: dict) -> dict:
+    return {
+        "matched_rejected": res["rejected_pos"],
+        "matched_rejected_negated": res["rejected_neg"],
+        "negation_triggers": res["triggers"],
+    }
+
+def expected(case: dict) -> dict:
+    return {key: case[key] for key in ("matched_rejected", "matched_rejected_negated", "negation_triggers")}
+
+@pytest.mark.parametrize("case", GOLDEN, ids=[case["name"] for case in GOLDEN])
+def test_negation_matches_golden(case):
+    res = step2.filter_rejected_with_negation(case["text"], case["terms"])
+    assert as_columns(res) == expected(case)
+
+@pytest.mark.parametrize("case", GOLDEN, ids=[case["name"] for case in GOLDEN])
+def test_negation_with_matcher_occurrences_matches_golden(case):
+    # как в Tagger.classify: вхождения находит PrefixTermMatcher, нормализация передаётся готовой
+    normalized = normalize_confusables(case["text"])
+    occurrences = PrefixTermMatcher(case["terms"]).find(normalized.lower())
+    res = step2.filter_rejected_with_negation(case["text"], case["terms"], occurrences, normalized)
+    assert as_columns(res) == expected(case)
+
+def test_golden_covers_every_rule():
+    triggers = {trigger.rsplit(":", 1)[1] for case in GOLDEN for trigger in case["negation_triggers"]}
+    # NEG_2 и NEG_6 — частные случаи NEG_1 и NEG_4, которые проверяются раньше
+    rules = {f"NEG_{i}" for i in range(1, 11)} - {"NEG_2", "NEG_6"}
+    assert rules | {"NEG_FALLBACK_LEFT_NEGATOR", "NEG_FALLBACK_EXCEPTION"} <= triggers
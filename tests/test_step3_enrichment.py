@@ -0,0 +1,59 @@
+import sys
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT / "pipeline"))
+import step3_enrichment as step3
+
+FIXTURES = REPO_ROOT / "tests" / "fixtures"
+# Строки деклараций: повторы позиций (пропуски и нули в количестве, цене и весе,
+# пропуск importer_name в ключе группы), строки групп вперемешку
+DECL_INPUT_PATH = FIXTURES / "step3_decl_input.parquet"
+# Результат enrich_decl_duplicates до векторизации (groupby + merge + построчный apply)
+DECL_EXPECTED_PATH = FIXTURES / "step3_decl_duplicates_expected.parquet"
+# Блеклист (cp1251, ';'): повтор названия, тип в разном регистре, неизвестный тип, пустые
+# название/тип/причина, одно название в обеих ролях; строки — импортёры и экспортёры из него
+BLACKLIST_PATH = FIXTURES / "step3_blacklist.csv"
+BLACKLIST_INPUT_PATH = FIXTURES / "step3_blacklist_input.parquet"
+# Результат цикла iterrows по строкам блеклиста (маска на каждую запись) до перехода на индекс
+BLACKLIST_EXPECTED_PATH = FIXTURES / "step3_blacklist_expected.parquet"
+
+@pytest.fixture
+def repo_cwd(monkeypatch):
+    # справочники (страны, блеклист) читаются по путям от корня репозитория
+    monkeypatch.chdir(REPO_ROOT)
+
+def test_enrich_decl_duplicates_matches_golden():
+    df = pd.read_parquet(DECL_INPUT_PATH)
+    expected = pd.read_parquet(DECL_EXPECTED_PATH)
+    pd.testing.assert_frame_equal(step3.enrich_decl_duplicates(df), expected, check_exact=True)
+
+def test_partitioned_enrichment_keeps_row_order(tmp_path, repo_cwd):
+    path = tmp_path / "st2.parquet"
+    pd.read_parquet(DECL_INPUT_PATH).to_parquet(path, index=False)
+    expected = step3.enrich_rows(step3.read_stage(path))
+    result = step3.enrich_rows_partitioned(str(path), partitions=4)
+    pd.testing.assert_frame_equal(result, expected, check_exact=True)
+
+def test_apply_manual_blacklist_matches_golden():
+    df = pd.read_parquet(BLACKLIST_INPUT_PATH)
+    expected = pd.read_parquet(BLACKLIST_EXPECTED_PATH)
+    # пустая причина: прежний цикл записывал NaN, индекс пишет "" (как у строк вне блеклиста)
+    expected["blacklist_reason"] = expected["blacklist_reason"].fillna("")
+    result = step3.apply_manual_blacklist(df, str(BLACKLIST_PATH))
+    pd.testing.assert_frame_equal(result, expected)
+
+def test_blacklist_matches_normalized_names():
+    from utils.normalization_utils import CompanyNormalizer
+
+    normalizer = CompanyNormalizer()
+    # в стадии названия уже нормализованы step1, в блеклисте — записаны как есть
+    _, names = normalizer.normalize_series(pd.Series(['ООО "РОМАШКА"', "ACME LTD", "ООО ТЕХНО"]))
+    df = pd.DataFrame({"importer_name": [names[0], names[2]], "exporter_name": [names[1], None]})
+    result = step3.apply_manual_blacklist(df, str(BLACKLIST_PATH), normalizer)
+    assert list(result["is_blacklisted_manual"]) == [True, False]
+    # «ACME LTD» и «acme ltd» нормализуются одинаково: причина — из последней по файлу записи
+    assert result["blacklist_reason"].iloc[0] == "другой регистр"
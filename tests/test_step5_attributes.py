@@ -0,0 +1,27 @@
+import sys
+from pathlib import Path
+
+import pandas as pd
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT / "pipeline"))
+import step5_attribute_extraction as step5
+
+FIXTURES = REPO_ROOT / "tests" / "fixtures"
+# Описания: каждый синоним словарей в тексте, в верхнем регистре и внутри слова; каждый
+# ключ DN/PN с разными разделителями перед числом; случайные сочетания нескольких
+# значений одного атрибута (приоритет), пропуски и повторы
+INPUT_PATH = FIXTURES / "step5_details_input.parquet"
+# Результат построчных parse_numeric_attribute/parse_from_patterns (отдельный .apply на атрибут)
+EXPECTED_PATH = FIXTURES / "step5_attributes_expected.parquet"
+
+def as_list(values: pd.Series) -> list:
+    # пропуск — None (в Parquet строковая колонка может прочитаться со своим NA)
+    return [value if isinstance(value, str) else None for value in values]
+
+def test_extract_attributes_matches_golden():
+    df = pd.read_parquet(INPUT_PATH)
+    expected = pd.read_parquet(EXPECTED_PATH)
+    result = step5.extract_attributes(df)
+    for column in step5.ATTRIBUTE_COLUMNS:
+        assert as_list(result[column]) == as_list(expected[column]), column
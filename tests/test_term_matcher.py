@@ -0,0 +1,34 @@
+import json
+import re
+import sys
+from pathlib import Path
+
+import pandas as pd
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT / "pipeline"))
+from utils.term_matcher import PrefixTermMatcher
+
+TAGS_PATH = REPO_ROOT / "data" / "utilities" / "word_tagger" / "tagged_words.csv"
+NEGATION_GOLDEN_PATH = REPO_ROOT / "tests" / "fixtures" / "step2_negation_golden.json"
+
+def regex_occurrences(text: str, patterns: dict) -> dict:
+    # поиск rejected-терминов в classify_text до PrefixTermMatcher: регулярка на каждый термин
+    found = {}
+    for term, rx in patterns.items():
+        spans = [m.span() for m in rx.finditer(text)]
+        if spans:
+            found[term] = spans
+    return found
+
+def test_find_matches_per_term_regex():
+    tags = pd.read_csv(TAGS_PATH)
+    rejected = set(tags[tags["tag"] == "rejected"]["word"].str.lower())
+    matcher = PrefixTermMatcher(rejected)
+    patterns = {term: re.compile(rf"\b{re.escape(term)}\w*\b") for term in rejected}
+    texts = [case["text"].lower() for case in json.loads(NEGATION_GOLDEN_PATH.read_text(encoding="utf-8"))]
+    # термины словаря в тексте, внутри слов, с хвостами, дефисами, цифрами и подчёркиваниями
+    terms = sorted(rejected)[::7]
+    texts += [" ".join(terms), "-".join(terms), "_".join(terms), "x".join(terms), " 1".join(terms)]
+    for text in texts:
+        assert matcher.find(text) == regex_occurrences(text, patterns), text